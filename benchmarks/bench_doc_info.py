@@ -0,0 +1,97 @@
+"""
+bench_doc_info.py
+
+Micro benchmark of the document info extraction on the saved view pages in
+fixtures/. Compares the separate searches of the check_* and find_* functions
+against DocumentInfoParser, given the whole html at once and fed in the
+pieces the scraper reads it in. Then compares the size of the info the
+scraper used to keep, a dict with the whole html, with DocumentInfo.
+
+    python benchmarks/bench_doc_info.py [-n NUMBER]
+"""
+import os
+import sys
+import json
+import pickle
+import timeit
+
+__root_location__ = os.path.realpath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(__root_location__, '..'))
+
+from docsend_scraper import doc_info
+from docsend_scraper.models import DocumentInfo
+from docsend_scraper.scraper import HTML_CHUNK_SIZE
+
+FIXTURES_FOLDER = os.path.join(__root_location__, 'fixtures')
+
+
+def separate_searches(document_html):
+    return {
+        'email_required': doc_info.check_email_required(document_html),
+        'passcode_required': doc_info.check_passcode_required(document_html),
+        'page_count': doc_info.find_page_count(document_html),
+        'authenticity_token': doc_info.find_auth_token(document_html),
+    }
+
+
+def single_pass(document_html):
+    return doc_info.parse_document_info(document_html)
+
+
+def streamed(document_html):
+    parser = doc_info.DocumentInfoParser()
+    for start in range(0, len(document_html), HTML_CHUNK_SIZE):
+        parser.feed(document_html[start:start + HTML_CHUNK_SIZE])
+    return parser.close()
+
+
+def read_fixtures():
+    for name in sorted(os.listdir(FIXTURES_FOLDER)):
+        if name.endswith('.html'):
+            with open(os.path.join(FIXTURES_FOLDER, name), 'r') as f:
+                yield name, f.read()
+
+
+def info_sizes(name, document_html):
+    """
+    Prints the bytes of the info of a fixture as json, as the web app
+    stores it, and pickled, as it is sent to another process.
+    """
+    # Like the cookies and expiry a real view page sets
+    session = {
+        'cookies': {'_v_': 'v' * 32, '_dss_': 's' * 120},
+        'cookies_expire': 1700000000.0,
+        'is_valid': True,
+    }
+    doc_id = os.path.splitext(name)[0]
+    url = doc_info.get_url_from_id(doc_id)
+    fields = doc_info.parse_document_info(document_html)
+    old = dict(fields, id=doc_id, url=url, html=document_html, **session)
+    new = DocumentInfo(id=doc_id, url=url, **fields, **session)
+    for kind, info in (('dict', old), ('DocumentInfo', new)):
+        data = info if isinstance(info, dict) else info.to_dict()
+        print(f'{name:16}{kind:20}{len(json.dumps(data)):>10}'
+              f'{len(pickle.dumps(info)):>10}')
+
+
+def main(number):
+    print(f'{"fixture":16}{"method":20}{"usec":>10}')
+    for name, document_html in read_fixtures():
+        expected = separate_searches(document_html)
+        for fn in (separate_searches, single_pass, streamed):
+            assert fn(document_html) == expected, (name, fn.__name__)
+            seconds = min(timeit.repeat(lambda: fn(document_html),
+                                        number=number, repeat=5))
+            print(f'{name:16}{fn.__name__:20}'
+                  f'{seconds / number * 1e6:>10.1f}')
+    print()
+    print(f'{"fixture":16}{"info":20}{"json B":>10}{"pickle B":>10}')
+    for name, document_html in read_fixtures():
+        info_sizes(name, document_html)
+
+
+if __name__ == '__main__':
+    number = 200
+    if '-n' in sys.argv:
+        number = int(sys.argv[sys.argv.index('-n') + 1])
+    main(number)
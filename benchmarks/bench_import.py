@@ -0,0 +1,80 @@
+"""
+bench_import.py
+
+Start-up cost of the package. Every statement runs in a fresh interpreter,
+like a CLI run, a serverless cold start or a spawned worker, and the median
+milliseconds it took are reported with the heavy dependencies it loaded.
+
+The light statements only need doc_info, so they must not load any of the
+heavy dependencies; the script exits with status 1 when one does.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --runs 20
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from harness import REPO_ROOT
+
+HEAVY_MODULES = ('aiohttp', 'requests', 'PIL', 'reportlab')
+
+# Name, statement and whether it has to stay clear of HEAVY_MODULES
+STATEMENTS = (
+    ('import', 'import docsend_scraper', True),
+    ('get_id_from_url',
+     'import docsend_scraper\n'
+     'docsend_scraper.get_id_from_url("https://docsend.com/view/abc")',
+     True),
+    ('scraper', 'import docsend_scraper\ndocsend_scraper.DocsendClient',
+     False),
+    ('cli', 'import docsend_scraper.batch', False),
+)
+
+# Runs a statement and prints what it took and loaded as json
+TIMER = '''
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+exec({statement!r})
+ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{'ms': ms, 'loaded': [name for name in {heavy!r}
+                                        if name in sys.modules]}}))
+'''
+
+
+def time_statement(statement):
+    """
+    :returns: (dict) milliseconds the statement took in a fresh interpreter
+                and the heavy modules it loaded
+    """
+    code = TIMER.format(root=REPO_ROOT, statement=statement,
+                        heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='fresh interpreters per statement')
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f'{"statement":<18}{"median ms":>10}{"max ms":>10}  loaded')
+    for name, statement, light in STATEMENTS:
+        results = [time_statement(statement) for _ in range(args.runs)]
+        times = [result['ms'] for result in results]
+        loaded = results[-1]['loaded']
+        print(f'{name:<18}{statistics.median(times):>10.1f}'
+              f'{max(times):>10.1f}  {", ".join(loaded) or "-"}')
+        failed = failed or (light and bool(loaded))
+    if failed:
+        print('A light statement loaded a heavy dependency')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
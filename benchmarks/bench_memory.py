@@ -0,0 +1,206 @@
+"""
+bench_memory.py
+
+Peak memory of downloading a large deck of high resolution pages, with the
+default pipeline and in the low memory mode. Every run is a process of its
+own, so its peak RSS only counts that download.
+
+The pages are WEBP, which has to be decoded to go in a pdf, like the high
+resolution decks that used to run containers out of memory. The default
+pipeline decodes every page fetched ahead at once, the low memory mode keeps
+all but max_memory bytes of them on disk and decodes one at a time.
+
+What a low memory run may add is measured, not estimated: a floor run with a
+max_memory of 1 byte keeps every page on disk, so its peak is the interpreter,
+the modules loaded by the download, the pages still downloading and the
+decoder, which alone peaks at several times the pixels of a page. Where the
+allocator puts the buffers of the decoder changes the peak by tens of MB from
+one run to the next, so every setting is run several times and medians are
+compared. The script exits with status 1 when the median a low memory run
+added is over the median of the floor, its max_memory and the pixels of one
+more decoded page.
+
+The runs set MALLOC_MMAP_THRESHOLD_, as the low memory mode docs advise, so
+glibc gives the decoder buffers back. --mmap-threshold 0 leaves glibc as it
+is, and the memory the decoder thread keeps then changes by tens of MB from
+one run to the next.
+
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --pages 400 --max-memory 16M 64M
+    python benchmarks/bench_memory.py --runs 5
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from harness import free_port, wait_for_port, use_mock, peak_rss_mb, \
+    REPO_ROOT
+
+
+def reset_peak():
+    """
+    Makes the peak RSS of this process start again from its current RSS.
+    Only Linux allows it, elsewhere the peak is the one since start up.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_mb():
+    """
+    :returns: (float) peak RSS of this process in MB. On Linux it is VmHWM,
+                since ru_maxrss keeps the RSS the parent process had when it
+                forked, which would hide what the download added.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def child(base_url, pages, reorder_buffer, max_memory, result_file):
+    use_mock(base_url)
+    import docsend_scraper
+    from docsend_scraper import spill
+
+    async def run(output_dir):
+        async with docsend_scraper.DocsendClient() as client:
+            doc_info = await docsend_scraper.gather_document_info(
+                f'memory-p{pages}', client)
+            reset_peak()
+            base_mb = peak_mb()
+            start = time.perf_counter()
+            await docsend_scraper.download_docsend_file(
+                doc_info, output_path=output_dir, client=client,
+                reorder_buffer=reorder_buffer or None,
+                max_memory=spill.parse_size(max_memory))
+            return base_mb, time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory(prefix='docsend-memory-') as output:
+        base_mb, seconds = asyncio.run(run(output))
+    with open(result_file, 'w') as f:
+        json.dump({'base_mb': base_mb, 'peak_mb': peak_mb(),
+                   'seconds': seconds}, f)
+
+
+def run(base_url, pages, reorder_buffer, max_memory, mmap_threshold=0):
+    env = dict(os.environ)
+    if mmap_threshold:
+        env['MALLOC_MMAP_THRESHOLD_'] = str(mmap_threshold)
+    with tempfile.NamedTemporaryFile(suffix='.json') as result:
+        subprocess.run([sys.executable, __file__, '--child', base_url,
+                        str(pages), str(reorder_buffer), max_memory,
+                        result.name], check=True, env=env)
+        with open(result.name, 'r') as f:
+            return json.load(f)
+
+
+def run_many(base_url, pages, reorder_buffer, max_memory, runs,
+             mmap_threshold):
+    """
+    :returns: (dict) median seconds, and median and max MB added of the
+                runs
+    """
+    results = [run(base_url, pages, reorder_buffer, max_memory,
+                   mmap_threshold) for _ in range(runs)]
+    added = [result['peak_mb'] - result['base_mb'] for result in results]
+    return {
+        'seconds': statistics.median(result['seconds']
+                                     for result in results),
+        'added': statistics.median(added), 'max_added': max(added),
+    }
+
+
+def report(max_memory, result, ceiling=None):
+    """
+    Prints the runs of a setting.
+
+    :returns: (float) median MB the runs added
+    """
+    ceiling = '-' if ceiling is None else f'{ceiling:.1f}'
+    print(f'{max_memory:>12}{result["seconds"]:>10.2f}'
+          f'{result["added"]:>10.1f}{result["max_added"]:>10.1f}'
+          f'{ceiling:>12}')
+    return result['added']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--image-size', default='3200x1800')
+    parser.add_argument('--image-format', default='WEBP')
+    parser.add_argument('--reorder-buffer', type=int, default=0,
+                        help='pages fetched ahead. Defaults to the config.')
+    parser.add_argument('--max-memory', nargs='+', default=['16M'],
+                        help='max_memory of the low memory runs')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='runs of each setting')
+    parser.add_argument('--mmap-threshold', default='1M',
+                        help='MALLOC_MMAP_THRESHOLD_ of the runs, 0 for '
+                             'none')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    import docsend_scraper
+    from docsend_scraper import spill
+    reorder_buffer = args.reorder_buffer or docsend_scraper.REORDER_BUFFER
+    mmap_threshold = spill.parse_size(args.mmap_threshold)
+    width, height = (int(n) for n in args.image_size.split('x'))
+    # WEBP pages are decoded to RGBA
+    decoded_mb = width * height * 4 / 1024 / 1024
+    mock_port = free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__),
+                                      'mock_server.py'),
+         '--port', str(mock_port), '--pages', str(args.pages),
+         '--image-size', args.image_size, '--image-format',
+         args.image_format, '--latency', '0.005'])
+    base_url = f'http://127.0.0.1:{mock_port}'
+    failed = False
+    try:
+        wait_for_port(mock_port, mock, timeout=120)
+        print(f'{args.pages} {args.image_format} pages of '
+              f'{args.image_size}, {reorder_buffer} pages fetched ahead')
+        print(f'{"max_memory":>12}{"seconds":>10}{"added MB":>10}'
+              f'{"max MB":>10}{"ceiling MB":>12}')
+
+        def run_setting(max_memory):
+            return run_many(base_url, args.pages, reorder_buffer,
+                            max_memory, args.runs, mmap_threshold)
+
+        # The default pipeline, then the floor of the low memory mode
+        report('0', run_setting('0'))
+        floor = report('1', run_setting('1'))
+        for max_memory in args.max_memory:
+            ceiling = floor + decoded_mb \
+                + spill.parse_size(max_memory) / 1024 / 1024
+            added = report(max_memory, run_setting(max_memory), ceiling)
+            failed = failed or added > ceiling
+    finally:
+        mock.terminate()
+        mock.wait()
+    if failed:
+        print('The low memory mode went over its ceiling')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        base_url, pages, reorder_buffer, max_memory, result_file = \
+            sys.argv[2:]
+        child(base_url, int(pages), int(reorder_buffer), max_memory,
+              result_file)
+    else:
+        sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+bench_shards.py
+
+Throughput of the background jobs of the web app as worker processes are
+added. The same documents are queued in a fresh jobs database for every
+process count, and worker.py runs them against the mock server, so the pages
+per second show how the shards of a document spread over the processes.
+
+    python benchmarks/bench_shards.py
+    python benchmarks/bench_shards.py --processes 1 2 4 8 --shard-pages 8
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from harness import free_port, wait_for_port, use_mock, REPO_ROOT
+
+WEB_ROOT = os.path.join(REPO_ROOT, 'docsend_scraper_web')
+
+
+def gather_doc_infos(doc_ids):
+    """
+    :returns: (list) info of the documents, authenticated
+    """
+    import docsend_scraper
+
+    async def gather():
+        async with docsend_scraper.DocsendClient() as client:
+            async def doc_info(doc_id):
+                info = await docsend_scraper.gather_document_info(doc_id,
+                                                                  client)
+                await docsend_scraper.authenticate_document(
+                    info, client=client)
+                return info
+            return await asyncio.gather(*map(doc_info, doc_ids))
+
+    return asyncio.run(gather())
+
+
+def run_jobs(base_url, doc_infos, processes, workers, shard_pages):
+    """
+    Queues the documents and runs them with worker.py.
+
+    :returns: (float) seconds until every job finished
+    """
+    from jobs import JobQueue, FINISHED_STATES, DONE
+    work_dir = tempfile.mkdtemp(prefix='docsend-shards-')
+    db_path = os.path.join(work_dir, 'jobs.sqlite3')
+    queue = JobQueue(db_path, work_dir, workers=0, shard_pages=shard_pages)
+    job_ids = [queue.submit(doc_info) for doc_info in doc_infos]
+    start = time.perf_counter()
+    child = subprocess.Popen(
+        [sys.executable, __file__, '--child', base_url, '--processes',
+         str(processes), '--workers', str(workers), '--jobs-db', db_path,
+         '--jobs-dir', work_dir])
+    try:
+        while True:
+            jobs = [queue.get(job_id) for job_id in job_ids]
+            if all(job['state'] in FINISHED_STATES for job in jobs):
+                break
+            if child.poll() is not None:
+                raise RuntimeError(f'worker.py exited with {child.returncode}')
+            time.sleep(0.02)
+        seconds = time.perf_counter() - start
+    finally:
+        child.send_signal(signal.SIGTERM)
+        child.wait(30)
+        queue.close()
+    failed = [job for job in jobs if job['state'] != DONE]
+    if failed:
+        raise RuntimeError(f'{len(failed)} jobs failed: {failed[0]["error"]}')
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker process counts to compare')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='tasks each process runs at the same time')
+    parser.add_argument('--docs', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=64)
+    parser.add_argument('--shard-pages', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the mock server takes per request')
+    args = parser.parse_args(argv)
+
+    mock_port = free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, 'benchmarks',
+                                      'mock_server.py'),
+         '--port', str(mock_port), '--pages', str(args.pages),
+         '--latency', str(args.latency)])
+    base_url = f'http://127.0.0.1:{mock_port}'
+    try:
+        wait_for_port(mock_port, mock)
+        use_mock(base_url)
+        sys.path.insert(0, WEB_ROOT)
+        run_id = os.urandom(4).hex()
+        doc_infos = gather_doc_infos([f'shards{run_id}-{n}'
+                                      for n in range(args.docs)])
+        pages = args.docs * args.pages
+        print(f'{args.docs} documents of {args.pages} pages, shards of '
+              f'{args.shard_pages} pages, {args.workers} tasks per process')
+        print(f'{"processes":>10}{"seconds":>10}{"pages/s":>10}'
+              f'{"speedup":>10}')
+        first = None
+        for processes in args.processes:
+            seconds = run_jobs(base_url, doc_infos, processes, args.workers,
+                               args.shard_pages)
+            first = seconds if first is None else first
+            print(f'{processes:>10}{seconds:>10.2f}{pages / seconds:>10.1f}'
+                  f'{first / seconds:>10.2f}')
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        use_mock(sys.argv[2])
+        sys.path.insert(0, WEB_ROOT)
+        import worker
+        worker.main(sys.argv[3:])
+    else:
+        main()
@@ -0,0 +1,401 @@
+"""
+harness.py
+
+End to end benchmarks of the library, the CLI and the web app against the
+local mock server. Every scenario runs in its own process, so its peak memory
+and CPU time can be measured apart from the harness and the mock server.
+
+For each scenario it reports:
+
+    docs_per_sec    documents downloaded per second of wall time
+    p50, p99        seconds to download a document
+    peak_rss_mb     peak resident memory of the process doing the work
+    cpu_ms_per_page user and system cpu time per page
+
+Results are compared to baselines.json and the harness exits with status 1
+if any metric is worse than its baseline by more than the tolerance.
+
+    python benchmarks/harness.py                    run and compare
+    python benchmarks/harness.py -s library-small   run one scenario
+    python benchmarks/harness.py --save-baseline    run and store results
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import signal
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import statistics
+import aiohttp
+
+__root_location__ = os.path.realpath(os.path.dirname(__file__))
+REPO_ROOT = os.path.join(__root_location__, '..')
+
+BASELINES_FILE = os.path.join(__root_location__, 'baselines.json')
+
+# target is library, cli or web. The mock options are passed to
+# mock_server.py, so they apply to every document of the scenario. A
+# scenario's tolerance replaces the one given on the command line.
+SCENARIOS = {
+    'library-small': {
+        'target': 'library', 'docs': 20, 'pages': 10, 'concurrency': 4,
+        'mock': ['--latency', '0.02', '--jitter', '0.01'],
+    },
+    'library-large': {
+        'target': 'library', 'docs': 2, 'pages': 150, 'concurrency': 2,
+        'mock': ['--latency', '0.02', '--jitter', '0.01'],
+    },
+    'library-png': {
+        'target': 'library', 'docs': 10, 'pages': 10, 'concurrency': 4,
+        'mock': ['--latency', '0.02', '--image-format', 'PNG'],
+    },
+    'library-gated': {
+        'target': 'library', 'docs': 20, 'pages': 10, 'concurrency': 4,
+        'doc_prefix': 'passcode-',
+        'mock': ['--latency', '0.02', '--jitter', '0.01'],
+    },
+    'library-errors': {
+        'target': 'library', 'docs': 10, 'pages': 10, 'concurrency': 4,
+        'mock': ['--latency', '0.02', '--error-rate', '0.02'],
+        # Retries wait a random backoff, so the timings vary a lot
+        'tolerance': 1.0,
+    },
+    'library-throttled': {
+        'target': 'library', 'docs': 20, 'pages': 10, 'concurrency': 4,
+        'mock': ['--latency', '0.02', '--max-in-flight', '6',
+                 '--retry-after', '1'],
+        # How soon the limit settles under the server's cap varies
+        'tolerance': 1.0,
+    },
+    'cli': {
+        'target': 'cli', 'docs': 20, 'pages': 10, 'concurrency': 4,
+        'mock': ['--latency', '0.02', '--jitter', '0.01'],
+    },
+    'web': {
+        'target': 'web', 'docs': 20, 'pages': 10, 'concurrency': 4,
+        'mock': ['--latency', '0.02', '--jitter', '0.01'],
+    },
+}
+
+# Metrics where a larger value is better. For the others smaller is better.
+HIGHER_IS_BETTER = ('docs_per_sec',)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'exited with {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'Nothing listening on port {port}')
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def use_mock(base_url):
+    """
+    Points the scraper at the mock server. Runs in the child processes.
+    """
+    sys.path.insert(0, REPO_ROOT)
+    from docsend_scraper import scraper, doc_info
+    scraper.BASE_URL = doc_info.BASE_URL = base_url
+
+
+def doc_ids(scenario, run_id):
+    prefix = scenario.get('doc_prefix', '')
+    return [f'{prefix}bench{run_id}-{n}' for n in range(scenario['docs'])]
+
+
+def credentials(doc_id):
+    return 'bench@example.com', 'secret'
+
+
+# Children. Each writes its measurements to a json file.
+
+def child_library(base_url, scenario, run_id, output_dir, result_file):
+    use_mock(base_url)
+    import docsend_scraper
+
+    async def run():
+        latencies = []
+        semaphore = asyncio.Semaphore(scenario['concurrency'])
+        async with docsend_scraper.DocsendClient() as client:
+            async def download(doc_id):
+                async with semaphore:
+                    start = time.perf_counter()
+                    doc_info = await docsend_scraper.gather_document_info(
+                        doc_id, client)
+                    await docsend_scraper.download_docsend_file(
+                        doc_info, *credentials(doc_id),
+                        output_path=output_dir, client=client)
+                    latencies.append(time.perf_counter() - start)
+
+            await asyncio.gather(*(download(doc_id)
+                                   for doc_id in doc_ids(scenario, run_id)))
+        return latencies
+
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    latencies = asyncio.run(run())
+    write_result(result_file, latencies, time.perf_counter() - start,
+                 cpu_seconds() - cpu_start)
+
+
+def child_cli(base_url, scenario, run_id, output_dir, result_file):
+    use_mock(base_url)
+    summary_path = os.path.join(output_dir, 'summary.json')
+    sys.argv = ['docsend_scraper', '-ge', 'bench@example.com', '-o',
+                output_dir, '-w', str(scenario['concurrency']), '-s',
+                summary_path]
+    for doc_id in doc_ids(scenario, run_id):
+        sys.argv += [doc_id, '-p', credentials(doc_id)[1]]
+
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    try:
+        runpy.run_module('docsend_scraper', run_name='__main__')
+    except SystemExit:
+        pass
+    seconds = time.perf_counter() - start
+    with open(summary_path, 'r') as f:
+        summary = json.load(f)
+    latencies = [result['seconds'] for result in summary['results']
+                 if result['status'] == 'done']
+    write_result(result_file, latencies, seconds, cpu_seconds() - cpu_start)
+
+
+def child_web(base_url, port, result_file):
+    use_mock(base_url)
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'docsend_scraper_web'))
+    os.chdir(tempfile.mkdtemp(prefix='docsend-bench-web-'))
+    import app as web_app
+    cpu = {}
+
+    @web_app.app.listener('after_server_start')
+    async def started(app, loop):
+        cpu['start'] = cpu_seconds()
+
+    @web_app.app.listener('after_server_stop')
+    async def stopped(app, loop):
+        write_result(result_file, [], 0, cpu_seconds() - cpu['start'])
+
+    web_app.app.run(host='127.0.0.1', port=port, access_log=False,
+                    workers=1)
+
+
+def write_result(result_file, latencies, seconds, cpu):
+    with open(result_file, 'w') as f:
+        json.dump({'latencies': latencies, 'seconds': seconds, 'cpu': cpu,
+                   'peak_rss_mb': peak_rss_mb()}, f)
+
+
+# Parent
+
+def start_child(args, log_file):
+    """
+    Starts a child process of the harness. Its output goes to log_file, see
+    read_log.
+    """
+    with open(log_file, 'ab') as log:
+        return subprocess.Popen([sys.executable, __file__, '--child'] + args,
+                                stdout=log, stderr=subprocess.STDOUT)
+
+
+def read_log(log_file, lines=20):
+    with open(log_file, 'r', errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+async def load_web(port, scenario, run_id):
+    """
+    Downloads the documents of the scenario from the /download route.
+
+    :returns: (tuple) latencies and wall time in seconds
+    """
+    latencies = []
+    semaphore = asyncio.Semaphore(scenario['concurrency'])
+    email, passcode = credentials(None)
+    async with aiohttp.ClientSession() as session:
+        async def download(doc_id):
+            url = f'http://127.0.0.1:{port}/download/{doc_id}'
+            params = {'email': email, 'passcode': passcode}
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    async for _ in response.content.iter_chunked(65536):
+                        pass
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(download(doc_id)
+                               for doc_id in doc_ids(scenario, run_id)))
+    return latencies, time.perf_counter() - start
+
+
+def run_scenario(name, scenario):
+    """
+    Starts a mock server, runs the scenario against it in a child process
+    and measures it.
+
+    :returns: (dict) metrics of the scenario
+    """
+    mock_port = free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(__root_location__, 'mock_server.py'),
+         '--port', str(mock_port), '--pages', str(scenario['pages'])]
+        + scenario['mock'])
+    base_url = f'http://127.0.0.1:{mock_port}'
+    run_id = os.urandom(4).hex()
+    work_dir = tempfile.mkdtemp(prefix='docsend-bench-')
+    result_file = os.path.join(work_dir, 'result.json')
+    log_file = os.path.join(work_dir, 'child.log')
+    try:
+        wait_for_port(mock_port, mock)
+        if scenario['target'] == 'web':
+            port = free_port()
+            server = start_child(['web', base_url, str(port), result_file],
+                                 log_file)
+            try:
+                wait_for_port(port, server)
+                latencies, seconds = asyncio.run(
+                    load_web(port, scenario, run_id))
+            except Exception as e:
+                raise RuntimeError(f'{e}\n{read_log(log_file)}') from e
+            finally:
+                server.send_signal(signal.SIGINT)
+                server.wait(30)
+            with open(result_file, 'r') as f:
+                result = json.load(f)
+            result['latencies'] = latencies
+            result['seconds'] = seconds
+        else:
+            child = start_child([scenario['target'], base_url, name, run_id,
+                                 work_dir, result_file], log_file)
+            if child.wait() != 0:
+                raise RuntimeError(f'exited with {child.returncode}\n'
+                                   f'{read_log(log_file)}')
+            with open(result_file, 'r') as f:
+                result = json.load(f)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    latencies = sorted(result['latencies'])
+    if len(latencies) != scenario['docs']:
+        raise RuntimeError(f'{name} downloaded {len(latencies)} of '
+                           f'{scenario["docs"]} documents')
+    pages = scenario['docs'] * scenario['pages']
+    return {
+        'docs_per_sec': scenario['docs'] / result['seconds'],
+        'p50': statistics.median(latencies),
+        'p99': latencies[min(len(latencies) - 1,
+                             int(len(latencies) * 0.99))],
+        'peak_rss_mb': result['peak_rss_mb'],
+        'cpu_ms_per_page': result['cpu'] / pages * 1000,
+    }
+
+
+def compare(name, metrics, baseline, tolerance):
+    """
+    :returns: (list) descriptions of the metrics worse than the baseline
+    """
+    regressions = []
+    for metric, value in metrics.items():
+        base = baseline.get(metric)
+        if not base:
+            continue
+        change = (value - base) / base
+        if metric in HIGHER_IS_BETTER:
+            change = -change
+        if change > tolerance:
+            regressions.append(f'{name} {metric}: {value:.3f} vs baseline '
+                               f'{base:.3f} ({change:+.0%} worse)')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-s', '--scenario', action='append',
+                        choices=sorted(SCENARIOS),
+                        help='scenario to run, all by default')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed share a metric may be worse by')
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(BASELINES_FILE):
+        with open(BASELINES_FILE, 'r') as f:
+            baselines = json.load(f)
+
+    results = {}
+    failed = []
+    regressions = []
+    print(f'{"scenario":16}{"docs/s":>9}{"p50 s":>9}{"p99 s":>9}'
+          f'{"rss MB":>9}{"cpu ms/page":>13}')
+    for name in args.scenario or SCENARIOS:
+        try:
+            metrics = run_scenario(name, SCENARIOS[name])
+        except Exception as e:
+            failed.append(name)
+            print(f'{name:16}failed: {e}')
+            continue
+        results[name] = metrics
+        print(f'{name:16}{metrics["docs_per_sec"]:>9.2f}'
+              f'{metrics["p50"]:>9.3f}{metrics["p99"]:>9.3f}'
+              f'{metrics["peak_rss_mb"]:>9.1f}'
+              f'{metrics["cpu_ms_per_page"]:>13.2f}')
+        tolerance = SCENARIOS[name].get('tolerance', args.tolerance)
+        regressions += compare(name, metrics, baselines.get(name, {}),
+                               tolerance)
+
+    if args.save_baseline:
+        baselines.update(results)
+        with open(BASELINES_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'Saved baselines of {", ".join(results)}')
+    elif regressions:
+        print('Regressions:')
+        for regression in regressions:
+            print(f'  {regression}')
+    return 1 if failed or (regressions and not args.save_baseline) else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        target, child_args = sys.argv[2], sys.argv[3:]
+        if target == 'web':
+            child_web(child_args[0], int(child_args[1]), child_args[2])
+        else:
+            base_url, name, run_id, output_dir, result_file = child_args
+            child = child_library if target == 'library' else child_cli
+            child(base_url, SCENARIOS[name], run_id, output_dir, result_file)
+    else:
+        sys.exit(main())
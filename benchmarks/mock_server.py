@@ -0,0 +1,238 @@
+"""
+mock_server.py
+
+Local stand-in for docsend.com to benchmark the scraper against. Serves view
+pages built from the saved pages in fixtures/, the authentication form post,
+the page_data json and the page images, with configurable latency, errors
+and page counts.
+
+The doc id picks what the document looks like:
+
+    email-<name>        needs an email
+    passcode-<name>     needs an email and the passcode "secret"
+    <name>-p<count>     has count pages instead of the default
+
+With --max-in-flight, page_data and image requests over that many at once
+are answered with a 429 and a Retry-After, like a rate limited server.
+
+    python benchmarks/mock_server.py --port 8765 --pages 20 --latency 0.05
+"""
+import io
+import os
+import re
+import random
+import asyncio
+import argparse
+from aiohttp import web
+from PIL import Image
+
+__root_location__ = os.path.realpath(os.path.dirname(__file__))
+
+FIXTURES_FOLDER = os.path.join(__root_location__, 'fixtures')
+PASSCODE = 'secret'
+SESSION_COOKIE = '_v_'
+AUTH_COOKIE = '_visitor_'
+PAGE_COUNT_SUFFIX = re.compile(r'-p(?P<pages>\d+)$')
+# Number of distinct images served, pages cycle through them
+IMAGE_VARIANTS = 8
+# Image format to the extension and content type of the page images
+IMAGE_TYPES = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'WEBP': ('webp', 'image/webp'),
+}
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_FOLDER, name), 'r') as f:
+        return f.read()
+
+
+def make_images(image_format, width, height):
+    """
+    Renders page images that compress like real slides, flat areas with
+    some text like noise.
+
+    :returns: (list) encoded images
+    """
+    images = []
+    rnd = random.Random(0)
+    for variant in range(IMAGE_VARIANTS):
+        img = Image.new('RGB', (width, height), (245, 245, 240))
+        noise = Image.effect_noise((width // 2, height // 6), 64 + variant)
+        img.paste(noise.convert('RGB'), (width // 8, height // 3))
+        for _ in range(12):
+            x, y = rnd.randrange(width), rnd.randrange(height)
+            color = tuple(rnd.randrange(256) for _ in range(3))
+            img.paste(color, (x, y, min(width, x + width // 6),
+                              min(height, y + height // 10)))
+        data = io.BytesIO()
+        img.save(data, image_format, quality=85)
+        images.append(data.getvalue())
+    return images
+
+
+class MockDocsend:
+    """
+    State and handlers of the mock server.
+
+    :pages: (int) page count of documents without a -p<count> suffix
+    :latency: (float) seconds every response is delayed by
+    :jitter: (float) max random seconds added to the latency
+    :error_rate: (float) share of page_data and image requests answered
+                    with a 503
+    :image_format: (str) JPEG, PNG or WEBP. WEBP pages have to be decoded
+                    to be put in a pdf.
+    :image_size: (tuple) width and height of the page images
+    :max_in_flight: (int) page_data and image requests served at once,
+                    the others get a 429. 0 for no limit.
+    :retry_after: (int) seconds sent in the Retry-After of a 429
+    """
+
+    def __init__(self, pages=10, latency=0, jitter=0, error_rate=0,
+                 image_format='JPEG', image_size=(1600, 900),
+                 max_in_flight=0, retry_after=1):
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.image_format = image_format.upper()
+        self.images = make_images(self.image_format, *image_size)
+        self.fixtures = {
+            'public': read_fixture('public.html'),
+            'email': read_fixture('email.html'),
+            'passcode': read_fixture('passcode.html'),
+        }
+        self.requests = {}
+
+    def page_count(self, doc_id):
+        match = PAGE_COUNT_SUFFIX.search(doc_id)
+        return int(match.group('pages')) if match else self.pages
+
+    @staticmethod
+    def kind(doc_id):
+        for kind in ('email', 'passcode'):
+            if doc_id.startswith(f'{kind}-'):
+                return kind
+        return 'public'
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        name = request.match_info.route.name or 'other'
+        self.requests[name] = self.requests.get(name, 0) + 1
+        limited = name in ('page_data', 'image')
+        if limited and self.max_in_flight \
+                and self.in_flight >= self.max_in_flight:
+            self.requests['throttled'] = self.requests.get('throttled', 0) + 1
+            return web.Response(
+                status=429, headers={'Retry-After': str(self.retry_after)})
+        if limited:
+            self.in_flight += 1
+        try:
+            delay = self.latency + random.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            if limited and random.random() < self.error_rate:
+                return web.Response(status=503)
+            return await handler(request)
+        finally:
+            if limited:
+                self.in_flight -= 1
+
+    async def view(self, request):
+        doc_id = request.match_info['doc_id']
+        # The page shows one page more than there are, see find_page_count
+        html = self.fixtures[self.kind(doc_id)].replace(
+            "\n / 24\n", f"\n / {self.page_count(doc_id) + 1}\n")
+        response = web.Response(text=html, content_type='text/html')
+        response.set_cookie(SESSION_COOKIE, os.urandom(8).hex())
+        return response
+
+    async def authenticate(self, request):
+        form = await request.post()
+        doc_id = request.match_info['doc_id']
+        if not form.get('visitor[email]') or (
+                self.kind(doc_id) == 'passcode'
+                and form.get('visitor[passcode]') != PASSCODE):
+            return web.Response(
+                text='<p>Please review the problems below</p>',
+                content_type='text/html')
+        response = web.Response(text='<p>ok</p>', content_type='text/html')
+        response.set_cookie(AUTH_COOKIE, doc_id)
+        return response
+
+    def authorized(self, request, doc_id):
+        if SESSION_COOKIE not in request.cookies:
+            return False
+        return self.kind(doc_id) == 'public' \
+            or request.cookies.get(AUTH_COOKIE) == doc_id
+
+    async def page_data(self, request):
+        doc_id = request.match_info['doc_id']
+        page = int(request.match_info['page'])
+        if not self.authorized(request, doc_id):
+            return web.Response(status=403)
+        if not 1 <= page <= self.page_count(doc_id):
+            return web.Response(status=404)
+        extension = IMAGE_TYPES[self.image_format][0]
+        signature = os.urandom(6).hex()
+        return web.json_response({
+            'imageUrl': f'{request.scheme}://{request.host}/images/'
+                        f'{doc_id}/{page}.{extension}?signature={signature}'
+        })
+
+    async def image(self, request):
+        page = int(request.match_info['page'])
+        content_type = IMAGE_TYPES[self.image_format][1]
+        return web.Response(body=self.images[page % len(self.images)],
+                            content_type=content_type)
+
+    async def stats(self, request):
+        return web.json_response(self.requests)
+
+    def create_app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/stats', self.stats, name='stats')
+        app.router.add_get('/view/{doc_id}', self.view, name='view')
+        app.router.add_post('/view/{doc_id}', self.authenticate,
+                            name='authenticate')
+        app.router.add_get('/view/{doc_id}/page_data/{page}',
+                           self.page_data, name='page_data')
+        app.router.add_get(r'/images/{doc_id}/{page:\d+}.{extension}',
+                           self.image, name='image')
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--image-format', default='JPEG',
+                        choices=sorted(IMAGE_TYPES))
+    parser.add_argument('--image-size', default='1600x900')
+    parser.add_argument('--max-in-flight', type=int, default=0,
+                        help='page requests served at once, the others get '
+                             'a 429')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='seconds sent in the Retry-After of a 429')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the latency jitter and the errors')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    width, height = (int(n) for n in args.image_size.split('x'))
+    random.seed(args.seed)
+    mock = MockDocsend(args.pages, args.latency, args.jitter,
+                       args.error_rate, args.image_format, (width, height),
+                       args.max_in_flight, args.retry_after)
+    web.run_app(mock.create_app(), host=args.host, port=args.port,
+                print=None)
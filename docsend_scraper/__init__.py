@@ -1,2 +1,77 @@
-from .scraper import *
+"""
+docsend_scraper
+
+The names of the scraper are imported on first use, so importing the package
+is cheap and the http clients, PIL and reportlab are only loaded by what
+needs them. docsend_scraper.get_id_from_url only loads doc_info, while
+docsend_scraper.download_docsend loads scraper and aiohttp.
+"""
+import importlib
 from .exceptions import AuthError, InfoRequiredError
+
+
+# Modules of the package, imported as attributes of it on first use
+_SUBMODULES = {
+    'batch', 'cache', 'config', 'doc_info', 'lazy', 'metrics', 'models',
+    'pdf', 'render', 'retry', 'scheduler', 'scraper', 'singleflight',
+    'sinks', 'spill', 'spool', 'sync',
+}
+
+# Names that do not need the scraper, to the module they come from
+_LIGHT_NAMES = {
+    'get_id_from_url': 'doc_info',
+    'get_url_from_id': 'doc_info',
+    'parse_page_range': 'doc_info',
+    'get_config': 'config',
+    'DocumentInfo': 'models',
+    'PageInfo': 'models',
+}
+
+# Names from other modules that load the scraper, to the module they come from
+_OTHER_NAMES = {
+    'LazyDocument': 'lazy',
+}
+
+__all__ = [
+    'AuthError', 'InfoRequiredError', 'LazyDocument', 'DocumentInfo',
+    'PageInfo', 'DocsendClient',
+    'get_default_client', 'get_id_from_url', 'get_url_from_id',
+    'parse_page_range', 'select_pages', 'is_valid_doc_id',
+    'is_valid_doc_id_async', 'get_document_html', 'gather_document_info',
+    'authenticate_cookie', 'authenticate_document', 'get_page_image_url',
+    'get_document_img_urls', 'download_page_image',
+    'download_cached_page_image', 'download_image_for_document', 'fetch_page',
+    'iter_document_pages', 'iter_docsend_images', 'stream_docsend_pdf',
+    'stream_docsend_zip', 'save_docsend_pages', 'download_docsend',
+    'download_docsend_file', 'download_docsend_with_doc_id', 'Renderer',
+    'get_default_renderer', 'Scheduler', 'AdaptiveLimit', 'RetryPolicy',
+    'PageCache', 'PdfCache', 'PageSpool', 'PdfWriter', 'ZipWriter',
+    'OUTPUT_FORMATS',
+]
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in _LIGHT_NAMES or name in _OTHER_NAMES:
+        module_name = _LIGHT_NAMES.get(name) or _OTHER_NAMES[name]
+        module = importlib.import_module(f'.{module_name}', __name__)
+    elif name.startswith('_'):
+        raise AttributeError(f'module {__name__!r} has no attribute '
+                             f'{name!r}')
+    else:
+        # Everything else, settings like REORDER_BUFFER included, is what
+        # the scraper module has
+        module = importlib.import_module('.scraper', __name__)
+    try:
+        value = getattr(module, name)
+    except AttributeError:
+        raise AttributeError(f'module {__name__!r} has no attribute '
+                             f'{name!r}') from None
+    # Later lookups skip this function
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | _SUBMODULES)
@@ -1,55 +1,131 @@
 import sys
 import asyncio
 from . import scraper
-import doc_info
+from . import batch
+from . import sinks
+from . import spill
 
 
-async def main(id_list):
-    coros = []
-    for d in id_list:
-        coros.append(scraper.download_docsend(*d))
-    return await asyncio.gather(*coros)
+async def main(jobs, workers=None, output_dir=None, summary_path=None,
+               output_format='pdf', sync_dir=None, max_memory=None):
+    try:
+        return await batch.run_batch(jobs, workers, output_dir=output_dir,
+                                     summary_path=summary_path,
+                                     output_format=output_format,
+                                     sync_dir=sync_dir, max_memory=max_memory)
+    finally:
+        await scraper.get_default_client().close()
 
-id_list = []
+jobs = []
 global_email = None
+manifest = None
+workers = None
+output_dir = None
+summary_path = None
+output_format = 'pdf'
+sync_dir = None
+max_memory = None
 
 next_is_passcode = False
 next_is_email = False
+next_is_pages = False
 next_is_global_email = False
+next_is_manifest = False
+next_is_workers = False
+next_is_output_dir = False
+next_is_summary = False
+next_is_format = False
+next_is_sync = False
+next_is_max_memory = False
 
 for arg in sys.argv[1:]:
     if next_is_passcode:
         next_is_passcode = False
-        id_list[-1][2] = arg
+        jobs[-1]['passcode'] = arg
+
+    elif next_is_pages:
+        next_is_pages = False
+        jobs[-1]['pages'] = arg
 
     elif next_is_email:
         next_is_email = False
-        id_list[-1][1] = arg
+        jobs[-1]['email'] = arg
 
     elif next_is_global_email:
         next_is_global_email = False
         assert global_email is None, 'global email can only be selected once'
         global_email = arg
 
+    elif next_is_manifest:
+        next_is_manifest = False
+        assert manifest is None, 'manifest can only be selected once'
+        manifest = arg
+
+    elif next_is_workers:
+        next_is_workers = False
+        workers = int(arg)
+
+    elif next_is_output_dir:
+        next_is_output_dir = False
+        output_dir = arg
+
+    elif next_is_summary:
+        next_is_summary = False
+        summary_path = arg
+
+    elif next_is_sync:
+        next_is_sync = False
+        sync_dir = arg
+
+    elif next_is_max_memory:
+        next_is_max_memory = False
+        max_memory = spill.parse_size(arg)
+
+    elif next_is_format:
+        next_is_format = False
+        sinks.check_output_format(arg)
+        output_format = arg
+
     elif arg == "-e":
         next_is_email = True
     elif arg == "-ge":
         next_is_global_email = True
     elif arg == "-p":
         next_is_passcode = True
+    elif arg == "-r":
+        next_is_pages = True
+    elif arg == "-m":
+        next_is_manifest = True
+    elif arg == "-w":
+        next_is_workers = True
+    elif arg == "-o":
+        next_is_output_dir = True
+    elif arg == "-s":
+        next_is_summary = True
+    elif arg == "-f":
+        next_is_format = True
+    elif arg == "-sync":
+        next_is_sync = True
+    elif arg == "-mem":
+        next_is_max_memory = True
 
     else:
-        if '.com' in arg:
-            doc_id = doc_info.get_id_from_url(arg)
-        else:
-            doc_id = arg
+        jobs.append({'url': arg, 'email': None, 'passcode': None,
+                     'output': None, 'pages': None})
 
-        id_list.append([doc_id, None, None])
+if manifest is not None:
+    jobs.extend(batch.read_manifest(manifest))
 
 if global_email is not None:
-    for d in id_list:
-        if d[1] is None:
-            d[1] = global_email
+    for job in jobs:
+        if job['email'] is None:
+            job['email'] = global_email
 
 loop = asyncio.get_event_loop()
-loop.run_until_complete(main(id_list))
+summary = loop.run_until_complete(
+    main(jobs, workers, output_dir, summary_path, output_format, sync_dir,
+         max_memory))
+print(f"{summary['done']} done, {summary['skipped']} skipped, "
+      f"{summary['failed']} failed, {summary['pages']} pages in "
+      f"{summary['seconds']:.1f}s ({summary['pages_per_second']:.1f} pages/s)")
+sys.exit(1 if summary['failed'] else 0)
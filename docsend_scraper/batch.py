@@ -0,0 +1,282 @@
+"""
+batch.py
+
+Downloads many documents with a bounded pool of workers. Documents whose pdf
+(or zip, cbz or page directory) already exists are skipped, so an interrupted
+batch can simply be run again, and a document that fails is recorded without
+stopping the others. Every document ends up in a summary with its status,
+timing, size and throughput.
+
+In sync mode every document is kept up to date in an archive of its own
+instead, see sync.py, and only its new or changed pages are downloaded.
+
+A manifest is a CSV file with a header row, or a JSONL file with one object
+per line, with the fields:
+
+    url         url or id of the document
+    email       (optional) email to authenticate with
+    passcode    (optional) passcode to authenticate with
+    output      (optional) path of the output, or directory to save it in
+    pages       (optional) pages to download, e.g. 1-5,12. Defaults to all.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+from . import scraper
+from . import doc_info
+from . import sync
+from .sinks import OUTPUT_FORMATS
+
+
+MANIFEST_FIELDS = ('url', 'email', 'passcode', 'output', 'pages')
+
+BATCH_WORKERS = scraper.CONFIG.getint('batch', 'workers')
+
+
+def get_doc_id(url):
+    """
+    :url: (str) url or id of a document
+
+    :returns: (str) id of the document
+    """
+    if '.com' in url:
+        return doc_info.get_id_from_url(url)
+    return url
+
+
+def read_manifest(path):
+    """
+    Reads the documents of a CSV or JSONL manifest. The format is picked by
+    the file extension, .jsonl and .json being JSONL and anything else CSV.
+
+    :path: (str) path of the manifest
+
+    :returns: (list) dicts with the manifest fields. Missing fields are None.
+    """
+    with open(path, 'r', newline='') as f:
+        if path.endswith(('.jsonl', '.json')):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for row in rows:
+        # Empty csv cells mean the field is not set
+        job = {field: row.get(field) or None for field in MANIFEST_FIELDS}
+        job['url'] = job['url'] or row.get('id')
+        if not job['url']:
+            raise ValueError(f'Manifest row without a url: {row}')
+        jobs.append(job)
+    return jobs
+
+
+def get_output_file(job, output_dir=None, output_format='pdf'):
+    """
+    :job: (dict) document of the batch
+    :output_dir: (str) directory of documents without an output
+    :output_format: (str) output format, see sinks.OUTPUT_FORMATS
+
+    :returns: (str) path the document is saved to
+    """
+    extension = OUTPUT_FORMATS[output_format][0]
+    output = job.get('output')
+    if output and extension and output.lower().endswith(extension):
+        return output
+    directory = output or output_dir or ''
+    return os.path.join(directory,
+                        f'Docsend-{get_doc_id(job["url"])}{extension}')
+
+
+def get_size(path):
+    """
+    :returns: (int) size of a file, or of the files in a directory
+    """
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path))
+    return os.path.getsize(path)
+
+
+async def download_job(job, client, output_dir=None, renderer=None,
+                       output_format='pdf', max_memory=None):
+    """
+    Downloads one document of the batch. Errors are recorded, not raised.
+
+    :job: (dict) document of the batch
+    :client: (DocsendClient) client to use
+    :output_dir: (str) directory of documents without an output
+    :renderer: (Renderer) renderer to use. Defaults to the shared one.
+    :output_format: (str) output format, see sinks.OUTPUT_FORMATS
+    :max_memory: (int) bytes of pages fetched ahead kept in memory, see
+                scraper.download_docsend_file
+
+    :returns: (dict) result with the status (done, skipped or failed),
+                seconds, bytes, pages and pages per second of the document
+    """
+    doc_id = get_doc_id(job['url'])
+    output_file = get_output_file(job, output_dir, output_format)
+    result = {'id': doc_id, 'url': job['url'], 'output': output_file,
+              'status': None, 'error': None, 'seconds': 0, 'bytes': 0,
+              'pages': 0, 'pages_per_second': 0}
+
+    if os.path.exists(output_file):
+        result['status'] = 'skipped'
+        result['bytes'] = get_size(output_file)
+        return result
+
+    start = time.monotonic()
+    try:
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        info = await scraper.gather_document_info(doc_id, client)
+        await scraper.download_docsend_file(info, job.get('email'),
+                                            job.get('passcode'),
+                                            client=client, renderer=renderer,
+                                            output_file=output_file,
+                                            output_format=output_format,
+                                            pages=job.get('pages'),
+                                            max_memory=max_memory)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+    else:
+        result['status'] = 'done'
+        result['bytes'] = get_size(output_file)
+        result['pages'] = len(scraper.select_pages(info, job.get('pages')))
+    result['seconds'] = time.monotonic() - start
+    if result['pages'] and result['seconds']:
+        result['pages_per_second'] = result['pages'] / result['seconds']
+    return result
+
+
+async def sync_job(job, client, sync_dir, renderer=None):
+    """
+    Syncs one document of the batch into <sync_dir>/<doc id>. Errors are
+    recorded, not raised.
+
+    :job: (dict) document of the batch
+    :client: (DocsendClient) client to use
+    :sync_dir: (str) directory of the archives
+    :renderer: (Renderer) renderer to use. Defaults to the shared one.
+
+    :returns: (dict) result like download_job, with the diff of the sync.
+                Pages are the pages downloaded.
+    """
+    doc_id = get_doc_id(job['url'])
+    output = os.path.join(sync_dir, doc_id)
+    result = {'id': doc_id, 'url': job['url'], 'output': output,
+              'status': None, 'error': None, 'seconds': 0, 'bytes': 0,
+              'pages': 0, 'pages_per_second': 0, 'diff': None}
+    start = time.monotonic()
+    try:
+        diff = await sync.sync_document(doc_id, output, job.get('email'),
+                                        job.get('passcode'), client,
+                                        renderer)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+    else:
+        result['status'] = 'done'
+        result['bytes'] = diff['bytes']
+        result['pages'] = diff['downloaded']
+        result['diff'] = diff
+    result['seconds'] = time.monotonic() - start
+    if result['pages'] and result['seconds']:
+        result['pages_per_second'] = result['pages'] / result['seconds']
+    return result
+
+
+def summarize(results, seconds):
+    """
+    :results: (list) results of download_job
+    :seconds: (float) wall time of the batch
+
+    :returns: (dict) totals of the batch along with every result
+    """
+    pages = sum(result['pages'] for result in results)
+    return {
+        'documents': len(results),
+        'done': sum(r['status'] == 'done' for r in results),
+        'skipped': sum(r['status'] == 'skipped' for r in results),
+        'failed': sum(r['status'] == 'failed' for r in results),
+        'seconds': seconds,
+        'bytes': sum(r['bytes'] for r in results if r['status'] == 'done'),
+        'pages': pages,
+        'pages_per_second': pages / seconds if seconds else 0,
+        'results': results,
+    }
+
+
+def report_progress(results, total, start, stream=sys.stderr):
+    """
+    Prints a line about the last finished document and the overall rate.
+    """
+    result = results[-1]
+    elapsed = time.monotonic() - start
+    pages = sum(r['pages'] for r in results)
+    line = (f'[{len(results)}/{total}] {result["status"]:7} {result["id"]} '
+            f'({pages / elapsed if elapsed else 0:.1f} pages/s overall)')
+    if result['error']:
+        line += f' {result["error"]}'
+    diff = result.get('diff')
+    if diff is not None:
+        line += (f' +{len(diff["added"])} ~{len(diff["changed"])} '
+                 f'>{len(diff["moved"])} -{len(diff["removed"])} pages')
+    print(line, file=stream)
+
+
+async def run_batch(jobs, workers=None, client=None, output_dir=None,
+                    summary_path=None, renderer=None, progress=True,
+                    output_format='pdf', sync_dir=None, max_memory=None):
+    """
+    Downloads the documents of a batch.
+
+    :jobs: (list) documents, as returned by read_manifest
+    :workers: (int) documents downloaded at the same time. Defaults to the
+                batch workers of config.ini.
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :output_dir: (str) directory of documents without an output
+    :summary_path: (str) where to write the summary as json. The summary is
+                written even if the batch is interrupted.
+    :renderer: (Renderer) renderer to use. Defaults to the shared one.
+    :progress: (bool) print a line to stderr as each document finishes
+    :output_format: (str) output format, see sinks.OUTPUT_FORMATS
+    :sync_dir: (str) sync every document into an archive in this directory
+                instead of downloading it, see sync_job
+    :max_memory: (int) bytes of pages fetched ahead kept in memory by each
+                download, see scraper.download_docsend_file
+
+    :returns: (dict) summary of the batch, see summarize
+    """
+    workers = BATCH_WORKERS if workers is None else workers
+    client = scraper.get_default_client() if client is None else client
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    results = []
+    start = time.monotonic()
+
+    async def worker():
+        while not queue.empty():
+            job = queue.get_nowait()
+            if sync_dir is not None:
+                result = await sync_job(job, client, sync_dir, renderer)
+            else:
+                result = await download_job(job, client, output_dir,
+                                            renderer, output_format,
+                                            max_memory)
+            results.append(result)
+            if progress:
+                report_progress(results, len(jobs), start)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    finally:
+        summary = summarize(results, time.monotonic() - start)
+        if summary_path is not None:
+            with open(summary_path, 'w') as f:
+                json.dump(summary, f, indent=2)
+    return summary
@@ -0,0 +1,303 @@
+"""
+cache.py
+
+On disk caches shared between CLI runs and web workers. Files are written to
+a temporary name and renamed into place, so several processes can use the
+same directory. When a cache grows past its size cap the least recently used
+files are removed. A file's modification time is its last use.
+
+The caches do blocking file I/O. Coroutines call them from a thread, and a
+cache can be used from several threads at once.
+"""
+import os
+import uuid
+import hashlib
+import threading
+from urllib.parse import urlsplit
+
+
+# Share of the size cap an eviction brings the cache down to, so a full
+# cache is not counted again on every file added to it
+LOW_WATER = 0.9
+
+
+class DiskLRU:
+    """
+    Directory of files with a size cap and least recently used eviction.
+    Once over its cap, a cache is brought down to LOW_WATER of it.
+
+    :directory: (str) where the files are kept. Created if missing.
+    :max_bytes: (int) size cap of the directory. 0 for no cap.
+    """
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    # Still being written by someone
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat
+
+    @property
+    def size(self):
+        """
+        Bytes used by the cache. Counted once, then kept up to date by this
+        process.
+        """
+        with self._lock:
+            return self._count()
+
+    def _count(self):
+        # Called with the lock held
+        if self._size is None:
+            self._size = sum(stat.st_size for _, stat in self._files())
+        return self._size
+
+    def touch(self, path):
+        """
+        Marks a file as just used.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def write(self, path, data):
+        """
+        Atomically writes data to path and evicts old files if needed.
+
+        :path: (str) path inside the cache directory
+        :data: (bytes) content of the file
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.added(len(data))
+
+    def added(self, size):
+        """
+        Accounts for a file that was moved into the cache and evicts old
+        files if the cache is over its cap.
+
+        :size: (int) size of the file
+        """
+        with self._lock:
+            self._size = self._count() + size
+            full = self.max_bytes and self._size > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used files until the cache is down to
+        LOW_WATER of its cap. Other processes may have written to the
+        directory, so it is counted again first.
+        """
+        with self._lock:
+            files = sorted(self._files(), key=lambda item: item[1].st_mtime)
+            size = sum(stat.st_size for _, stat in files)
+            if size <= self.max_bytes:
+                # Another thread already made room
+                self._size = size
+                return
+            low_water = self.max_bytes * LOW_WATER
+            for path, stat in files:
+                if size <= low_water:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= stat.st_size
+            self._size = size
+
+
+class PageCache(DiskLRU):
+    """
+    Content addressed cache of page images.
+
+    Images are stored once under the sha256 of their content. A small
+    reference file maps a document page and its image url to that hash. The
+    query string of the url, which holds the expiring signature, is ignored,
+    so an unchanged page only needs its page_data request to be found.
+
+        <directory>/objects/<hash[:2]>/<hash>
+        <directory>/refs/<sha1 of doc_id>/<page>-<url key>
+
+    :directory: (str) where the images are kept
+    :max_bytes: (int) size cap of the cache. 0 for no cap.
+    """
+
+    @staticmethod
+    def url_key(image_url):
+        """
+        Key of an image url that stays the same when only its signature
+        changes.
+
+        :image_url: (str) url of the page image
+
+        :returns: (str) hex digest of the url without its query string
+        """
+        parts = urlsplit(image_url)
+        url = f'{parts.netloc}{parts.path}'.encode()
+        return hashlib.sha1(url).hexdigest()
+
+    def _ref_path(self, doc_id, page, image_url):
+        doc_dir = hashlib.sha1(str(doc_id).encode()).hexdigest()
+        name = f'{page}-{self.url_key(image_url)}'
+        return os.path.join(self.directory, 'refs', doc_dir, name)
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.directory, 'objects', content_hash[:2],
+                            content_hash)
+
+    def get(self, doc_id, page, image_url):
+        """
+        :doc_id: (str) id of the document
+        :page: (int) page number
+        :image_url: (str) url of the page image
+
+        :returns: (bytes) the cached image, None if it is not cached
+        """
+        ref_path = self._ref_path(doc_id, page, image_url)
+        try:
+            with open(ref_path, 'r') as f:
+                content_hash = f.read().strip()
+            object_path = self._object_path(content_hash)
+            with open(object_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(ref_path)
+        self.touch(object_path)
+        return data
+
+    def put(self, doc_id, page, image_url, data):
+        """
+        Adds a page image to the cache.
+
+        :doc_id: (str) id of the document
+        :page: (int) page number
+        :image_url: (str) url of the page image
+        :data: (bytes) the image
+
+        :returns: (str) sha256 of the image
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(content_hash)
+        if os.path.exists(object_path):
+            self.touch(object_path)
+        else:
+            self.write(object_path, data)
+        self.write(self._ref_path(doc_id, page, image_url),
+                   content_hash.encode())
+        return content_hash
+
+
+class PdfCacheEntry:
+    """
+    A pdf being written to the cache. Chunks are written to a temporary file
+    that only becomes visible in the cache on commit.
+    """
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        self.tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk):
+        self._file.write(chunk)
+
+    def commit(self):
+        """
+        Moves the finished pdf into the cache.
+
+        :returns: (str) path of the cached pdf
+        """
+        self._file.close()
+        size = os.path.getsize(self.tmp_path)
+        os.replace(self.tmp_path, self.path)
+        self.cache.added(size)
+        return self.path
+
+    def discard(self):
+        """
+        Drops an unfinished pdf.
+        """
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class PdfCache(DiskLRU):
+    """
+    Cache of finished pdf files. A pdf is keyed by its doc id and a
+    fingerprint of its page image urls, so it is only reused while the
+    document has not changed.
+
+        <directory>/<sha1 of doc_id>/<fingerprint>.pdf
+
+    :directory: (str) where the pdf files are kept
+    :max_bytes: (int) size cap of the cache. 0 for no cap.
+    """
+
+    @staticmethod
+    def fingerprint(image_urls):
+        """
+        Fingerprint of a document's pages. Uses the same url key as the page
+        cache, so expiring signatures do not change it.
+
+        :image_urls: (list) urls of the page images, in page order
+
+        :returns: (str) hex digest usable as an ETag
+        """
+        digest = hashlib.sha256()
+        for image_url in image_urls:
+            digest.update(PageCache.url_key(image_url).encode())
+        return digest.hexdigest()
+
+    def _path(self, doc_id, fingerprint):
+        doc_dir = hashlib.sha1(str(doc_id).encode()).hexdigest()
+        return os.path.join(self.directory, doc_dir, f'{fingerprint}.pdf')
+
+    def get(self, doc_id, fingerprint):
+        """
+        :doc_id: (str) id of the document
+        :fingerprint: (str) fingerprint of the document pages
+
+        :returns: (str) path of the cached pdf, None if it is not cached
+        """
+        path = self._path(doc_id, fingerprint)
+        if not os.path.exists(path):
+            return None
+        self.touch(path)
+        return path
+
+    def entry(self, doc_id, fingerprint):
+        """
+        Starts writing a pdf to the cache.
+
+        :doc_id: (str) id of the document
+        :fingerprint: (str) fingerprint of the document pages
+
+        :returns: (PdfCacheEntry)
+        """
+        return PdfCacheEntry(self, self._path(doc_id, fingerprint))
@@ -0,0 +1,46 @@
+"""
+config.py
+
+The settings of config.ini and the request headers. Both are read once, the
+first time a module asks for them, and the same objects are shared by every
+module of the scraper.
+"""
+import os
+import json
+from configparser import ConfigParser
+
+
+__root_location__ = os.path.realpath(os.path.dirname(__file__))
+
+_CONFIG = None
+_HEADERS = None
+
+
+def get_config():
+    """
+    Returns the settings of config.ini, read on the first call.
+
+    :returns: (configparser.ConfigParser)
+    """
+    global _CONFIG
+    if _CONFIG is None:
+        config = ConfigParser()
+        config.read(os.path.join(__root_location__, 'config.ini'))
+        _CONFIG = config
+    return _CONFIG
+
+
+def get_headers():
+    """
+    Returns the headers sent with every request, read on the first call from
+    the request_headers_file of config.ini.
+
+    :returns: (dict)
+    """
+    global _HEADERS
+    if _HEADERS is None:
+        path = os.path.join(__root_location__,
+                            get_config()['DEFAULT']['request_headers_file'])
+        with open(path, 'r') as f:
+            _HEADERS = json.load(f)
+    return _HEADERS
@@ -7,17 +7,20 @@ here take the document text and use regex or string search to find the relevant
 info.
 """
 import re
-from configparser import ConfigParser
-import os
+from .config import get_config
 
-__root_location__ = os.path.realpath(os.path.dirname(__file__))
-CONFIG = ConfigParser()
-CONFIG.read(os.path.join(__root_location__, 'config.ini'))
+CONFIG = get_config()
 
 BASE_URL = CONFIG['DEFAULT']['base_url']
 PAGE_COUNT_REGEX = CONFIG['DEFAULT']['page_count_regex']
 AUTH_TOKEN_REGEX = CONFIG['DEFAULT']['auth_token_regex']
 
+PAGE_COUNT_PATTERN = re.compile(PAGE_COUNT_REGEX)
+AUTH_TOKEN_PATTERN = re.compile(AUTH_TOKEN_REGEX)
+DOC_ID_PATTERN = re.compile(r'docsend\.com/view/(?P<doc_id>.*)')
+EMAIL_MARKER = 'visitor[email]'
+PASSCODE_MARKER = 'visitor[passcode]'
+
 
 def get_url_from_id(doc_id):
     """
@@ -36,8 +39,7 @@ def get_id_from_url(url):
     :url: (str) url to be scraped
     :return: (str) id of the document
     """
-    doc_id_regex = r'.*docsend.com/view/(?P<doc_id>.*)'
-    search = re.search(doc_id_regex, url)
+    search = DOC_ID_PATTERN.search(url)
     if search:
         doc_id = search.group('doc_id')
         return doc_id
@@ -52,7 +54,7 @@ def check_passcode_required(document_html):
 
     :return: (bool) if a passcode is required to access document
     """
-    if "visitor[passcode]" in document_html:
+    if PASSCODE_MARKER in document_html:
         return True
     else:
         return False
@@ -67,7 +69,7 @@ def check_email_required(document_text):
 
     :return: (bool) if an email is required to access document
     """
-    if "visitor[email]" in document_text:
+    if EMAIL_MARKER in document_text:
         return True
     else:
         return False
@@ -82,7 +84,7 @@ def find_auth_token(document_html):
 
     :returns: (str) auth token from the document. None if it couldn't find one
     """
-    search_result = re.search(AUTH_TOKEN_REGEX, document_html)
+    search_result = AUTH_TOKEN_PATTERN.search(document_html)
     if search_result:
         return search_result.group('auth_token')
 
@@ -95,6 +97,218 @@ def find_page_count(document_html):
 
     :return: (int) page count
     """
-    search_result = re.search(PAGE_COUNT_REGEX, document_html)
+    search_result = PAGE_COUNT_PATTERN.search(document_html)
     if search_result:
         return int(search_result.group('page_count')) - 1
+
+
+def literal_prefix(regex):
+    """
+    The text every match of a regex starts with, used to find candidate
+    matches with a plain string search, which is much faster than a regex
+    search.
+
+    :regex: (str) regular expression
+
+    :returns: (str) literal prefix of the regex. Empty if it has none.
+    """
+    prefix = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\' and i + 1 < len(regex):
+            escaped = regex[i + 1]
+            if escaped == 'n':
+                prefix.append('\n')
+            elif not escaped.isalnum():
+                prefix.append(escaped)
+            else:
+                break
+            i += 2
+        elif char in '.^$*+?{}[]()|':
+            break
+        else:
+            prefix.append(char)
+            i += 1
+    if i < len(regex) and regex[i] in '*+?{':
+        # The quantifier makes the last character optional
+        prefix = prefix[:-1]
+    return ''.join(prefix)
+
+
+def search_from_prefix(pattern, prefix, text, end):
+    """
+    Same as pattern.search(text, 0, end), but only tries the pattern where
+    its literal prefix is found.
+
+    :returns: (re.Match) first match, None if there is none
+    """
+    if not prefix:
+        return pattern.search(text, 0, end)
+    start = text.find(prefix, 0, end)
+    while start != -1:
+        match = pattern.match(text, start, end)
+        if match:
+            return match
+        start = text.find(prefix, start + 1, end)
+    return None
+
+
+class DocumentInfoParser:
+    """
+    Finds the email and passcode requirements, the page count and the auth
+    token of a document in a single pass over its html. The html can be fed
+    in pieces while it is being downloaded. Only complete lines are searched
+    and each search starts a few lines before the end of the last one, which
+    leaves room for matches that span lines, so the document is not searched
+    again from the start for every field. Once every field is found the rest
+    of the document is not searched at all, and feed returns True so the
+    caller can stop reading it. A missing marker is only known to be missing
+    at the end of the document, so that only happens for documents that ask
+    for both an email and a passcode.
+
+        parser = DocumentInfoParser()
+        for text in pieces:
+            parser.feed(text)
+        fields = parser.close()
+
+    The fields are the same as the ones of check_email_required,
+    check_passcode_required, find_page_count and find_auth_token.
+
+    :keep_html: (bool) keep the pieces fed, see html. The scraper only
+                    needs the fields, so it does not.
+    """
+
+    # A match can span this many lines, so the search resumes this many lines
+    # before the end of the last complete line that was searched.
+    OVERLAP_LINES = max(PAGE_COUNT_PATTERN.pattern.count(r'\n'),
+                        AUTH_TOKEN_PATTERN.pattern.count(r'\n'))
+    PAGE_COUNT_PREFIX = literal_prefix(PAGE_COUNT_REGEX)
+    AUTH_TOKEN_PREFIX = literal_prefix(AUTH_TOKEN_REGEX)
+
+    def __init__(self, keep_html=True):
+        self.keep_html = keep_html
+        self.email_required = False
+        self.passcode_required = False
+        self.page_count = None
+        self.authenticity_token = None
+        self.done = False
+        self._chunks = []
+        # Text from the point the next search starts at
+        self._window = ''
+
+    def feed(self, text):
+        """
+        Searches the next piece of the document.
+
+        :text: (str) next piece of the document html
+
+        :returns: (bool) True once every field has been found
+        """
+        if self.keep_html:
+            self._chunks.append(text)
+        if self.done:
+            return True
+        self._window += text
+        end = self._window.rfind('\n') + 1
+        if end:
+            self._search(end)
+            start = end
+            for _ in range(self.OVERLAP_LINES):
+                start = self._window.rfind('\n', 0, max(0, start - 1)) + 1
+            self._window = self._window[start:]
+        return self.done
+
+    def close(self):
+        """
+        Searches what is left of the document.
+
+        :returns: (dict) email_required, passcode_required, page_count and
+                    authenticity_token of the document
+        """
+        if not self.done:
+            self._search(len(self._window))
+            self._window = ''
+        return {
+            'email_required': self.email_required,
+            'passcode_required': self.passcode_required,
+            'page_count': self.page_count,
+            'authenticity_token': self.authenticity_token,
+        }
+
+    @property
+    def html(self):
+        """
+        The document html fed so far, empty if it is not kept.
+        """
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def _search(self, end):
+        window = self._window
+        if not self.email_required:
+            self.email_required = window.find(EMAIL_MARKER, 0, end) != -1
+        if not self.passcode_required:
+            self.passcode_required = \
+                window.find(PASSCODE_MARKER, 0, end) != -1
+        if self.page_count is None:
+            search = search_from_prefix(PAGE_COUNT_PATTERN,
+                                        self.PAGE_COUNT_PREFIX, window, end)
+            if search:
+                self.page_count = int(search.group('page_count')) - 1
+        if self.authenticity_token is None:
+            search = search_from_prefix(AUTH_TOKEN_PATTERN,
+                                        self.AUTH_TOKEN_PREFIX, window, end)
+            if search:
+                self.authenticity_token = search.group('auth_token')
+        self.done = (self.email_required and self.passcode_required
+                     and self.page_count is not None
+                     and self.authenticity_token is not None)
+
+
+def parse_document_info(document_html):
+    """
+    Finds every field of the document in one pass, see DocumentInfoParser.
+
+    :document_html: (str) text from the view page of the document
+
+    :returns: (dict) email_required, passcode_required, page_count and
+                authenticity_token of the document
+    """
+    parser = DocumentInfoParser()
+    parser.feed(document_html)
+    return parser.close()
+
+
+def parse_page_range(spec, page_count):
+    """
+    Parses a selection of pages like "1-5,12". A part is a page, a range of
+    pages "a-b", or an open range "a-" up to the last page. Ranges are cut
+    at the last page, so "1-5" of a three page document is pages 1 to 3.
+
+    :spec: (str) selection of pages
+    :page_count: (int) number of pages of the document
+
+    :return: (list) page numbers in order, without duplicates
+
+    :raises ValueError: the selection is malformed, names a page past the
+                        end of the document or selects no page
+    """
+    pages = set()
+    for part in spec.split(','):
+        part = part.strip()
+        first, dash, last = part.partition('-')
+        try:
+            first = int(first)
+            last = (int(last) if last.strip() else page_count) if dash \
+                else first
+        except ValueError:
+            raise ValueError(f'Invalid page range "{part}" in "{spec}"')
+        if first < 1 or last < first:
+            raise ValueError(f'Invalid page range "{part}" in "{spec}"')
+        if first > page_count:
+            raise ValueError(f'Page {first} is past the last page '
+                             f'({page_count}) of the document')
+        pages.update(range(first, min(last, page_count) + 1))
+    return sorted(pages)
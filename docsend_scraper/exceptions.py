@@ -20,7 +20,8 @@ class InfoRequiredError(ValueError):
     def __str__(self):
         s = f'Document "{self.doc_id}" requires an email'
         if self.passcode_required:
-            s = f"{s} and a passcode to access."
+            s = f"{s} and a passcode"
+        return f"{s} to access."
 
 
 class AuthError(RuntimeError):
@@ -31,3 +32,6 @@ class AuthError(RuntimeError):
     def __init__(self, response_code, *args, **kwargs):
         self.response_code = response_code
         RuntimeError.__init__(self, *args, **kwargs)
+
+    def __str__(self):
+        return f'Authentication failed with response code {self.response_code}'
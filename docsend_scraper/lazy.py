@@ -0,0 +1,149 @@
+"""
+lazy.py
+
+A document whose pages are only fetched when they are asked for. Previews and
+classifiers often only look at the first few pages of a deck, so nothing is
+requested up front beyond the view page and the authentication.
+"""
+import asyncio
+import collections
+from . import scraper
+
+
+class LazyDocument:
+    """
+    Authenticated document that fetches its pages on demand.
+
+        async with await LazyDocument.open(doc_id, email) as document:
+            cover = await document.page(1)
+            async for page, img_data in document.pages('2-4'):
+                ...
+
+    Concurrent requests for the same page share one fetch. Every fetch goes
+    through the client's scheduler, page cache and retry policy.
+
+    :doc_info: (dict) info of an authenticated document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :keep_pages: (bool) keep fetched pages in memory, so asking for a page
+                    again does not fetch it again
+    """
+
+    def __init__(self, doc_info, client=None, keep_pages=True):
+        self.doc_info = doc_info
+        self.client = scraper.get_default_client() if client is None \
+            else client
+        self.keep_pages = keep_pages
+        self._session = None
+        # page number -> task fetching the page
+        self._pages = {}
+
+    @classmethod
+    async def open(cls, doc_id, email=None, passcode=None, client=None,
+                   keep_pages=True):
+        """
+        Gathers the info of a document and authenticates it.
+
+        :raises InfoRequiredError: the email or passcode is missing
+        :raises AuthError: the server refused the email or passcode
+
+        :returns: (LazyDocument)
+        """
+        doc_info = await scraper.gather_document_info(doc_id, client)
+        await scraper.authenticate_document(doc_info, email, passcode, client)
+        return cls(doc_info, client, keep_pages)
+
+    @property
+    def id(self):
+        return self.doc_info['id']
+
+    @property
+    def page_count(self):
+        return self.doc_info['page_count']
+
+    def __len__(self):
+        return self.page_count
+
+    def _fetch(self, page):
+        if self._session is None:
+            self._session = self.client.session(self.doc_info['cookies'])
+        task = asyncio.ensure_future(scraper.fetch_page(
+            self._session, self.doc_info, page, self.client))
+
+        def done(task):
+            # Failed pages are fetched again the next time they are asked for
+            if not self.keep_pages or task.cancelled() or task.exception():
+                if self._pages.get(page) is task:
+                    del self._pages[page]
+
+        task.add_done_callback(done)
+        self._pages[page] = task
+        return task
+
+    async def page(self, page):
+        """
+        :page: (int) page number. Pages start at 1.
+
+        :returns: (bytes) image file of the page
+
+        :raises IndexError: the document has no such page
+        """
+        if not 1 <= page <= self.page_count:
+            raise IndexError(f'Page {page} is not within the '
+                             f'{self.page_count} pages of the document')
+        task = self._pages.get(page)
+        if task is None:
+            task = self._fetch(page)
+        # A caller that goes away does not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def pages(self, pages=None, reorder_buffer=None):
+        """
+        Async generator of pages in order. Like iter_document_pages, at most
+        reorder_buffer pages are fetched ahead of the one being yielded.
+
+        :pages: (str or iterable) pages to get, e.g. "1-5,12", see
+                    scraper.select_pages. Defaults to every page.
+        :reorder_buffer: (int) max pages fetched ahead. Defaults to the
+                    config.
+
+        :yields: (tuple) page number and the image file of the page
+        """
+        reorder_buffer = scraper.REORDER_BUFFER if reorder_buffer is None \
+            else reorder_buffer
+        selected = iter(scraper.select_pages(self.doc_info, pages))
+        pending = collections.deque()
+
+        def fill():
+            while len(pending) < max(1, reorder_buffer):
+                page = next(selected, None)
+                if page is None:
+                    return
+                pending.append((page, asyncio.ensure_future(self.page(page))))
+
+        try:
+            fill()
+            while pending:
+                page, task = pending.popleft()
+                img_data = await task
+                fill()
+                yield page, img_data
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def close(self):
+        """
+        Stops the fetches still running and closes the session.
+        """
+        for task in list(self._pages.values()):
+            task.cancel()
+        self._pages.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,309 @@
+"""
+metrics.py
+
+Counters, gauges and histograms of what the scraper does, rendered in the
+Prometheus text format, and per stage trace spans.
+
+Every stage of a download (view page, auth post, page_data, image download,
+render, whole document) runs inside `stage`, which times it, counts its
+errors, tracks how many are in flight and hands a Span to the trace hooks.
+
+    metrics.add_trace_hook(lambda span: print(span.to_dict()))
+    metrics.start_trace('request-1')
+    ...
+    print(metrics.REGISTRY.render())
+
+Metrics are kept per process.
+"""
+import time
+import uuid
+import contextlib
+import contextvars
+
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _labels_text(labelnames, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"'
+             for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """
+    Base of the metric types. Values are kept per tuple of label values.
+
+    :name: (str) name of the metric
+    :documentation: (str) help text of the metric
+    :labelnames: (tuple) names of the labels of the metric
+    :registry: (Registry) registry to add the metric to. Defaults to
+                REGISTRY, False to not register it.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry = REGISTRY if registry is None else registry
+        if registry is not False:
+            registry.register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def value(self, **labels):
+        """
+        :returns: the current value for the labels
+        """
+        return self._values.get(self._key(labels), 0)
+
+    def clear(self):
+        self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self._values.items()):
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f'{self.name}{labels} {value}')
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down.
+    """
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, counted in cumulative buckets.
+
+    :buckets: (tuple) upper bounds of the buckets
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            # Bucket counts, then the sum and the count of the values
+            counts = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def value(self, **labels):
+        """
+        :returns: (tuple) count and sum of the values observed for the labels
+        """
+        counts = self._values.get(self._key(labels))
+        return (0, 0) if counts is None else (counts[-1], counts[-2])
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for key, counts in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _labels_text(self.labelnames, key, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _labels_text(self.labelnames, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {counts[-1]}')
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {counts[-2]}')
+            lines.append(f'{self.name}_count{labels} {counts[-1]}')
+        return lines
+
+
+class Registry:
+    """
+    Set of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric "{metric.name}" already registered')
+        self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """
+        :returns: (str) every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    'docsend_stage_seconds', 'Seconds spent in each stage of a download',
+    ('stage',))
+STAGE_ERRORS = Counter(
+    'docsend_stage_errors_total', 'Stages that failed, by error type',
+    ('stage', 'error'))
+IN_FLIGHT = Gauge(
+    'docsend_in_flight', 'Stages running right now', ('stage',))
+BYTES = Counter(
+    'docsend_bytes_total', 'Bytes of html and images received and of pdf '
+    'produced', ('kind',))
+RETRIES = Counter(
+    'docsend_retries_total', 'Requests retried, by the error of the failed '
+    'attempt', ('error',))
+CACHE_LOOKUPS = Counter(
+    'docsend_cache_lookups_total', 'Page lookups in the page cache and the '
+    'spool', ('cache', 'result'))
+SCHEDULER_WAIT = Histogram(
+    'docsend_scheduler_wait_seconds', 'Seconds requests waited for a '
+    'scheduler slot')
+SPILLED_PAGES = Counter(
+    'docsend_spilled_pages_total', 'Pages of the low memory mode written to '
+    'disk until their turn came')
+CONCURRENCY_LIMIT = Gauge(
+    'docsend_concurrency_limit', 'Requests the adaptive scheduler lets in '
+    'flight')
+BACKOFFS = Counter(
+    'docsend_backoffs_total', 'Times the adaptive scheduler lowered its '
+    'limit, by what the server did', ('reason',))
+
+
+class Span:
+    """
+    A finished stage, as handed to the trace hooks.
+
+    :name: (str) name of the stage
+    :trace_id: (str) trace the stage ran in, see start_trace
+    :start: (float) unix time the stage started at
+    :duration: (float) seconds the stage took
+    :error: (str) type of the error the stage raised, None if it did not
+    :attributes: (dict) what the stage worked on, like doc_id and page
+    """
+    __slots__ = ('name', 'trace_id', 'start', 'duration', 'error',
+                 'attributes')
+
+    def __init__(self, name, trace_id, start, duration, error, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.start = start
+        self.duration = duration
+        self.error = error
+        self.attributes = attributes
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+_TRACE_HOOKS = []
+_TRACE_ID = contextvars.ContextVar('docsend_trace_id', default=None)
+
+
+def add_trace_hook(hook):
+    """
+    :hook: (callable) called with every finished Span
+    """
+    _TRACE_HOOKS.append(hook)
+
+
+def remove_trace_hook(hook):
+    _TRACE_HOOKS.remove(hook)
+
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace in the current context. Spans of stages run in this
+    context, or in tasks created from it, carry its id.
+
+    :trace_id: (str) id of the trace. A random one by default.
+
+    :returns: (str) id of the trace
+    """
+    trace_id = uuid.uuid4().hex if trace_id is None else trace_id
+    _TRACE_ID.set(trace_id)
+    return trace_id
+
+
+def current_trace():
+    """
+    :returns: (str) id of the trace of the current context, None if none
+    """
+    return _TRACE_ID.get()
+
+
+@contextlib.contextmanager
+def stage(name, **attributes):
+    """
+    Measures a stage of a download.
+
+        with metrics.stage('image', doc_id=doc_id, page=page):
+            ...
+
+    :name: (str) name of the stage
+    :attributes: added to the span of the stage
+    """
+    start = time.time()
+    started = time.perf_counter()
+    error = None
+    IN_FLIGHT.inc(stage=name)
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        STAGE_ERRORS.inc(stage=name, error=error)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        IN_FLIGHT.dec(stage=name)
+        STAGE_SECONDS.observe(duration, stage=name)
+        if _TRACE_HOOKS:
+            span = Span(name, _TRACE_ID.get(), start, duration, error,
+                        attributes)
+            for hook in _TRACE_HOOKS:
+                hook(span)
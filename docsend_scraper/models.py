@@ -0,0 +1,179 @@
+"""
+models.py
+
+Records of what the scraper knows about a document and its pages. They keep
+only the parsed fields, never the view page html, in __slots__, so a
+document costs a few hundred bytes wherever it is kept or sent.
+
+The records are also mutable mappings of their fields, so code written for
+the dicts gather_document_info used to return keeps working:
+doc_info['page_count'], doc_info.get('cookies_expire') and dict(doc_info).
+A field that was never set is a missing key, like it was in the dicts.
+"""
+from collections.abc import MutableMapping
+
+
+class _Record(MutableMapping):
+    """
+    Mapping over the fields of a slotted record. Subclasses list their
+    fields in FIELDS and use them as their __slots__.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            self[name] = value
+
+    def __getitem__(self, name):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name, value):
+        if name not in self.FIELDS:
+            raise KeyError(f'{type(self).__name__} has no field "{name}"')
+        setattr(self, name, value)
+
+    def __delitem__(self, name):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        try:
+            delattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __iter__(self):
+        return (name for name in self.FIELDS if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={value!r}' for name, value in
+                           self.items())
+        return f'{type(self).__name__}({fields})'
+
+    def to_dict(self):
+        """
+        :returns: (dict) the fields that are set, json serializable
+        """
+        return dict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds a record from to_dict or an old style info dict. Keys that
+        are not fields, like the html of old dicts, are dropped.
+
+        :data: (dict) fields of the record
+
+        :returns: (_Record)
+        """
+        return cls(**{name: value for name, value in data.items()
+                      if name in cls.FIELDS})
+
+
+class PageInfo(_Record):
+    """
+    A page of a document. Fields are filled in as the scraper learns them.
+
+    :page: (int) page number, starting at 1
+    :image_url: (str) signed url of the page image
+    :size: (int) bytes of the page image
+    :sha256: (str) hex sha256 of the page image
+    """
+
+    FIELDS = ('page', 'image_url', 'size', 'sha256')
+    __slots__ = FIELDS
+
+
+class DocumentInfo(_Record):
+    """
+    Info of a document, as returned by gather_document_info.
+
+    :id: (str) id of the document
+    :url: (str) url of the view page
+    :is_valid: (bool) False if the view page could not be loaded, and then
+                    only id and url are set
+    :cookies: (dict) cookies of the document session
+    :cookies_expire: (float) unix timestamp the first cookie expires at,
+                    None if they last for the browser session
+    :email_required: (bool)
+    :passcode_required: (bool)
+    :page_count: (int)
+    :authenticity_token: (str) token of the authentication form
+    :authenticated: (bool) set by authenticate_document
+    :pages: (dict) page number to PageInfo, for the pages known so far
+    """
+
+    FIELDS = ('id', 'url', 'is_valid', 'cookies', 'cookies_expire',
+              'email_required', 'passcode_required', 'page_count',
+              'authenticity_token', 'authenticated', 'pages')
+    __slots__ = FIELDS
+
+    def page(self, page):
+        """
+        Returns the info of a page, added if it was not known yet.
+
+        :page: (int) page number
+
+        :returns: (PageInfo)
+        """
+        if not hasattr(self, 'pages'):
+            self.pages = {}
+        info = self.pages.get(page)
+        if info is None:
+            info = self.pages[page] = PageInfo(page=page)
+        return info
+
+    def to_dict(self):
+        """
+        :returns: (dict) the fields that are set, json serializable. The
+                    pages are a list of their fields.
+        """
+        data = dict(self)
+        if 'pages' in data:
+            data['pages'] = [info.to_dict() for _, info in
+                             sorted(data['pages'].items())]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds the info from to_dict or an old style info dict. Keys that
+        are not fields, like the html of old dicts, are dropped.
+
+        :data: (dict) fields of the info
+
+        :returns: (DocumentInfo)
+        """
+        info = super().from_dict(data)
+        if 'pages' in info:
+            pages = info.pages.values() if isinstance(info.pages, dict) \
+                else info.pages
+            info.pages = {}
+            for page in pages:
+                page = page if isinstance(page, PageInfo) \
+                    else PageInfo.from_dict(page)
+                info.pages[page.page] = page
+        return info
+
+
+def page_info(doc_info, page):
+    """
+    Returns the PageInfo of a page of a document, None if doc_info is a
+    plain dict, which has nowhere to keep it.
+
+    :doc_info: (DocumentInfo or dict) info of the document
+    :page: (int) page number
+
+    :returns: (PageInfo)
+    """
+    if isinstance(doc_info, DocumentInfo):
+        return doc_info.page(page)
+    return None
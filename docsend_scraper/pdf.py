@@ -0,0 +1,328 @@
+"""
+pdf.py
+
+Minimal pdf writer that builds the document one page at a time. Unlike a
+reportlab canvas, nothing is kept in memory once a page has been written,
+only the byte offsets of the objects, so a document can be sent to a client
+or a file while the rest of its pages are still downloading.
+
+Every page is a single image drawn over the whole page, one image pixel to
+one pdf point, which is what the scraper produces.
+
+JPEG and most PNG files are embedded as they came from the server. Only their
+header is read, for the page size, so the pixels are never decoded. Other
+images are decoded with PIL and compressed again.
+"""
+import io
+import json
+import zlib
+import struct
+from collections import namedtuple
+
+
+PdfImage = namedtuple('PdfImage', ['width', 'height', 'color_space',
+                                   'bits', 'filter', 'data', 'decode_parms'])
+PdfImage.__doc__ = """
+Image ready to be written as a pdf image XObject.
+
+:width: (int) width in pixels
+:height: (int) height in pixels
+:color_space: (str) pdf color space name, e.g. DeviceRGB
+:bits: (int) bits per component
+:filter: (str) pdf filter the data is encoded with, e.g. FlateDecode
+:data: (bytes) encoded image data
+:decode_parms: (bytes) pdf DecodeParms dictionary or None
+"""
+
+# Objects with a fixed number, written when the document is closed.
+CATALOG_ID = 1
+PAGES_ID = 2
+INFO_ID = 3
+
+JPEG_COLOR_SPACES = {1: 'DeviceGray', 3: 'DeviceRGB'}
+# PNG color type to pdf color space and number of components
+PNG_COLOR_TYPES = {0: ('DeviceGray', 1), 2: ('DeviceRGB', 3)}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Bytes of raw pixels compressed at a time by decode_image
+STRIP_BYTES = 1024 * 1024
+
+
+def read_jpeg(img_data):
+    """
+    Reads the frame header of a JPEG file so it can be embedded with
+    DCTDecode without decoding it.
+
+    :img_data: (bytes) image file
+
+    :returns: (PdfImage) None if it is not a JPEG that can pass through
+    """
+    if img_data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 4 <= len(img_data):
+        if img_data[i] != 0xFF:
+            return None
+        marker = img_data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Markers without a length
+            i += 2
+            continue
+        length, = struct.unpack('>H', img_data[i + 2:i + 4])
+        # Start of frame markers, except DHT, JPG and DAC
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            bits, height, width, components = struct.unpack(
+                '>BHHB', img_data[i + 4:i + 10])
+            if components not in JPEG_COLOR_SPACES or bits != 8:
+                return None
+            return PdfImage(width, height, JPEG_COLOR_SPACES[components],
+                            bits, 'DCTDecode', img_data, None)
+        if marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        i += 2 + length
+    return None
+
+
+def read_png(img_data):
+    """
+    Reads the chunks of a PNG file and joins its compressed image data so it
+    can be embedded with FlateDecode without decoding it. Only 8 bit, non
+    interlaced gray or RGB images without transparency can pass through.
+
+    :img_data: (bytes) image file
+
+    :returns: (PdfImage) None if it is not a PNG that can pass through
+    """
+    if img_data[:8] != PNG_SIGNATURE:
+        return None
+    i = 8
+    header = None
+    idat = []
+    while i + 8 <= len(img_data):
+        length, chunk_type = struct.unpack('>I4s', img_data[i:i + 8])
+        chunk = img_data[i + 8:i + 8 + length]
+        i += 12 + length
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type in (b'tRNS', b'PLTE'):
+            return None
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+    if header is None or not idat:
+        return None
+    width, height, bits, color_type, _, _, interlace = header
+    if bits != 8 or interlace or color_type not in PNG_COLOR_TYPES:
+        return None
+    color_space, colors = PNG_COLOR_TYPES[color_type]
+    decode_parms = b'<< /Predictor 15 /Colors %d /BitsPerComponent 8 ' \
+        b'/Columns %d >>' % (colors, width)
+    return PdfImage(width, height, color_space, bits, 'FlateDecode',
+                    b''.join(idat), decode_parms)
+
+
+def encode_image(img_data):
+    """
+    Prepares an image file for the pdf. JPEG and simple PNG files are passed
+    through as they are, anything else is decoded and compressed again.
+
+    :img_data: (bytes) image file, any format PIL can read
+
+    :returns: (PdfImage)
+    """
+    image = read_jpeg(img_data) or read_png(img_data)
+    if image is not None:
+        return image
+    return decode_image(img_data)
+
+
+def decode_image(img_data):
+    """
+    Decodes an image file with PIL and encodes its pixels for the pdf. The
+    pixels are compressed a strip of rows at a time, so a raw copy of the
+    whole image is never made next to the decoded one.
+
+    :img_data: (bytes) image file, any format PIL can read
+
+    :returns: (PdfImage)
+    """
+    # PIL is only loaded once a page has to be decoded
+    from PIL import Image
+    with Image.open(io.BytesIO(img_data)) as img:
+        if img.mode.startswith('I'):
+            # 16 bit gray, which convert would clip to white instead of
+            # scaling down to 8 bits
+            img = img.convert('I').point(lambda value: value / 256)
+            img = img.convert('L')
+        if img.mode in ('1', 'L'):
+            mode, color_space = 'L', 'DeviceGray'
+        else:
+            mode, color_space = 'RGB', 'DeviceRGB'
+        if img.mode != mode:
+            img = img.convert(mode)
+        row_bytes = img.width * len(mode)
+        rows = max(1, STRIP_BYTES // max(1, row_bytes))
+        compressor = zlib.compressobj()
+        data = []
+        for top in range(0, img.height, rows):
+            strip = img.crop((0, top, img.width, min(img.height, top + rows)))
+            data.append(compressor.compress(strip.tobytes()))
+        data.append(compressor.flush())
+        return PdfImage(img.width, img.height, color_space, 8,
+                        'FlateDecode', b''.join(data), None)
+
+
+def dump_image(image):
+    """
+    Serializes an encoded image, so pages encoded in one process can be
+    written to a pdf by another.
+
+    :image: (PdfImage) encoded image
+
+    :returns: (bytes)
+    """
+    header = json.dumps({
+        'width': image.width, 'height': image.height,
+        'color_space': image.color_space, 'bits': image.bits,
+        'filter': image.filter,
+        'decode_parms': None if image.decode_parms is None
+        else image.decode_parms.decode('latin-1'),
+    }).encode()
+    return struct.pack('>I', len(header)) + header + image.data
+
+
+def load_image(data):
+    """
+    :data: (bytes) image serialized with dump_image
+
+    :returns: (PdfImage)
+    """
+    length, = struct.unpack('>I', data[:4])
+    header = json.loads(data[4:4 + length])
+    decode_parms = header['decode_parms']
+    return PdfImage(header['width'], header['height'], header['color_space'],
+                    header['bits'], header['filter'], data[4 + length:],
+                    None if decode_parms is None
+                    else decode_parms.encode('latin-1'))
+
+
+def _escape(text):
+    text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return text.encode('latin-1', errors='replace')
+
+
+class PdfWriter:
+    """
+    Builds a pdf incrementally. Each method returns the bytes that come next
+    in the file, so the caller decides where they go.
+
+        writer = PdfWriter(title)
+        f.write(writer.header())
+        for img_data in pages:
+            f.write(writer.page(img_data))
+        f.write(writer.trailer())
+
+    :title: (str) title stored in the document info
+    """
+
+    def __init__(self, title=None):
+        self.title = title
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self._next_id = INFO_ID + 1
+
+    def _object(self, obj_id, body, stream=None):
+        out = [b'%d 0 obj\n' % obj_id, body]
+        if stream is not None:
+            out += [b'\nstream\n', stream, b'\nendstream']
+        out.append(b'\nendobj\n')
+        self.offsets[obj_id] = self.offset
+        chunk = b''.join(out)
+        self.offset += len(chunk)
+        return chunk
+
+    def _new_id(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def header(self):
+        """
+        :returns: (bytes) start of the file
+        """
+        chunk = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.offset += len(chunk)
+        return chunk
+
+    def page(self, image):
+        """
+        Adds a page showing a single image.
+
+        :image: (bytes or PdfImage) image file or an already encoded image
+
+        :returns: (bytes) the objects of the page
+        """
+        if not isinstance(image, PdfImage):
+            image = encode_image(image)
+        image_id, content_id, page_id = (self._new_id() for _ in range(3))
+        self.page_ids.append(page_id)
+
+        decode_parms = b''
+        if image.decode_parms is not None:
+            decode_parms = b'/DecodeParms ' + image.decode_parms + b' '
+        image_dict = (
+            b'<< /Type /XObject /Subtype /Image /Width %d /Height %d '
+            b'/ColorSpace /%s /BitsPerComponent %d /Filter /%s %s'
+            b'/Length %d >>' % (image.width, image.height,
+                                image.color_space.encode(), image.bits,
+                                image.filter.encode(), decode_parms,
+                                len(image.data)))
+        content = b'q %d 0 0 %d 0 0 cm /Im0 Do Q' % (image.width,
+                                                      image.height)
+        page_dict = (
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /XObject << /Im0 %d 0 R >> >> '
+            b'/Contents %d 0 R >>' % (PAGES_ID, image.width, image.height,
+                                      image_id, content_id))
+        return b''.join([
+            self._object(image_id, image_dict, image.data),
+            self._object(content_id, b'<< /Length %d >>' % len(content),
+                         content),
+            self._object(page_id, page_dict),
+        ])
+
+    def trailer(self):
+        """
+        Writes the page tree, catalog, info and cross reference table.
+
+        :returns: (bytes) end of the file
+        """
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        info = b'<< /Producer (docsend_scraper)'
+        if self.title is not None:
+            info += b' /Title (' + _escape(self.title) + b')'
+        info += b' >>'
+        chunks = [
+            self._object(PAGES_ID, b'<< /Type /Pages /Kids [%s] /Count %d >>'
+                         % (kids, len(self.page_ids))),
+            self._object(CATALOG_ID,
+                         b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES_ID),
+            self._object(INFO_ID, info),
+        ]
+
+        size = self._next_id
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for obj_id in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self.offsets[obj_id])
+        chunks += xref
+        chunks.append(
+            b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\n'
+            b'startxref\n%d\n%%%%EOF\n' % (size, CATALOG_ID, INFO_ID,
+                                           self.offset))
+        return b''.join(chunks)
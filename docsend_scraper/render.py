@@ -0,0 +1,104 @@
+"""
+render.py
+
+Runs the cpu heavy part of building a pdf, decoding and encoding page images,
+away from the event loop so a large document does not stall every other
+download. The executor is picked in the [render] section of config.ini:
+
+    * none: run on the event loop thread
+    * thread: run in a thread pool
+    * process: run in a process pool, so documents scale across cores
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .config import get_config
+
+
+CONFIG = get_config()
+
+EXECUTOR = CONFIG['render']['executor']
+WORKERS = CONFIG.getint('render', 'workers')
+
+EXECUTOR_KINDS = ('none', 'thread', 'process')
+
+
+class Renderer:
+    """
+    Runs render work in the configured executor.
+
+    Work given to `run` may be sent to another process, so the function and
+    its arguments must be picklable. Work on objects that can not leave the
+    process, like a reportlab canvas, goes through `run_in_thread`.
+
+    :executor: (str) one of none, thread or process
+    :workers: (int) size of the pool. 0 uses the number of cpus.
+    """
+
+    def __init__(self, executor=None, workers=None):
+        executor = EXECUTOR if executor is None else executor
+        if executor not in EXECUTOR_KINDS:
+            raise ValueError(f'Unknown render executor "{executor}"')
+        self.executor = executor
+        self.workers = (WORKERS if workers is None else workers) or None
+        self._pool = None
+        self._thread_pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.executor == 'process':
+                self._pool = ProcessPoolExecutor(self.workers)
+            elif self.executor == 'thread':
+                self._pool = self.thread_pool
+        return self._pool
+
+    @property
+    def thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.workers)
+        return self._thread_pool
+
+    async def run(self, fn, *args):
+        """
+        Runs fn(*args) in the executor and returns its result.
+        """
+        if self.executor == 'none':
+            return fn(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool,
+                                          functools.partial(fn, *args))
+
+    async def run_in_thread(self, fn, *args):
+        """
+        Runs fn(*args) in a thread, or inline if the executor is none.
+        """
+        if self.executor == 'none':
+            return fn(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.thread_pool,
+                                          functools.partial(fn, *args))
+
+    def close(self):
+        """
+        Shuts the pools down, waiting for running work to finish.
+        """
+        for pool in (self._pool, self._thread_pool):
+            if pool is not None:
+                pool.shutdown()
+        self._pool = self._thread_pool = None
+
+
+_DEFAULT_RENDERER = None
+
+
+def get_default_renderer():
+    """
+    Returns the module level renderer used when no renderer is given.
+
+    :returns: (Renderer)
+    """
+    global _DEFAULT_RENDERER
+    if _DEFAULT_RENDERER is None:
+        _DEFAULT_RENDERER = Renderer()
+    return _DEFAULT_RENDERER
@@ -0,0 +1,92 @@
+"""
+retry.py
+
+Retries of failed requests with exponential backoff and jitter, so a single
+transient error does not throw away the rest of a download.
+
+A Retry-After sent with a failed response is honored by the scheduler, which
+holds every request until it has passed, not only the one that is retried.
+"""
+import time
+import random
+import asyncio
+import aiohttp
+from email.utils import parsedate_to_datetime
+from . import metrics
+
+
+# Responses worth asking for again
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_retryable(error):
+    """
+    :error: (Exception) error raised by a request
+
+    :returns: (bool) True if the request may succeed when sent again
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def retry_after(headers):
+    """
+    :headers: (multidict) headers of a response
+
+    :returns: (float) seconds the Retry-After header asks to wait, given as
+                seconds or as a date. None if there is none or it is invalid.
+    """
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Calls a coroutine function until it succeeds or runs out of attempts.
+    The wait before retry n is a random time between 0 and
+    min(max_delay, base_delay * 2 ** (n - 1)), which keeps many failing
+    requests from retrying in lock step.
+
+    :attempts: (int) max number of calls. 1 means no retries.
+    :base_delay: (float) seconds of the first backoff
+    :max_delay: (float) max seconds of a backoff
+    """
+
+    def __init__(self, attempts=1, base_delay=0.5, max_delay=10):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """
+        :attempt: (int) number of retries made so far
+
+        :returns: (float) seconds to wait before the next attempt
+        """
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, fn, *args, **kwargs):
+        """
+        Awaits fn(*args, **kwargs), retrying on retryable errors.
+
+        :returns: the result of fn
+        """
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.attempts or not is_retryable(e):
+                    raise
+                metrics.RETRIES.inc(error=type(e).__name__)
+                await asyncio.sleep(self.delay(attempt - 1))
@@ -0,0 +1,424 @@
+"""
+scheduler.py
+
+Limits how much work the scraper sends to the server at once. Every request
+takes a slot from the scheduler before it goes out. A slot is only given when
+the global, per document and per host caps all have room and, if a request
+rate is set, when the token bucket has a token.
+
+A cap or rate of 0 means no limit.
+
+The global cap can be an AdaptiveLimit, which shrinks when the server answers
+429s or 5xx, fails to answer or slows down, and grows back once it copes
+again. A Retry-After sent with a 429 or 503 holds every new request until it
+has passed. Since one client, and so one scheduler, is shared by every
+download of a process, they all back off together.
+"""
+import time
+import asyncio
+import collections
+from urllib.parse import urlsplit
+import aiohttp
+from . import metrics
+from .retry import is_retryable, retry_after, RETRY_STATUSES
+
+
+# Fewest responses whose latency is averaged before it is compared to the
+# usual latency
+MIN_ROUND = 8
+# Share of the gap the usual latency moves up by every round, so a server
+# that got slower for good is not taken as overloaded forever
+BASELINE_DRIFT = 0.05
+
+
+class TokenBucket:
+    """
+    Simple token bucket used to cap the requests per second.
+
+    :rate: (float) tokens added per second
+    :burst: (int) max tokens the bucket holds. Defaults to rate.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = max(1, burst if burst is not None else int(rate))
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self):
+        """
+        Waits until a token is available and takes it.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class AdaptiveLimit:
+    """
+    Cap on the requests in flight that follows how the server copes,
+    additive increase, multiplicative decrease style. Every response that
+    comes back in time while the limit was reached adds 1/limit, so a limit
+    in use grows by one per round of limit responses. A 429, a 5xx, a
+    failed request or a round whose mean latency is latency_factor times the
+    usual one multiplies the limit by decrease, at most once per round trip,
+    so a burst of failures of the same round only counts once.
+
+    :max_limit: (int) largest limit, and the one it starts at
+    :min_limit: (int) smallest limit
+    :decrease: (float) factor the limit is multiplied by on overload
+    :latency_factor: (float) mean latency of a round, as a multiple of the
+                usual one, that counts as overload. 0 to ignore latency.
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease=0.5,
+                 latency_factor=3):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._waiters = collections.deque()
+        self._last_decrease = 0
+        self._round_count = 0
+        self._round_total = 0
+        # Mean latency of the last round and the lowest one seen
+        self._round_latency = None
+        self._baseline = None
+
+    @property
+    def waiting(self):
+        """
+        :returns: (int) requests waiting for room under the limit
+        """
+        return len(self._waiters)
+
+    async def acquire(self):
+        """
+        Waits until the requests in flight are under the limit.
+        """
+        woken = False
+        while True:
+            if self.in_flight < int(self.limit) \
+                    and (woken or not self._waiters):
+                self.in_flight += 1
+                return
+            future = asyncio.get_event_loop().create_future()
+            # A waiter that lost its room to a new request keeps its place
+            if woken:
+                self._waiters.appendleft(future)
+            else:
+                self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                elif not future.cancelled():
+                    # Woken just before being cancelled, the room goes on
+                    self._wake()
+                raise
+            woken = True
+
+    def release(self, overload=None, latency=None):
+        """
+        Gives the room of a request back and adapts the limit to how it went.
+
+        :overload: (str) why the request counts as overload, None if it did
+                    not
+        :latency: (float) seconds the request took, if it got an answer in
+                    time. Not given for requests that were cancelled.
+        """
+        # Only a limit that was reached has shown it is not too low
+        limited = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if overload is not None:
+            self._decrease(overload)
+        elif latency is not None:
+            if self._slow_round(latency):
+                self._decrease('latency')
+            elif limited:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        metrics.CONCURRENCY_LIMIT.set(int(self.limit))
+        self._wake()
+
+    def _slow_round(self, latency):
+        """
+        Adds a latency to the current round.
+
+        :returns: (bool) True if the round ended and was slow
+        """
+        self._round_count += 1
+        self._round_total += latency
+        if self._round_count < max(MIN_ROUND, int(self.limit)):
+            return False
+        mean = self._round_total / self._round_count
+        self._round_count = self._round_total = 0
+        self._round_latency = mean
+        if self._baseline is None or mean < self._baseline:
+            self._baseline = mean
+        else:
+            self._baseline += (mean - self._baseline) * BASELINE_DRIFT
+        return bool(self.latency_factor) \
+            and mean > self._baseline * self.latency_factor
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        round_trip = 1 if self._round_latency is None \
+            else self._round_latency
+        if now - self._last_decrease < round_trip:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        metrics.BACKOFFS.inc(reason=reason)
+
+    def _wake(self):
+        room = int(self.limit) - self.in_flight
+        while room > 0 and self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                room -= 1
+
+
+def overload_reason(status, error=None):
+    """
+    :status: (int) status of the response, None if there was none
+    :error: (Exception) error the request raised
+
+    :returns: (str) why the request shows the server is overloaded, None if
+                it does not
+    """
+    if status == 429:
+        return 'throttled'
+    if status is not None and status >= 500:
+        return 'server_error'
+    if status is None and error is not None and is_retryable(error):
+        return 'connection'
+    return None
+
+
+class _Limit:
+    """
+    Semaphore that is dropped by its owner once nobody is using it.
+    """
+
+    def __init__(self, size):
+        self.semaphore = asyncio.Semaphore(size)
+        self.users = 0
+
+
+class _Slot:
+    """
+    Async context manager returned by Scheduler.slot.
+    """
+
+    def __init__(self, scheduler, doc_id, host):
+        self.scheduler = scheduler
+        self.doc_id = doc_id
+        self.host = host
+        self._held = []
+        self._adaptive = False
+        self._started = None
+        self._status = None
+        self._headers = None
+
+    def report(self, response):
+        """
+        Tells the scheduler how a request went when its response is not
+        raised as an error, see Scheduler.slot.
+
+        :response: (aiohttp.ClientResponse) response of the request
+        """
+        self._status = response.status
+        self._headers = response.headers
+
+    async def __aenter__(self):
+        scheduler = self.scheduler
+        started = time.perf_counter()
+        scheduler.waiting += 1
+        try:
+            await self._acquire()
+        finally:
+            scheduler.waiting -= 1
+        self._started = time.perf_counter()
+        metrics.SCHEDULER_WAIT.observe(self._started - started)
+        return self
+
+    async def _acquire(self):
+        scheduler = self.scheduler
+        await scheduler.wait_retry_after()
+        # Narrowest limit first so a request waiting on its own document
+        # does not hold one of the global slots.
+        limits = [
+            (scheduler._documents, self.doc_id, scheduler.max_per_document),
+            (scheduler._hosts, self.host, scheduler.max_per_host),
+        ]
+        try:
+            for registry, key, size in limits:
+                if key is None or not size:
+                    continue
+                limit = registry.get(key)
+                if limit is None:
+                    limit = registry[key] = _Limit(size)
+                limit.users += 1
+                try:
+                    await limit.semaphore.acquire()
+                except BaseException:
+                    self._drop(registry, key, limit)
+                    raise
+                self._held.append((registry, key, limit))
+
+            if scheduler.adaptive is not None:
+                await scheduler.adaptive.acquire()
+                self._adaptive = True
+            elif scheduler.max_concurrency:
+                await scheduler._global.acquire()
+                self._held.append((None, None, None))
+
+            if scheduler.bucket is not None:
+                await scheduler.bucket.acquire()
+        except BaseException:
+            self._release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        status, headers = self._status, self._headers
+        if isinstance(exc, aiohttp.ClientResponseError):
+            status, headers = exc.status, exc.headers
+        if status in RETRY_STATUSES and headers is not None:
+            seconds = retry_after(headers)
+            if seconds:
+                self.scheduler.pause(seconds)
+        overload = overload_reason(status, exc)
+        latency = None
+        if overload is None and (exc is None or status is not None):
+            latency = time.perf_counter() - self._started
+        self._release(overload, latency)
+
+    def _release(self, overload=None, latency=None):
+        if self._adaptive:
+            self._adaptive = False
+            self.scheduler.adaptive.release(overload, latency)
+        while self._held:
+            registry, key, limit = self._held.pop()
+            if registry is None:
+                self.scheduler._global.release()
+            else:
+                limit.semaphore.release()
+                self._drop(registry, key, limit)
+
+    @staticmethod
+    def _drop(registry, key, limit):
+        limit.users -= 1
+        if limit.users == 0:
+            del registry[key]
+
+
+class Scheduler:
+    """
+    Bounds the number of concurrent requests globally, per document and per
+    host, and optionally the number of requests per second.
+
+    :max_concurrency: (int) max requests in flight overall
+    :max_per_document: (int) max requests in flight for a single document
+    :max_per_host: (int) max requests in flight to a single host
+    :requests_per_second: (float) max rate of new requests. 0 for no limit.
+    :adaptive: (AdaptiveLimit) cap on the requests in flight overall that
+                takes the place of max_concurrency
+    :max_retry_after: (float) longest Retry-After honored, in seconds
+    """
+
+    def __init__(self, max_concurrency=0, max_per_document=0, max_per_host=0,
+                 requests_per_second=0, adaptive=None, max_retry_after=120):
+        self.max_concurrency = max_concurrency
+        self.max_per_document = max_per_document
+        self.max_per_host = max_per_host
+        self.bucket = TokenBucket(requests_per_second) \
+            if requests_per_second else None
+        self.adaptive = adaptive
+        self.max_retry_after = max_retry_after
+        # Requests waiting for a slot
+        self.waiting = 0
+        # Monotonic time until which no request goes out, see pause
+        self.paused_until = 0
+        self._global_semaphore = None
+        self._documents = {}
+        self._hosts = {}
+
+    def pause(self, seconds):
+        """
+        Holds every new request for a while, as asked by a Retry-After.
+
+        :seconds: (float) how long, capped at max_retry_after
+        """
+        seconds = min(seconds, self.max_retry_after)
+        self.paused_until = max(self.paused_until,
+                                time.monotonic() + seconds)
+
+    def retry_after(self):
+        """
+        :returns: (float) seconds left until requests go out again, 0 if
+                    they are not held
+        """
+        return max(0, self.paused_until - time.monotonic())
+
+    async def wait_retry_after(self):
+        """
+        Waits until a pause asked for by the server has passed.
+        """
+        while True:
+            seconds = self.retry_after()
+            if not seconds:
+                return
+            await asyncio.sleep(seconds)
+
+    def overloaded(self, max_waiting):
+        """
+        :max_waiting: (int) requests that may wait for a slot before the
+                    scheduler counts as overloaded. 0 for no limit.
+
+        :returns: (bool) True if the server asked to hold requests, or too
+                    many are waiting for a slot
+        """
+        return bool(self.retry_after()) \
+            or bool(max_waiting and self.waiting > max_waiting)
+
+    @property
+    def _global(self):
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._global_semaphore
+
+    def slot(self, doc_id=None, url=None):
+        """
+        Returns an async context manager that holds a slot for one request.
+
+            async with scheduler.slot(doc_id, url) as slot:
+                async with session.get(url) as response:
+                    slot.report(response)
+
+        How the request went adapts the AdaptiveLimit, if any. A request
+        that raised an aiohttp.ClientResponseError is judged by its status,
+        one that did not by the response given to report, if any.
+
+        :doc_id: (str) id of the document the request is for
+        :url: (str) url that will be requested. Used for the per host cap.
+
+        :returns: (async context manager)
+        """
+        host = urlsplit(url).netloc if url else None
+        return _Slot(self, doc_id, host)
@@ -1,28 +1,184 @@
 import os
 import io
-import json
+import codecs
+import shutil
+import time
 import asyncio
-import requests
+import collections
 import aiohttp
-from PIL import Image
-from configparser import ConfigParser
-from reportlab.pdfgen import canvas
+from yarl import URL
+from email.utils import parsedate_to_datetime
+from .config import get_config, get_headers
 from .exceptions import InfoRequiredError, AuthError
+from .models import DocumentInfo, page_info
 from . import doc_info
+from .doc_info import parse_page_range
+from .scheduler import Scheduler, AdaptiveLimit
+from .pdf import PdfWriter, encode_image
+from .render import Renderer, get_default_renderer
+from .cache import PageCache, PdfCache
+from .retry import RetryPolicy
+from .spool import PageSpool
+from .spill import SpillBuffer, parse_size
+from .sinks import ZipWriter, OUTPUT_FORMATS, page_filename, \
+    check_output_format
+from . import metrics
 
 
 __root_location__ = os.path.realpath(os.path.dirname(__file__))
-CONFIG = ConfigParser()
-
-CONFIG.read(os.path.join(__root_location__, 'config.ini'))
+CONFIG = get_config()
 
 BASE_URL = CONFIG['DEFAULT']['base_url']
 REQUEST_HEADERS_FILE_LOC = CONFIG['DEFAULT']['request_headers_file']
 
+CONNECTION_LIMIT = CONFIG.getint('client', 'connection_limit')
+CONNECTION_LIMIT_PER_HOST = CONFIG.getint('client', 'connection_limit_per_host')
+KEEPALIVE_TIMEOUT = CONFIG.getfloat('client', 'keepalive_timeout')
+
+MAX_CONCURRENCY = CONFIG.getint('scheduler', 'max_concurrency')
+MAX_PER_DOCUMENT = CONFIG.getint('scheduler', 'max_per_document')
+MAX_PER_HOST = CONFIG.getint('scheduler', 'max_per_host')
+REQUESTS_PER_SECOND = CONFIG.getfloat('scheduler', 'requests_per_second')
+ADAPTIVE = CONFIG.getboolean('scheduler', 'adaptive')
+MIN_CONCURRENCY = CONFIG.getint('scheduler', 'min_concurrency')
+LATENCY_FACTOR = CONFIG.getfloat('scheduler', 'latency_factor')
+MAX_RETRY_AFTER = CONFIG.getfloat('scheduler', 'max_retry_after')
+
+REORDER_BUFFER = CONFIG.getint('pipeline', 'reorder_buffer')
+SPOOL_DIR = CONFIG['pipeline']['spool_dir']
+MAX_MEMORY = parse_size(CONFIG['pipeline']['max_memory'] or 0)
+SPILL_DIR = CONFIG['pipeline']['spill_dir']
+
+RETRY_ATTEMPTS = CONFIG.getint('retry', 'attempts')
+RETRY_BASE_DELAY = CONFIG.getfloat('retry', 'base_delay')
+RETRY_MAX_DELAY = CONFIG.getfloat('retry', 'max_delay')
+
+PAGE_CACHE_DIR = CONFIG['cache']['page_cache_dir']
+PAGE_CACHE_MAX_BYTES = CONFIG.getint('cache', 'page_cache_max_bytes')
+PDF_CACHE_DIR = CONFIG['cache']['pdf_cache_dir']
+PDF_CACHE_MAX_BYTES = CONFIG.getint('cache', 'pdf_cache_max_bytes')
+
+# Size of the pieces the document html is read in
+HTML_CHUNK_SIZE = 64 * 1024
+
+
+def __getattr__(name):
+    # The headers are only read from their file once a request needs them
+    if name == 'HEADERS':
+        return get_headers()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class DocsendClient:
+    """
+    Long lived, connection pooled http client shared by every fetch in the
+    scraper. All sessions handed out by the client share one connector, so
+    the page_data requests and image downloads of every document reuse the
+    same keep-alive connections instead of doing a new handshake per image.
+
+    Each call to `session` returns a light weight aiohttp.ClientSession with
+    its own cookie jar, so cookies of different documents never mix.
+
+    :limit: (int) max number of open connections across all hosts
+    :limit_per_host: (int) max number of open connections to a single host
+    :keepalive_timeout: (float) seconds an idle connection is kept open
+    :scheduler: (Scheduler) caps the requests in flight. Defaults to one
+                    built from the [scheduler] section of config.ini, shared
+                    by every download made with the client.
+    :page_cache: (PageCache) cache of page images. Defaults to one in the
+                    page_cache_dir of config.ini, if set.
+    :retry: (RetryPolicy) how failed page fetches are retried. Defaults to
+                    one built from the [retry] section of config.ini.
+    """
+
+    def __init__(self, limit=None, limit_per_host=None,
+                 keepalive_timeout=None, scheduler=None, page_cache=None,
+                 retry=None):
+        self.limit = CONNECTION_LIMIT if limit is None else limit
+        self.limit_per_host = CONNECTION_LIMIT_PER_HOST \
+            if limit_per_host is None else limit_per_host
+        self.keepalive_timeout = KEEPALIVE_TIMEOUT \
+            if keepalive_timeout is None else keepalive_timeout
+        if scheduler is None:
+            adaptive = None
+            if ADAPTIVE and MAX_CONCURRENCY:
+                adaptive = AdaptiveLimit(MAX_CONCURRENCY, MIN_CONCURRENCY,
+                                         latency_factor=LATENCY_FACTOR)
+            scheduler = Scheduler(MAX_CONCURRENCY, MAX_PER_DOCUMENT,
+                                  MAX_PER_HOST, REQUESTS_PER_SECOND,
+                                  adaptive, MAX_RETRY_AFTER)
+        self.scheduler = scheduler
+        if page_cache is None and PAGE_CACHE_DIR:
+            page_cache = PageCache(PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES)
+        self.page_cache = page_cache
+        if retry is None:
+            retry = RetryPolicy(RETRY_ATTEMPTS, RETRY_BASE_DELAY,
+                                RETRY_MAX_DELAY)
+        self.retry = retry
+        self._connector = None
+        self._loop = None
+
+    @property
+    def connector(self):
+        """
+        The shared aiohttp.TCPConnector. It is created on first use since it
+        has to be bound to the running event loop.
+        """
+        loop = asyncio.get_event_loop()
+        if self._connector is None or self._connector.closed \
+                or self._loop is not loop:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout)
+            self._loop = loop
+        return self._connector
+
+    def session(self, cookies=None):
+        """
+        Creates a session that uses the shared connection pool.
+
+        :cookies: (dict) cookies to start the session's cookie jar with
+
+        :returns: (aiohttp.ClientSession)
+        """
+        # unsafe allows cookies from hosts given as an ip address
+        cookie_jar = aiohttp.CookieJar(unsafe=True)
+        return aiohttp.ClientSession(connector=self.connector,
+                                     connector_owner=False,
+                                     cookie_jar=cookie_jar,
+                                     headers=get_headers(),
+                                     cookies=cookies)
+
+    async def close(self):
+        """
+        Closes every pooled connection.
+        """
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
+        self._connector = None
 
-# Load headers that will be used with all the queries
-with open(os.path.join(__root_location__, REQUEST_HEADERS_FILE_LOC), 'r') as f:
-    HEADERS = json.load(f)
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_DEFAULT_CLIENT = None
+
+
+def get_default_client():
+    """
+    Returns the module level client used when no client is given to a
+    function.
+
+    :returns: (DocsendClient)
+    """
+    global _DEFAULT_CLIENT
+    if _DEFAULT_CLIENT is None:
+        _DEFAULT_CLIENT = DocsendClient()
+    return _DEFAULT_CLIENT
 
 
 def is_valid_doc_id(doc_id, request_response=None):
@@ -30,89 +186,165 @@ def is_valid_doc_id(doc_id, request_response=None):
     Attempts to pull the main page of the doc with doc_id. If it fails,
     this returns false.
 
+    Note: This blocks. Use is_valid_doc_id_async from inside a coroutine.
+
     :doc_id: (str) id of the document
     :request_response: (requests.response) Option response in case this action
                             was already performed elsewhere.
 
     :returns: (bool) True if the request was successful
     """
-    if request_response is None:
+    resp = request_response
+    if resp is None:
+        # Only this blocking helper needs requests, it is not loaded before
+        import requests
         doc_url = doc_info.get_url_from_id(doc_id)
-        resp = requests.get(doc_url, headers=HEADERS)
+        resp = requests.get(doc_url, headers=get_headers())
     if resp.status_code == 200:
         return True
     else:
         return False
 
 
-async def get_document_html(doc_id):
+async def is_valid_doc_id_async(doc_id, client=None):
+    """
+    Same as is_valid_doc_id but does not block the event loop.
+
+    :doc_id: (str) id of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+
+    :returns: (bool) True if the request was successful
+    """
+    client = get_default_client() if client is None else client
+    doc_url = doc_info.get_url_from_id(doc_id)
+    async with client.session() as session:
+        async with session.get(doc_url) as resp:
+            return resp.status == 200
+
+
+def _session_cookies(session, url):
+    """
+    Returns the cookies a session holds for url as a plain dict so they can be
+    handed to the next session that works on the same document.
+    """
+    cookies = session.cookie_jar.filter_cookies(URL(url))
+    return {name: morsel.value for name, morsel in cookies.items()}
+
+
+def _cookies_expire(response_cookies):
+    """
+    Returns when the first of the cookies set by a response expires, as a
+    unix timestamp. None if they all last for the browser session.
+    """
+    expires = []
+    for morsel in response_cookies.values():
+        try:
+            if morsel['max-age']:
+                expires.append(time.time() + int(morsel['max-age']))
+            elif morsel['expires']:
+                expires.append(
+                    parsedate_to_datetime(morsel['expires']).timestamp())
+        except (TypeError, ValueError):
+            continue
+    return min(expires) if expires else None
+
+
+async def get_document_html(doc_id, client=None):
     """
     Requests the main html page of the document. Mainly used to collect
     information about the document to be scraped.
 
     :doc_id: (str) id of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
     """
+    client = get_default_client() if client is None else client
     doc_url = doc_info.get_url_from_id(doc_id)
-    document_url_response = requests.get(doc_url, headers=HEADERS)
-    document_html = document_url_response.text
-    return document_html
+    async with client.session() as session:
+        async with session.get(doc_url) as document_url_response:
+            return await document_url_response.text()
 
 
-async def gather_document_info(doc_id):
+async def gather_document_info(doc_id, client=None):
     """
     Collects all the needed information from the document text to be used
         in other parts of the program.
 
     Note: If doc_id is invalid, this will reponse with is_valid being False.
+    The html of the view page is only searched, it is not kept.
 
     :doc_id: (str) id of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
 
-    :returns: (dict) document information
+    :returns: (DocumentInfo) document information
     """
+    client = get_default_client() if client is None else client
     doc_url = doc_info.get_url_from_id(doc_id)
-    document_url_response = requests.get(doc_url, headers=HEADERS)
-    if document_url_response.status_code == 200:
-        document_html = document_url_response.text
-        cookies = document_url_response.cookies
-
-        # Check Authentication requirements
-        passcode_required = doc_info.check_passcode_required(document_html)
-        email_required = doc_info.check_email_required(document_html)
-
-        info = {
-            'id': doc_id,
-            'url': doc_url,
-            'html': document_html,
-            'cookies': cookies,
-            'email_required': email_required,
-            'passcode_required': passcode_required,
-            'page_count': doc_info.find_page_count(document_html),
-            'authenticity_token': doc_info.find_auth_token(document_html),
-            'is_valid': True
-        }
+    async with client.session() as session, \
+            client.scheduler.slot(doc_id, doc_url) as slot:
+        with metrics.stage('view', doc_id=doc_id):
+            async with session.get(doc_url) as document_url_response:
+                slot.report(document_url_response)
+                status = document_url_response.status
+                if status == 200:
+                    # The html is searched as it arrives instead of once it
+                    # is all in, see doc_info.DocumentInfoParser
+                    parser = doc_info.DocumentInfoParser(keep_html=False)
+                    encoding = document_url_response.charset or 'utf-8'
+                    decoder = codecs.getincrementaldecoder(encoding)()
+                    content = document_url_response.content
+                    async for data in content.iter_chunked(HTML_CHUNK_SIZE):
+                        metrics.BYTES.inc(len(data), kind='html')
+                        if parser.feed(decoder.decode(data)):
+                            # Every field is found, which only happens for
+                            # documents that ask for an email and a
+                            # passcode. The rest of the page is not read.
+                            break
+                    else:
+                        parser.feed(decoder.decode(b'', final=True))
+                cookies_expire = _cookies_expire(
+                    document_url_response.cookies)
+        cookies = _session_cookies(session, doc_url)
+
+    if status == 200:
+        fields = parser.close()
+        info = DocumentInfo(
+            id=doc_id,
+            url=doc_url,
+            cookies=cookies,
+            cookies_expire=cookies_expire,
+            email_required=fields['email_required'],
+            passcode_required=fields['passcode_required'],
+            page_count=fields['page_count'],
+            authenticity_token=fields['authenticity_token'],
+            is_valid=True
+        )
     else:
-        info = {
-            'id': doc_id,
-            'url': doc_url,
-            'is_valid': False
-        }
+        info = DocumentInfo(
+            id=doc_id,
+            url=doc_url,
+            is_valid=False
+        )
 
     return info
 
 
-def authenticate_cookie(doc_info, cookies, authenticity_token,
-                        email, passcode=None):
+async def authenticate_cookie(doc_info, cookies, authenticity_token,
+                              email, passcode=None, client=None):
     """
     Registers the email and optionally a passcode with docsend to
     get the document.
 
+    Any cookie the server sets while authenticating is added to cookies, so
+    the same dict can be used for the page_data and image requests after.
+
     :doc_info: (dict) dict containing the url of the document
     :cookies: (dict) cookies to authenticate
     :authenticity_token: (str) authenticity token taken from the document html
     :email: (str) email to use in auth
     :passcode: (str) Optional passcode to auth
+    :client: (DocsendClient) client to use. Defaults to the shared client.
 
-    :returns: (request.Response)
+    :returns: (aiohttp.ClientResponse) response with its body already read
     """
     form_data = {
         "utf8": "✓",
@@ -125,81 +357,727 @@ def authenticate_cookie(doc_info, cookies, authenticity_token,
     if passcode is not None:
         form_data['visitor[passcode]'] = passcode
 
+    client = get_default_client() if client is None else client
     doc_url = doc_info['url']
-    document_url_response = requests.post(
-        doc_url, headers=HEADERS, data=form_data, cookies=cookies)
+    async with client.session(cookies) as session, \
+            client.scheduler.slot(doc_info['id'], doc_url) as slot:
+        with metrics.stage('auth', doc_id=doc_info['id']):
+            async with session.post(doc_url, data=form_data) \
+                    as document_url_response:
+                slot.report(document_url_response)
+                await document_url_response.read()
+        cookies.update(_session_cookies(session, doc_url))
 
     return document_url_response
 
 
-async def get_document_img_urls(doc_info):
+async def get_page_image_url(session, doc_info, page, client=None):
+    """
+    Requests the page_data of a single page and returns its image url.
+
+    :session: (aiohttp.ClientSession) session holding the document cookies
+    :doc_info: (dict) dict containing the info of the document
+    :page: (int) page number. Pages start at 1.
+    :client: (DocsendClient) client whose scheduler the request waits on.
+
+    :returns: (str) url of the page image
+    """
+    client = get_default_client() if client is None else client
+    doc_info_link = f"{doc_info['url']}/page_data/{page}"
+    async with client.scheduler.slot(doc_info['id'], doc_info_link):
+        with metrics.stage('page_data', doc_id=doc_info['id'], page=page):
+            async with session.get(doc_info_link) as resp:
+                resp.raise_for_status()
+                image_info = await resp.json()
+    info = page_info(doc_info, page)
+    if info is not None:
+        info.image_url = image_info['imageUrl']
+    return image_info['imageUrl']
+
+
+def select_pages(doc_info, pages=None):
+    """
+    :doc_info: (dict) dict containing the info of the document
+    :pages: (str or iterable) selection of pages like "1-5,12", see
+                doc_info.parse_page_range, or page numbers. None for every
+                page.
+
+    :returns: (list) page numbers in order, without duplicates
+
+    :raises ValueError: the selection names pages the document does not have
+    """
+    page_count = doc_info['page_count']
+    if pages is None:
+        return list(range(1, page_count+1))
+    if isinstance(pages, str):
+        return parse_page_range(pages, page_count)
+    pages = sorted(set(pages))
+    if not pages or pages[0] < 1 or pages[-1] > page_count:
+        raise ValueError(f'Pages {pages} are not within the '
+                         f'{page_count} pages of the document')
+    return pages
+
+
+async def get_document_img_urls(doc_info, client=None, pages=None):
     """
     Using the document info from gather_document_info, this gets all the image
     urls from the server.
 
     :doc_info: (dict) dict containing the info of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :pages: (str or iterable) only get the urls of these pages, see
+                select_pages. Defaults to every page.
 
     :returns: (list) a list of urls retrieved from the server than can be used
-                        to pull the images in the document.
+                        to pull the images in the document, in page order.
     """
-    image_url_coros = []
-    doc_url = doc_info['url']
     cookies = doc_info['cookies']
-    page_count = doc_info['page_count']
+    client = get_default_client() if client is None else client
+
+    # At most reorder_buffer pages wait on the scheduler at once, so a large
+    # document does not queue all its pages in front of other documents
+    window = asyncio.Semaphore(max(1, REORDER_BUFFER))
+
+    async def image_url(session, page):
+        async with window:
+            return await get_page_image_url(session, doc_info, page, client)
+
+    async with client.session(cookies) as session:
+        # Pages start at count 1. The scheduler decides how many of them
+        # are actually in flight.
+        image_url_coros = [
+            image_url(session, page)
+            for page in select_pages(doc_info, pages)
+        ]
+        return await asyncio.gather(*image_url_coros)
+
+
+async def download_page_image(session, image_url, client=None,
+                              doc_id=None):
+    """
+    Downloads the raw bytes of a page image.
+
+    :session: (aiohttp.ClientSession) session holding the document cookies
+    :image_url: (str) url to pull image from
+    :client: (DocsendClient) client whose scheduler the request waits on.
+    :doc_id: (str) id of the document, used for the per document cap.
+
+    :returns: (bytes) image file as sent by the server
+    """
+    client = get_default_client() if client is None else client
+    async with client.scheduler.slot(doc_id, image_url):
+        with metrics.stage('image', doc_id=doc_id):
+            async with session.get(image_url) as img_response:
+                img_response.raise_for_status()
+                img_data = await img_response.read()
+    metrics.BYTES.inc(len(img_data), kind='image')
+    return img_data
+
 
-    async with aiohttp.ClientSession(headers=HEADERS, cookies=cookies) \
-            as session:
-        # Pages start at count 1
-        for page in range(1, page_count+1):
-            doc_info_link = f"{doc_url}/page_data/{page}"
-            image_url_coros.append(session.get(doc_info_link))
-            # image_info = requests.get(
-            #     doc_info_link, cookies=cookies, headers=HEADERS)
+async def download_cached_page_image(session, doc_id, page, image_url,
+                                     client=None):
+    """
+    Returns a page image from the client's page cache, or downloads it and
+    adds it to the cache.
 
-        # Gather coros to get them all at the same time.
-        image_url_responses = await asyncio.gather(*image_url_coros)
-        images_info = await asyncio.gather(*[resp.json()
-                                             for resp in image_url_responses])
-        image_urls = [image_info['imageUrl'] for image_info in images_info]
+    :session: (aiohttp.ClientSession) session holding the document cookies
+    :doc_id: (str) id of the document
+    :page: (int) page number
+    :image_url: (str) url to pull image from
+    :client: (DocsendClient) client to use. Defaults to the shared client.
 
-        return image_urls
+    :returns: (bytes) image file of the page
+    """
+    client = get_default_client() if client is None else client
+    cache = client.page_cache
+    # The cache reads and writes files, so it runs in the default executor
+    # instead of blocking the event loop
+    loop = asyncio.get_event_loop()
+    if cache is not None:
+        img_data = await loop.run_in_executor(None, cache.get, doc_id, page,
+                                              image_url)
+        metrics.CACHE_LOOKUPS.inc(
+            cache='page', result='miss' if img_data is None else 'hit')
+        if img_data is not None:
+            return img_data
 
+    img_data = await download_page_image(session, image_url, client, doc_id)
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, doc_id, page, image_url,
+                                   img_data)
+    return img_data
 
-async def download_image_for_document(cookies, image_url):
+
+async def download_image_for_document(cookies, image_url, client=None,
+                                      doc_id=None, page=None):
     """
     Given a cookie and image url, this returns a PIL.Image.
 
     :cookies: (dict) dict with cookie data for the remote server.
                 Note: Cookie should already be authenticated
     :image_url: (str) url to pull image from
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :doc_id: (str) id of the document, used for the per document cap.
+    :page: (int) page number. The page cache is only used if the doc_id
+            and page are given.
 
     :return: (PIL.Image) image from the server.
     """
-    async with aiohttp.ClientSession(headers=HEADERS, cookies=cookies) \
-            as session:
-        img_response = await session.get(image_url)
-        img_data = await img_response.read()
-        return Image.open(io.BytesIO(img_data))
+    from PIL import Image
+    client = get_default_client() if client is None else client
+    async with client.session(cookies) as session:
+        if doc_id is not None and page is not None:
+            img_data = await download_cached_page_image(
+                session, doc_id, page, image_url, client)
+        else:
+            img_data = await download_page_image(session, image_url, client,
+                                                 doc_id)
+    return Image.open(io.BytesIO(img_data))
+
+
+async def fetch_page(session, doc_info, page, client=None, image_url=None):
+    """
+    Gets the image url of a page and then downloads the image, unless it is
+    in the page cache. Failures are retried with the client's retry policy.
+
+    :session: (aiohttp.ClientSession) session holding the document cookies
+    :doc_info: (dict) dict containing the info of the document
+    :page: (int) page number. Pages start at 1.
+    :client: (DocsendClient) client whose scheduler the requests wait on.
+    :image_url: (str) image url of the page if it is already known
+
+    :returns: (bytes) image file of the page
+    """
+    client = get_default_client() if client is None else client
+    known_url = [image_url]
+
+    async def attempt():
+        # The known url is only tried by the first attempt, retries ask for
+        # a new one
+        url = known_url.pop() if known_url else None
+        if url is not None:
+            try:
+                return await download_cached_page_image(
+                    session, doc_info['id'], page, url, client)
+            except aiohttp.ClientResponseError as e:
+                # The signature of a known url expires after a while and
+                # the image is then refused with a 403, so a new url is
+                # asked for
+                if e.status != 403:
+                    raise
+        url = await get_page_image_url(session, doc_info, page, client)
+        return await download_cached_page_image(session, doc_info['id'],
+                                                page, url, client)
+
+    img_data = await client.retry.call(attempt)
+    info = page_info(doc_info, page)
+    if info is not None:
+        info.size = len(img_data)
+    return img_data
+
+
+async def _fetch_and_prepare(session, doc_info, page, client, prepare,
+                             renderer, image_url, spool):
+    img_data = None
+    # The spool reads and writes files, so it runs in the default executor
+    # like the page cache
+    loop = asyncio.get_event_loop()
+    if spool is not None:
+        # Spooled pages are found by their image url, so a page that
+        # changed since it was spooled is fetched again
+        if image_url is None:
+            image_url = await client.retry.call(
+                get_page_image_url, session, doc_info, page, client)
+        img_data = await loop.run_in_executor(None, spool.get, page,
+                                              image_url)
+        metrics.CACHE_LOOKUPS.inc(
+            cache='spool', result='miss' if img_data is None else 'hit')
+    if img_data is None:
+        img_data = await fetch_page(session, doc_info, page, client,
+                                    image_url)
+        if spool is not None:
+            await loop.run_in_executor(None, spool.put, page, image_url,
+                                       img_data)
+    if prepare is None:
+        return img_data
+    with metrics.stage('render', doc_id=doc_info['id'], page=page):
+        return await renderer.run(prepare, img_data)
+
+
+async def _fetch_and_spill(session, doc_info, page, client, image_url, spool,
+                           buffer):
+    img_data = await _fetch_and_prepare(session, doc_info, page, client, None,
+                                        None, image_url, spool)
+    await buffer.put(page, img_data)
+
+
+async def iter_document_pages(doc_info, client=None, reorder_buffer=None,
+                              prepare=None, renderer=None, image_urls=None,
+                              spool=None, pages=None, max_memory=None):
+    """
+    Async generator that yields the pages of a document in order as soon as
+    they are ready. Each page goes from its page_data request straight to its
+    image download, so the first page can be used while later pages are
+    still in flight.
+
+    At most reorder_buffer pages are fetched ahead of the page that is
+    waiting to be yielded, which also caps how many page images are held in
+    memory at once.
+
+    If prepare is given, each page's bytes are passed through it in the
+    renderer as soon as the page is downloaded, so the pages in the buffer
+    are prepared in parallel.
+
+    With max_memory, the low memory mode, the pages fetched ahead are kept
+    in a SpillBuffer, which writes them to disk past max_memory bytes, and
+    prepare runs on one page at a time, on a worker of its own, when it is
+    its turn to be yielded. What a download holds at most is then max_memory
+    bytes of page images, the pages still downloading and the page being
+    prepared.
+
+    Note: The cookies in doc_info should already be authenticated.
+
+    :doc_info: (dict) dict containing the info of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead. Defaults to the config.
+    :prepare: (callable) picklable function applied to the page bytes
+    :renderer: (Renderer) where prepare runs. Defaults to the shared one.
+    :image_urls: (list) page image urls from get_document_img_urls, for the
+                    same pages. Skips the page_data requests when given.
+    :spool: (PageSpool) pages found in the spool are not fetched again and
+                    fetched pages are added to it.
+    :pages: (str or iterable) only fetch these pages, see select_pages.
+                    Defaults to every page.
+    :max_memory: (int) bytes of page images kept in memory for the pages
+                    fetched ahead. Defaults to the config, 0 keeps them all
+                    in memory.
+
+    :yields: (tuple) page number and the bytes of the page image, or what
+                prepare returned for them
+    """
+    client = get_default_client() if client is None else client
+    renderer = get_default_renderer() if renderer is None else renderer
+    reorder_buffer = REORDER_BUFFER if reorder_buffer is None \
+        else reorder_buffer
+    reorder_buffer = max(1, reorder_buffer)
+    max_memory = MAX_MEMORY if max_memory is None else max_memory
+    buffer = SpillBuffer(max_memory, SPILL_DIR) if max_memory else None
+    if buffer is not None and prepare is not None \
+            and renderer.executor != 'none':
+        # Every thread of a pool keeps the memory of the largest page it
+        # decoded, so the pages are decoded by one worker of their own.
+        renderer = Renderer(renderer.executor, workers=1)
+        own_renderer = True
+    else:
+        own_renderer = False
+    selected = select_pages(doc_info, pages)
+    if image_urls is None:
+        image_urls = [None] * len(selected)
+    pages = zip(selected, image_urls)
+    pending = collections.deque()
+
+    async with client.session(doc_info['cookies']) as session:
+        def fill():
+            while len(pending) < reorder_buffer:
+                page, image_url = next(pages, (None, None))
+                if page is None:
+                    return
+                if buffer is None:
+                    task = asyncio.ensure_future(_fetch_and_prepare(
+                        session, doc_info, page, client, prepare, renderer,
+                        image_url, spool))
+                else:
+                    task = asyncio.ensure_future(_fetch_and_spill(
+                        session, doc_info, page, client, image_url, spool,
+                        buffer))
+                pending.append((page, task))
+
+        try:
+            fill()
+            while pending:
+                page, task = pending.popleft()
+                img_data = await task
+                fill()
+                if buffer is not None:
+                    img_data = await buffer.pop(page)
+                    if prepare is not None:
+                        with metrics.stage('render', doc_id=doc_info['id'],
+                                           page=page):
+                            img_data = await renderer.run(prepare, img_data)
+                yield page, img_data
+                # Not kept alive while the next page is awaited
+                img_data = None
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if buffer is not None:
+                buffer.close()
+            if own_renderer:
+                renderer.close()
+
+
+async def authenticate_document(doc_info, email=None, passcode=None,
+                                client=None):
+    """
+    Checks the needed email and passcode were given and authenticates the
+    document cookies with them if the document requires it.
+
+    :doc_info: (dict) dict containing the info of the document
+    :email: (str) email to use to authenticate if needed
+    :passcode: (str) passcode to use to authenticate if needed
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+
+    On success doc_info['authenticated'] is set to True.
+
+    :raises InfoRequiredError: the email or passcode is missing
+    :raises AuthError: the server refused the email or passcode
+    """
+    doc_id = doc_info['id']
+    if doc_info['passcode_required'] and passcode is None:
+        raise InfoRequiredError(doc_id, passcode_required=True)
+    elif doc_info['email_required'] and email is None:
+        raise InfoRequiredError(doc_id)
+
+    if doc_info['email_required'] or doc_info['passcode_required']:
+        auth_response = await authenticate_cookie(
+            doc_info, doc_info['cookies'], doc_info['authenticity_token'],
+            email, passcode, client)
+        auth_text = await auth_response.text()
+        if auth_response.status not in [200, 302] \
+                or "review the problems" in auth_text:
+            raise AuthError(auth_response.status)
+        doc_info['authenticated'] = True
+
+
+async def stream_docsend_pdf(doc_info, client=None, reorder_buffer=None,
+                             renderer=None, image_urls=None, spool=None,
+                             progress=None, pages=None, max_memory=None):
+    """
+    Async generator that yields the pdf of a document piece by piece while
+    it is being downloaded. Only the page being written is held in memory.
+
+    Note: The document should already be authenticated with
+        authenticate_document.
+
+    :doc_info: (dict) dict containing the info of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead of the page being written.
+    :renderer: (Renderer) runs the image encoding. Defaults to the shared one.
+    :image_urls: (list) page image urls if they were already requested
+    :spool: (PageSpool) spool to resume from and record pages in
+    :progress: (callable) called with the page number after each page is
+                    added to the pdf
+    :pages: (str or iterable) only put these pages in the pdf, see
+                    select_pages. Defaults to every page.
+    :max_memory: (int) bytes of pages fetched ahead kept in memory, see
+                    iter_document_pages
+
+    :yields: (bytes) next part of the pdf file
+    """
+    with metrics.stage('document', doc_id=doc_info['id']):
+        writer = PdfWriter(doc_info['id'])
+        chunk = writer.header()
+        metrics.BYTES.inc(len(chunk), kind='pdf')
+        yield chunk
+        pages = iter_document_pages(doc_info, client, reorder_buffer,
+                                    prepare=encode_image, renderer=renderer,
+                                    image_urls=image_urls, spool=spool,
+                                    pages=pages, max_memory=max_memory)
+        async for page, image in pages:
+            chunk = writer.page(image)
+            metrics.BYTES.inc(len(chunk), kind='pdf')
+            if progress is not None:
+                progress(page)
+            yield chunk
+        chunk = writer.trailer()
+        metrics.BYTES.inc(len(chunk), kind='pdf')
+        yield chunk
+
+
+async def stream_docsend_zip(doc_info, client=None, reorder_buffer=None,
+                             image_urls=None, spool=None, progress=None,
+                             pages=None, max_memory=None):
+    """
+    Async generator that yields a zip of the page images of a document piece
+    by piece while it is being downloaded. The images are stored as they
+    came from the server, named by page number, so the zip is also a cbz.
+
+    Note: The document should already be authenticated with
+        authenticate_document.
+
+    :doc_info: (dict) dict containing the info of the document
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead of the page being written.
+    :image_urls: (list) page image urls if they were already requested
+    :spool: (PageSpool) spool to resume from and record pages in
+    :progress: (callable) called with the page number after each page is
+                    added to the zip
+    :pages: (str or iterable) only put these pages in the zip, see
+                    select_pages. Defaults to every page.
+    :max_memory: (int) bytes of pages fetched ahead kept in memory, see
+                    iter_document_pages
+
+    :yields: (bytes) next part of the zip file
+    """
+    with metrics.stage('document', doc_id=doc_info['id']):
+        writer = ZipWriter()
+        images = iter_document_pages(doc_info, client, reorder_buffer,
+                                     image_urls=image_urls, spool=spool,
+                                     pages=pages, max_memory=max_memory)
+        async for page, img_data in images:
+            name = page_filename(page, doc_info['page_count'], img_data)
+            chunk = writer.add(name, img_data)
+            metrics.BYTES.inc(len(chunk), kind='zip')
+            if progress is not None:
+                progress(page)
+            yield chunk
+        chunk = writer.close()
+        metrics.BYTES.inc(len(chunk), kind='zip')
+        yield chunk
+
+
+async def save_docsend_pages(doc_info, directory, client=None,
+                             reorder_buffer=None, spool=None, progress=None,
+                             pages=None, max_memory=None):
+    """
+    Saves the page images of a document as they came from the server, one
+    file per page named by page number, e.g. 007.jpg.
+
+    Note: The document should already be authenticated with
+        authenticate_document.
+
+    :doc_info: (dict) dict containing the info of the document
+    :directory: (str) directory to save the pages in. Created if needed.
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead of the page being saved.
+    :spool: (PageSpool) spool to resume from and record pages in
+    :progress: (callable) called with the page number after each page is
+                    saved
+    :pages: (str or iterable) only save these pages, see select_pages.
+                    Defaults to every page.
+    :max_memory: (int) bytes of pages fetched ahead kept in memory, see
+                    iter_document_pages
+
+    :returns: (list) paths of the page files, in page order
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    with metrics.stage('document', doc_id=doc_info['id']):
+        images = iter_document_pages(doc_info, client, reorder_buffer,
+                                     spool=spool, pages=pages,
+                                     max_memory=max_memory)
+        async for page, img_data in images:
+            path = os.path.join(directory, page_filename(
+                page, doc_info['page_count'], img_data))
+            # Readers never see a partly written page
+            with open(f'{path}.part', 'wb') as f:
+                f.write(img_data)
+            os.replace(f'{path}.part', path)
+            paths.append(path)
+            if progress is not None:
+                progress(page)
+    return paths
+
+
+async def iter_docsend_images(doc_info, email=None, passcode=None,
+                              client=None, reorder_buffer=None, spool=None,
+                              pages=None, max_memory=None):
+    """
+    Async generator of the page images of a document, in order, as soon as
+    they are downloaded. Nothing is decoded or converted, so this is the
+    cheapest way to feed the pages to something else, like OCR.
+
+        async for page, img_data in iter_docsend_images(doc_info):
+            ...
+
+    :doc_info: (dict) dict containing the info of the document
+    :email: (str) email to use to authenticate if needed
+    :passcode: (str) passcode to use to authenticate if needed
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead of the page yielded.
+    :spool: (PageSpool) spool to resume from and record pages in
+    :pages: (str or iterable) only fetch these pages, see select_pages.
+                Defaults to every page.
+    :max_memory: (int) bytes of pages fetched ahead kept in memory, see
+                iter_document_pages
+
+    :yields: (tuple) page number and the bytes of the page image
+    """
+    await authenticate_document(doc_info, email, passcode, client)
+    images = iter_document_pages(doc_info, client, reorder_buffer,
+                                 spool=spool, pages=pages,
+                                 max_memory=max_memory)
+    async for page, img_data in images:
+        yield page, img_data
+
+
+async def _write_stream(chunks, output_file):
+    """
+    Writes an async iterator of bytes to a file. It is written under a
+    temporary name so a failed download never leaves a partial file behind.
+    """
+    part_file = f'{output_file}.part'
+    try:
+        with open(part_file, 'wb') as f:
+            async for chunk in chunks:
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.remove(part_file)
+        except FileNotFoundError:
+            pass
+        raise
+    os.replace(part_file, output_file)
+
+
+def _draw_page(c, img_data):
+    """
+    Decodes a page image and draws it as a page of the canvas.
+    """
+    from PIL import Image
+    with Image.open(io.BytesIO(img_data)) as img:
+        c.setPageSize(img.size)
+        c.drawInlineImage(img, 0, 0)
+        c.showPage()
 
 
 async def download_docsend_with_doc_id(doc_id, email=None, passcode=None,
                                        output_path=None, output_canvas=None,
-                                       save_output=True):
-    doc_info = await gather_document_info(doc_id)
+                                       save_output=True, client=None,
+                                       renderer=None, spool_dir=None,
+                                       output_file=None, output_format='pdf',
+                                       pages=None, max_memory=None):
+    doc_info = await gather_document_info(doc_id, client)
     return await download_docsend(doc_info, email, passcode,
-                                  output_path, output_canvas, save_output)
+                                  output_path, output_canvas, save_output,
+                                  client=client, renderer=renderer,
+                                  spool_dir=spool_dir,
+                                  output_file=output_file,
+                                  output_format=output_format, pages=pages,
+                                  max_memory=max_memory)
+
+
+def _output_file(doc_id, output_path, output_file, output_format):
+    if output_file is not None:
+        return output_file
+    output_path = '' if output_path is None else output_path
+    extension = OUTPUT_FORMATS[output_format][0]
+    return os.path.join(output_path, f'Docsend-{doc_id}{extension}')
+
+
+def _open_spool(doc_info, spool_dir):
+    spool_dir = SPOOL_DIR if spool_dir is None else spool_dir
+    if not spool_dir:
+        return None
+    return PageSpool(spool_dir, doc_info['id'], doc_info['page_count'])
+
+
+async def download_docsend_file(doc_info, email=None, passcode=None,
+                                output_path=None, client=None,
+                                reorder_buffer=None, renderer=None,
+                                spool_dir=None, output_file=None,
+                                output_format='pdf', pages=None,
+                                max_memory=None):
+    """
+    Downloads the document from the server to a file, without a canvas.
+    Notes:
+        * email and passcode are not used if function does not detect it
+            is needed.
+        * The pdf is written straight to the output file with PdfWriter,
+            which embeds JPEG and PNG pages without decoding them.
+        * The zip, cbz and dir output formats keep the page images as they
+            came from the server and skip the pdf generation entirely. The
+            directory of the dir format must not exist or be empty.
+        * The output is written under a temporary name and only gets its
+            name once it is complete.
+        * See download_docsend for the spool directory and max_memory.
+
+    :doc_info: (dict) info of the document, see gather_document_info
+    :email: (str) email to use to authenticate if needed
+    :passcode: (str) passcode to use to authenticate if needed
+    :output_path: (str) directory to save the file in.
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead of the page being written.
+    :renderer: (Renderer) runs the image decoding. Defaults to the shared
+                one.
+    :spool_dir: (str) directory to spool pages in. Defaults to the spool_dir
+                of config.ini. Empty for no spool.
+    :output_file: (str) path of the output. Takes precedence over
+                output_path.
+    :output_format: (str) pdf, zip or cbz for a zip of the page images, or
+                dir for a directory of page files. See sinks.OUTPUT_FORMATS.
+    :pages: (str or iterable) only download these pages, e.g. "1-5,12",
+                see select_pages. Defaults to every page.
+    :max_memory: (int) bytes of pages fetched ahead kept in memory.
+                Defaults to the max_memory of config.ini, 0 for no limit.
+
+    :returns: (str) path of the saved file or directory
+    """
+    client = get_default_client() if client is None else client
+    check_output_format(output_format)
+    pages = select_pages(doc_info, pages)
+
+    await authenticate_document(doc_info, email, passcode, client)
+
+    output_file = _output_file(doc_info['id'], output_path, output_file,
+                               output_format)
+    spool = _open_spool(doc_info, spool_dir)
+    try:
+        if output_format == 'pdf':
+            await _write_stream(stream_docsend_pdf(
+                doc_info, client, reorder_buffer, renderer, spool=spool,
+                pages=pages, max_memory=max_memory), output_file)
+        elif output_format == 'dir':
+            # Like the files, the directory only gets its name once every
+            # page is in it.
+            part_dir = f'{output_file}.part'
+            try:
+                await save_docsend_pages(doc_info, part_dir, client,
+                                         reorder_buffer, spool=spool,
+                                         pages=pages, max_memory=max_memory)
+            except BaseException:
+                shutil.rmtree(part_dir, ignore_errors=True)
+                raise
+            os.replace(part_dir, output_file)
+        else:
+            await _write_stream(stream_docsend_zip(
+                doc_info, client, reorder_buffer, spool=spool, pages=pages,
+                max_memory=max_memory), output_file)
+        if spool is not None:
+            spool.clear()
+    finally:
+        # A failed download keeps its pages in the spool for the next run
+        if spool is not None:
+            spool.close()
+    return output_file
 
 
 async def download_docsend(doc_info, email=None, passcode=None,
                            output_path=None, output_canvas=None,
-                           save_output=True):
+                           save_output=True, client=None,
+                           reorder_buffer=None, renderer=None,
+                           spool_dir=None, output_file=None,
+                           output_format='pdf', pages=None, max_memory=None):
     """
-    Downloads the document from the server and converts to a pdf.
+    Downloads the document from the server and converts to a pdf, or saves
+    its page images as they are.
     Notes:
         * email and passcode are not used if function does not detect it
             is needed.
         * If canvas is provided then output_path is not utilized since the
             path must be designated at the time of creation.
+        * The pdf is drawn on a reportlab canvas, which decodes every page
+            with PIL. download_docsend_file writes it with PdfWriter
+            instead, which embeds JPEG and PNG pages without decoding them.
+        * With a spool directory the download is resumable. Completed pages
+            are kept there until the pdf is saved, so running the download
+            again after a failure only fetches the missing pages.
+        * The zip, cbz and dir output formats are written by
+            download_docsend_file, and their path is returned.
+        * With max_memory, the pages fetched ahead past that many bytes wait
+            on disk and pages are decoded one at a time, see
+            iter_document_pages. A canvas still holds every page it drew
+            until it is saved.
 
 
     :doc_id: (str) id of the document to be downloaded
@@ -210,48 +1088,71 @@ async def download_docsend(doc_info, email=None, passcode=None,
     :output_canvas: (reportlab.pdfgen.canvas.Canvas) preconfigured canvas to
                     save the downloaded document to.
     :save_output: (bool) flag to save the output before exiting function
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :reorder_buffer: (int) max pages fetched ahead of the page being drawn.
+    :renderer: (Renderer) runs the image decoding and pdf drawing. Defaults
+                to the shared one.
+    :spool_dir: (str) directory to spool pages in. Defaults to the spool_dir
+                of config.ini. Empty for no spool.
+    :output_file: (str) path of the output. Takes precedence over
+                output_path.
+    :output_format: (str) pdf, zip or cbz for a zip of the page images, or
+                dir for a directory of page files. See sinks.OUTPUT_FORMATS.
+    :pages: (str or iterable) only download these pages, e.g. "1-5,12",
+                see select_pages. Defaults to every page.
+    :max_memory: (int) bytes of pages fetched ahead kept in memory.
+                Defaults to the max_memory of config.ini, 0 for no limit.
+
+    :returns: (reportlab.pdfgen.canvas.Canvas or str) the canvas of the pdf,
+                or the path of the saved file or directory of the other
+                output formats.
     """
+    if output_format != 'pdf':
+        if output_canvas is not None:
+            raise ValueError('A canvas can only be used for pdf output')
+        return await download_docsend_file(
+            doc_info, email, passcode, output_path, client=client,
+            reorder_buffer=reorder_buffer, renderer=renderer,
+            spool_dir=spool_dir, output_file=output_file,
+            output_format=output_format, pages=pages, max_memory=max_memory)
+
     # Gather basic information and get cookies
     doc_id = doc_info['id']
-    cookies = doc_info['cookies']
+    client = get_default_client() if client is None else client
+    pages = select_pages(doc_info, pages)
 
-    if doc_info['passcode_required'] and passcode is None:
-        raise InfoRequiredError(doc_id, passcode_required=True)
-    elif doc_info['email_required'] and email is None:
-        raise InfoRequiredError(doc_id)
+    await authenticate_document(doc_info, email, passcode, client)
 
-    # Authenticate
-    if doc_info['email_required'] or doc_info['passcode_required']:
-        auth_response = authenticate_cookie(doc_info, cookies,
-                                            doc_info['authenticity_token'],
-                                            email, passcode)
-        if auth_response.status_code not in [200, 302] \
-                or "review the problems" in auth_response.text:
-            raise AuthError(auth_response.status_code)
-
-    # Retrieve Image Urls
-    image_urls = await get_document_img_urls(doc_info)
-
-    # Download Images
-    imgs_coros = []
-    for image_url in image_urls:
-        imgs_coros.append(download_image_for_document(cookies, image_url))
-    imgs = await asyncio.gather(*imgs_coros)
-
-    # Generate PDF
-    output_path = '' if output_path is None else output_path
-    output_filename = f'Docsend-{doc_id}.pdf'
-    output_file = os.path.join(output_path, output_filename)
+    output_file = _output_file(doc_id, output_path, output_file,
+                               output_format)
     if output_canvas is None:
+        from reportlab.pdfgen import canvas
         c = canvas.Canvas(output_file)
     else:
         c = output_canvas
 
     c.setTitle(doc_id)
-    for img in imgs:
-        c.setPageSize(img.size)
-        c.drawInlineImage(img, 0, 0)
-        c.showPage()
-    if save_output:
-        c.save()
+
+    # Retrieve and draw the pages. Each page is drawn as soon as it and
+    # every page before it has been downloaded.
+    renderer = get_default_renderer() if renderer is None else renderer
+    spool = _open_spool(doc_info, spool_dir)
+    try:
+        images = iter_document_pages(doc_info, client, reorder_buffer,
+                                     spool=spool, pages=pages,
+                                     max_memory=max_memory)
+        with metrics.stage('document', doc_id=doc_id):
+            async for page, img_data in images:
+                # The canvas can not leave the process, so it is drawn in a
+                # thread
+                with metrics.stage('render', doc_id=doc_id, page=page):
+                    await renderer.run_in_thread(_draw_page, c, img_data)
+            if save_output:
+                await renderer.run_in_thread(c.save)
+        if spool is not None:
+            spool.clear()
+    finally:
+        # A failed download keeps its pages in the spool for the next run
+        if spool is not None:
+            spool.close()
     return c
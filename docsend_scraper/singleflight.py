@@ -0,0 +1,171 @@
+"""
+singleflight.py
+
+Coalesces concurrent work on the same key. While a call or a stream for a key
+is running, everyone else asking for that key attaches to it instead of
+starting their own, so a burst of requests for one document costs the server
+a single fetch per page.
+"""
+import os
+import asyncio
+import tempfile
+
+
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+
+class SharedStream:
+    """
+    Runs an async generator of bytes once and lets any number of readers
+    follow its output, each from the start. The output is spooled to a
+    temporary file, so memory use does not depend on the number of readers
+    or on how far behind they are.
+
+    The source keeps running when readers leave. The spool file is removed
+    once the source is done and the last reader is gone.
+
+    :source: (async generator) yields the bytes to share
+    :spool_dir: (str) where the spool file is created. Defaults to the
+                    system temp directory.
+    """
+
+    def __init__(self, source, spool_dir=None):
+        self._source = source
+        self._spool = tempfile.NamedTemporaryFile(
+            dir=spool_dir, prefix='docsend-', suffix='.spool', delete=False)
+        self.path = self._spool.name
+        self.size = 0
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        try:
+            async for chunk in self._source:
+                self._spool.write(chunk)
+                self._spool.flush()
+                self.size += len(chunk)
+                self._notify()
+        except BaseException as e:
+            # A cancelled source, like one stopped by a server shutdown, is
+            # a failure too, or readers would take a cut short output for a
+            # complete one
+            self.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self.done = True
+            self._spool.close()
+            self._notify()
+            self._cleanup()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _cleanup(self):
+        if self.done and self.readers == 0:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def read(self, chunk_size=SPOOL_CHUNK_SIZE):
+        """
+        Returns an async generator over the whole output, waiting for the
+        source where the reader catches up with it. The reader is counted
+        right away, so call this before giving up control of the loop.
+
+        :chunk_size: (int) max size of the chunks read from the spool
+
+        :returns: (async generator) yields bytes. Raises the error of the
+                    source, if it failed.
+        """
+        self.readers += 1
+        return self._read(chunk_size)
+
+    async def _read(self, chunk_size):
+        try:
+            with open(self.path, 'rb') as f:
+                offset = 0
+                while True:
+                    if offset < self.size:
+                        data = f.read(min(chunk_size, self.size - offset))
+                        offset += len(data)
+                        yield data
+                    elif self.done:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    else:
+                        await self._changed.wait()
+        finally:
+            self.readers -= 1
+            self._cleanup()
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls and streams by key.
+
+        flights = SingleFlight()
+        info = await flights.do(doc_id, lambda: gather_document_info(doc_id))
+        async for chunk in flights.stream(key, make_pdf).read():
+            ...
+
+    :spool_dir: (str) where shared streams spool their output
+    """
+
+    def __init__(self, spool_dir=None):
+        self.spool_dir = spool_dir
+        self._calls = {}
+        self._streams = {}
+
+    async def do(self, key, fn):
+        """
+        Awaits fn() once for every concurrent caller with the same key. All
+        callers get the same result, or the same exception. A caller that is
+        cancelled does not cancel the call for the others.
+
+        :key: hashable key of the call
+        :fn: (callable) returns the coroutine to run
+
+        :returns: result of the coroutine
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(
+                lambda _: self._forget(self._calls, key, future))
+        return await asyncio.shield(future)
+
+    def stream(self, key, fn):
+        """
+        Returns the running shared stream for key, or starts one from fn().
+
+        :key: hashable key of the stream
+        :fn: (callable) returns the async generator to share
+
+        :returns: (SharedStream)
+        """
+        shared = self._streams.get(key)
+        if shared is None or shared.done:
+            shared = SharedStream(fn(), self.spool_dir)
+            self._streams[key] = shared
+            shared.task.add_done_callback(
+                lambda _: self._forget(self._streams, key, shared))
+        return shared
+
+    @staticmethod
+    def _forget(registry, key, value):
+        if registry.get(key) is value:
+            del registry[key]
+
+    def in_flight(self):
+        """
+        :returns: (int) number of calls and streams running
+        """
+        return len(self._calls) + len(self._streams)
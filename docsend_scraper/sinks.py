@@ -0,0 +1,150 @@
+"""
+sinks.py
+
+Outputs other than a pdf, for consumers that only want the page images, for
+example to run OCR or make thumbnails. The images are kept as they came from
+the server, so nothing is decoded or encoded again.
+
+A zip (or cbz, which is a zip of images named in reading order) is built one
+page at a time like PdfWriter builds a pdf. The pages are stored without
+compression, since the images are already compressed, and only the entries
+of the central directory are kept in memory.
+"""
+import time
+import zlib
+import struct
+
+
+# Output format to the extension of the file and its content type. A dir
+# output is a directory of page files, not a single file.
+OUTPUT_FORMATS = {
+    'pdf': ('.pdf', 'application/pdf'),
+    'zip': ('.zip', 'application/zip'),
+    'cbz': ('.cbz', 'application/vnd.comicbook+zip'),
+    'dir': ('', None),
+}
+
+# Leading bytes of an image file to its extension
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF8', '.gif'),
+)
+
+ZIP_VERSION = 20
+# Made on unix, so the external attributes hold unix permissions
+ZIP_CREATE_VERSION = 3 << 8 | ZIP_VERSION
+# Names are encoded as utf-8
+ZIP_FLAGS = 0x800
+ZIP_STORED = 0
+ZIP_MAX_SIZE = 0xFFFFFFFF
+ZIP_LOCAL_HEADER = '<4s5H3L2H'
+# Regular file, rw-r--r--, in the high bits of the external attributes
+ZIP_FILE_ATTRIBUTES = 0o100644 << 16
+
+
+def image_extension(img_data):
+    """
+    :img_data: (bytes) image file
+
+    :returns: (str) extension of the image format, .bin if it is unknown
+    """
+    for signature, extension in IMAGE_SIGNATURES:
+        if img_data.startswith(signature):
+            return extension
+    if img_data[:4] == b'RIFF' and img_data[8:12] == b'WEBP':
+        return '.webp'
+    return '.bin'
+
+
+def page_filename(page, page_count, img_data):
+    """
+    Name of a page file. Page numbers are zero padded so the files sort in
+    reading order.
+
+    :page: (int) page number
+    :page_count: (int) number of pages of the document
+    :img_data: (bytes) image file of the page
+
+    :returns: (str) e.g. 007.jpg
+    """
+    return page_name(page, page_count, image_extension(img_data))
+
+
+def page_name(page, page_count, extension):
+    """
+    :returns: (str) name of a page file with the given extension, see
+                page_filename
+    """
+    width = max(3, len(str(page_count)))
+    return f'{page:0{width}d}{extension}'
+
+
+def check_output_format(output_format):
+    """
+    :raises ValueError: the output format is not one of OUTPUT_FORMATS
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format "{output_format}", '
+                         f'expected one of {", ".join(OUTPUT_FORMATS)}')
+
+
+def _dos_date_time(timestamp):
+    t = time.localtime(timestamp)
+    date = (max(t.tm_year, 1980) - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    return date, t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+
+
+class ZipWriter:
+    """
+    Writes a zip file one entry at a time. Each method returns the bytes to
+    append to the output.
+
+    :timestamp: (float) modification time of the entries. Defaults to now.
+    """
+
+    def __init__(self, timestamp=None):
+        self.date, self.time = _dos_date_time(
+            time.time() if timestamp is None else timestamp)
+        self.offset = 0
+        # Central directory records of the entries written so far
+        self.entries = []
+
+    def add(self, name, data):
+        """
+        :name: (str) path of the entry in the zip
+        :data: (bytes) content of the entry
+
+        :returns: (bytes) local header and content of the entry
+        """
+        name = name.encode('utf-8')
+        # The entry has to end within 4 GiB, since the central directory
+        # that follows it is found by its offset
+        size = struct.calcsize(ZIP_LOCAL_HEADER) + len(name) + len(data)
+        if self.offset + size > ZIP_MAX_SIZE:
+            raise ValueError('Zip files over 4 GiB are not supported')
+        crc = zlib.crc32(data)
+        header = struct.pack(
+            ZIP_LOCAL_HEADER, b'PK\x03\x04', ZIP_VERSION, ZIP_FLAGS,
+            ZIP_STORED, self.time, self.date, crc, len(data), len(data),
+            len(name), 0)
+        self.entries.append(struct.pack(
+            '<4s6H3L5H2L', b'PK\x01\x02', ZIP_CREATE_VERSION, ZIP_VERSION,
+            ZIP_FLAGS, ZIP_STORED, self.time, self.date, crc, len(data),
+            len(data), len(name), 0, 0, 0, 0, ZIP_FILE_ATTRIBUTES,
+            self.offset) + name)
+        chunk = header + name + data
+        self.offset += len(chunk)
+        return chunk
+
+    def close(self):
+        """
+        :returns: (bytes) central directory and end record of the zip
+        """
+        if len(self.entries) > 0xFFFF or self.offset > ZIP_MAX_SIZE:
+            raise ValueError('Zip files over 4 GiB or 65535 entries are '
+                             'not supported')
+        directory = b''.join(self.entries)
+        end = struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, len(self.entries),
+                          len(self.entries), len(directory), self.offset, 0)
+        return directory + end
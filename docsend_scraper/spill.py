@@ -0,0 +1,130 @@
+"""
+spill.py
+
+Page buffer of the low memory mode. Pages fetched ahead of the one being
+written are kept in memory up to a budget of bytes. Pages past the budget are
+spilled to files in a temporary directory and read back when their turn
+comes, so a large deck of high resolution pages can be fetched ahead as far
+as usual without its images piling up in memory.
+"""
+import os
+import shutil
+import asyncio
+import tempfile
+import threading
+from . import metrics
+
+
+# Suffixes of a size, see parse_size
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(size):
+    """
+    :size: (str) number of bytes, with an optional K, M or G suffix, e.g.
+                256M
+
+    :returns: (int) number of bytes
+
+    :raises ValueError: the size can not be read
+    """
+    text = str(size).strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ''
+    number = text[:len(text) - len(unit)]
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f'Invalid size "{size}", expected a number of '
+                         f'bytes like 512K, 256M or 1G') from None
+
+
+class SpillBuffer:
+    """
+    Pages waiting to be used, in memory up to max_bytes and on disk past it.
+
+    :max_bytes: (int) bytes of pages kept in memory at once
+    :directory: (str) where the spill directory is made. Defaults to the
+                system temp directory.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.memory_bytes = 0
+        # Most bytes held in memory at once and pages spilled, for reporting
+        self.peak_bytes = 0
+        self.spilled = 0
+        self._pages = {}
+        self._path = None
+        # Pages are spilled from the default executor, where two of them can
+        # make the spill directory at once
+        self._path_lock = threading.Lock()
+
+    def _spill_path(self, page):
+        with self._path_lock:
+            if self._path is None:
+                if self.directory:
+                    os.makedirs(os.path.expanduser(self.directory),
+                                exist_ok=True)
+                self._path = tempfile.mkdtemp(
+                    prefix='docsend-spill-',
+                    dir=self.directory and os.path.expanduser(self.directory))
+        return os.path.join(self._path, f'{page}.page')
+
+    def _write(self, page, data):
+        with open(self._spill_path(page), 'wb') as f:
+            f.write(data)
+
+    def _read(self, page):
+        path = self._spill_path(page)
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.remove(path)
+        return data
+
+    async def put(self, page, data):
+        """
+        Adds a page to the buffer. A page past the budget is written to disk
+        in the default executor, instead of blocking the event loop.
+
+        :page: (int) page number
+        :data: (bytes) the page image
+        """
+        if self.memory_bytes + len(data) <= self.max_bytes:
+            self._pages[page] = data
+            self.memory_bytes += len(data)
+            self.peak_bytes = max(self.peak_bytes, self.memory_bytes)
+            return
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write, page, data)
+        self._pages[page] = None
+        self.spilled += 1
+        metrics.SPILLED_PAGES.inc()
+
+    async def pop(self, page):
+        """
+        Takes a page out of the buffer. A spilled page is read back in the
+        default executor.
+
+        :page: (int) page number
+
+        :returns: (bytes) the page image
+
+        :raises KeyError: the page is not in the buffer
+        """
+        data = self._pages.pop(page)
+        if data is not None:
+            self.memory_bytes -= len(data)
+            return data
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._read, page)
+
+    def close(self):
+        """
+        Drops the pages left and removes the spill directory.
+        """
+        self._pages.clear()
+        self.memory_bytes = 0
+        if self._path is not None:
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._path = None
@@ -0,0 +1,135 @@
+"""
+spool.py
+
+Keeps the pages of a download on disk as they complete, so a download that
+fails, or a server that restarts, can resume and only fetch the pages that
+are missing. Each page is written to a temporary name and renamed into place,
+so a page file that exists is always complete.
+
+Several downloads of a document, in one process or several, can use its
+spool at once. Each of them holds a shared lock on the spool while it is
+open, and the spool is only removed by the last one to finish.
+"""
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import hashlib
+from .cache import PageCache
+
+
+class PageSpool:
+    """
+    Spool directory of one document.
+
+        <directory>/<sha1 of doc_id>.lock
+        <directory>/<sha1 of doc_id>/manifest.json
+        <directory>/<sha1 of doc_id>/<page>-<url key>.page
+
+    Pages are stored under the key of their image url, like in the page
+    cache, so a page of a document that was revised since it was spooled is
+    not found and is fetched again.
+
+    :directory: (str) root of all spools
+    :doc_id: (str) id of the document
+    :page_count: (int) pages of the document. A spool left by a run that
+                    saw a different page count is thrown away, unless
+                    another download still has it open.
+    """
+
+    def __init__(self, directory, doc_id, page_count):
+        directory = os.path.expanduser(directory)
+        doc_dir = hashlib.sha1(str(doc_id).encode()).hexdigest()
+        self.path = os.path.join(directory, doc_dir)
+        self.doc_id = doc_id
+        self.page_count = page_count
+        os.makedirs(directory, exist_ok=True)
+        # The lock file stays, so every download locks the same file
+        self._lock = open(os.path.join(directory, f'{doc_dir}.lock'), 'a')
+        manifest = {'id': doc_id, 'page_count': page_count}
+        if self._read_manifest() != manifest and self._lock_exclusive():
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path, exist_ok=True)
+            self._write(os.path.join(self.path, 'manifest.json'),
+                        json.dumps(manifest).encode())
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+
+    def _lock_exclusive(self):
+        # True if no other download has the spool open
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, 'manifest.json'), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _page_path(self, page, image_url):
+        name = f'{page}-{PageCache.url_key(image_url)}.page'
+        return os.path.join(self.path, name)
+
+    def _write(self, path, data):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, page, image_url):
+        """
+        :page: (int) page number
+        :image_url: (str) url of the page image
+
+        :returns: (bytes) the spooled page image, None if it is missing
+        """
+        try:
+            with open(self._page_path(page, image_url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, page, image_url, data):
+        """
+        Records a completed page.
+
+        :page: (int) page number
+        :image_url: (str) url of the page image
+        :data: (bytes) the page image
+        """
+        self._write(self._page_path(page, image_url), data)
+
+    def completed(self):
+        """
+        :returns: (set) page numbers already in the spool
+        """
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return set()
+        return {int(name.split('-', 1)[0]) for name in names
+                if name.endswith('.page')}
+
+    def close(self):
+        """
+        Lets go of the spool and keeps its pages, for a download that failed
+        and can be resumed.
+        """
+        self._lock.close()
+
+    def clear(self):
+        """
+        Removes the spool once the download it was for has finished, and lets
+        go of it. A spool that other downloads still have open is left to the
+        last of them.
+        """
+        if self._lock.closed:
+            return
+        if self._lock_exclusive():
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.close()
@@ -0,0 +1,283 @@
+"""
+sync.py
+
+Keeps a local copy of a document up to date, for decks that are archived
+again and again to track their revisions.
+
+A sync requests the image url of every page, which is a small json request
+per page, and compares it with the manifest of the last sync. Only pages whose
+url is new are downloaded. A page whose url moved to another page number is
+renamed instead. The page set is then patched in place, the pdf is rebuilt
+from the local pages when anything changed, and the difference between the
+two revisions is returned and added to the history of the archive.
+
+    <directory>/manifest.json
+    <directory>/history.jsonl
+    <directory>/pages/001.jpg
+    <directory>/Docsend-<doc_id>.pdf
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+from . import scraper
+from .cache import PageCache
+from .pdf import PdfWriter, encode_image
+from .render import get_default_renderer
+from .sinks import page_filename, page_name
+
+
+MANIFEST_NAME = 'manifest.json'
+HISTORY_NAME = 'history.jsonl'
+PAGES_DIR = 'pages'
+
+
+class DocumentArchive:
+    """
+    Local copy of a document as left by the last sync.
+
+    :directory: (str) directory of the archive. Created on the first sync.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(directory)
+        self.pages_dir = os.path.join(self.directory, PAGES_DIR)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'id': None, 'page_count': 0, 'synced': None, 'pages': []}
+
+    @property
+    def pages(self):
+        """
+        :returns: (list) entries of the pages, with the page number, the
+                    image url and its url key, the sha256, size and file name
+                    of the image
+        """
+        return self.manifest['pages']
+
+    def page_path(self, entry):
+        return os.path.join(self.pages_dir, entry['file'])
+
+    def has_page(self, entry):
+        """
+        :returns: (bool) the file of the page is there and complete
+        """
+        try:
+            return os.path.getsize(self.page_path(entry)) == entry['size']
+        except FileNotFoundError:
+            return False
+
+    def pdf_path(self, doc_id):
+        return os.path.join(self.directory, f'Docsend-{doc_id}.pdf')
+
+    def save(self, manifest):
+        """
+        Replaces the manifest. Written last, so an interrupted sync is found
+        out by has_page on the next one.
+        """
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+        self.manifest = manifest
+
+    def record(self, diff):
+        """
+        Adds the diff of a sync to the history of the archive.
+        """
+        with open(os.path.join(self.directory, HISTORY_NAME), 'a') as f:
+            f.write(json.dumps(diff) + '\n')
+
+
+def plan_sync(old_pages, image_urls):
+    """
+    Matches the pages of the last sync with the current image urls.
+
+    :old_pages: (list) entries of the pages that are still on disk
+    :image_urls: (list) current image urls, in page order
+
+    :returns: (list) for every page, its url key and the old entry it can
+                reuse, None if it has to be downloaded
+    """
+    by_url = {entry['url_key']: entry for entry in old_pages}
+    claimed = set()
+    plan = []
+    for image_url in image_urls:
+        url_key = PageCache.url_key(image_url)
+        entry = by_url.get(url_key)
+        # A file can only move to one page, repeats are downloaded again
+        if entry is not None and entry['page'] in claimed:
+            entry = None
+        if entry is not None:
+            claimed.add(entry['page'])
+        plan.append((url_key, entry))
+    return plan
+
+
+def diff_pages(old_pages, new_pages):
+    """
+    :old_pages: (list) entries of the last sync
+    :new_pages: (list) entries of this sync
+
+    :returns: (dict) page numbers added (past the old end), changed (new
+                content), moved (as old and new page number) and removed
+                (past the new end), and the number of unchanged pages
+    """
+    old_by_page = {entry['page']: entry for entry in old_pages}
+    old_by_hash = {}
+    for entry in old_pages:
+        old_by_hash.setdefault(entry['sha256'], entry['page'])
+    diff = {'added': [], 'changed': [], 'moved': [], 'removed': [],
+            'unchanged': 0}
+    for entry in new_pages:
+        page = entry['page']
+        old = old_by_page.get(page)
+        if old is not None and old['sha256'] == entry['sha256']:
+            diff['unchanged'] += 1
+        elif entry['sha256'] in old_by_hash:
+            diff['moved'].append([old_by_hash[entry['sha256']], page])
+        elif old is None:
+            diff['added'].append(page)
+        else:
+            diff['changed'].append(page)
+    diff['removed'] = [entry['page'] for entry in old_pages
+                       if entry['page'] > len(new_pages)]
+    return diff
+
+
+async def write_pdf(archive, doc_id, pages, renderer=None):
+    """
+    Builds the pdf of the archive from its page files. JPEG and PNG pages
+    pass through without being decoded, so this costs little besides
+    reading the files.
+
+    :returns: (str) path of the pdf
+    """
+    renderer = get_default_renderer() if renderer is None else renderer
+    path = archive.pdf_path(doc_id)
+    part_path = f'{path}.part'
+    writer = PdfWriter(doc_id)
+    try:
+        with open(part_path, 'wb') as f:
+            f.write(writer.header())
+            for entry in pages:
+                with open(archive.page_path(entry), 'rb') as page_file:
+                    image = await renderer.run(encode_image, page_file.read())
+                f.write(writer.page(image))
+            f.write(writer.trailer())
+    except BaseException:
+        os.remove(part_path)
+        raise
+    os.replace(part_path, path)
+    return path
+
+
+async def sync_document(doc_id, directory, email=None, passcode=None,
+                        client=None, renderer=None, pdf=True):
+    """
+    Brings the archive of a document up to date, downloading only the pages
+    that are new or changed since the last sync.
+
+    :doc_id: (str) id of the document
+    :directory: (str) directory of the archive of the document
+    :email: (str) email to use to authenticate if needed
+    :passcode: (str) passcode to use to authenticate if needed
+    :client: (DocsendClient) client to use. Defaults to the shared client.
+    :renderer: (Renderer) renderer the pdf is built with
+    :pdf: (bool) keep a pdf of the document next to its pages
+
+    :returns: (dict) diff of the sync, see diff_pages, along with the id,
+                the page count before and after, the pages downloaded, their
+                bytes and the seconds the sync took
+    """
+    start = time.monotonic()
+    archive = DocumentArchive(directory)
+    doc_info = await scraper.gather_document_info(doc_id, client)
+    await scraper.authenticate_document(doc_info, email, passcode, client)
+    page_count = doc_info['page_count']
+    image_urls = await scraper.get_document_img_urls(doc_info, client)
+
+    old_pages = archive.pages if archive.manifest['id'] == doc_id else []
+    plan = plan_sync([entry for entry in old_pages
+                      if archive.has_page(entry)], image_urls)
+    downloads = [page for page, (_, entry) in enumerate(plan, 1)
+                 if entry is None]
+
+    os.makedirs(archive.pages_dir, exist_ok=True)
+    # Left by an interrupted sync
+    for name in os.listdir(archive.pages_dir):
+        if name.endswith(('.download', '.move')):
+            os.remove(os.path.join(archive.pages_dir, name))
+    new_pages = [None] * page_count
+    # Downloads land under a temporary name until the old files are out of
+    # the way
+    moves = []
+    downloaded_bytes = 0
+    if downloads:
+        images = scraper.iter_document_pages(
+            doc_info, client, pages=downloads,
+            image_urls=[image_urls[page - 1] for page in downloads])
+        async for page, img_data in images:
+            tmp_path = os.path.join(archive.pages_dir, f'{page}.download')
+            with open(tmp_path, 'wb') as f:
+                f.write(img_data)
+            downloaded_bytes += len(img_data)
+            doc_info.page(page).sha256 = hashlib.sha256(img_data).hexdigest()
+            new_pages[page - 1] = {
+                'page': page, 'image_url': image_urls[page - 1],
+                'url_key': plan[page - 1][0],
+                'sha256': doc_info.page(page).sha256,
+                'size': len(img_data),
+                'file': page_filename(page, page_count, img_data)}
+            moves.append((tmp_path, new_pages[page - 1]))
+
+    reused = set()
+    for page, (url_key, entry) in enumerate(plan, 1):
+        if entry is None:
+            continue
+        extension = os.path.splitext(entry['file'])[1]
+        new_pages[page - 1] = dict(entry, page=page,
+                                   image_url=image_urls[page - 1],
+                                   file=page_name(page, page_count, extension))
+        reused.add(entry['file'])
+        if entry['file'] != new_pages[page - 1]['file']:
+            tmp_path = os.path.join(archive.pages_dir, f'{page}.move')
+            os.replace(archive.page_path(entry), tmp_path)
+            moves.append((tmp_path, new_pages[page - 1]))
+
+    # Old files that are not reused make room for the new ones
+    for entry in old_pages:
+        if entry['file'] not in reused:
+            try:
+                os.remove(archive.page_path(entry))
+            except FileNotFoundError:
+                pass
+    for tmp_path, entry in moves:
+        os.replace(tmp_path, archive.page_path(entry))
+
+    diff = diff_pages(old_pages, new_pages)
+    changed = bool(diff['added'] or diff['changed'] or diff['moved']
+                   or diff['removed'])
+    archive.save({'id': doc_id, 'page_count': page_count,
+                  'synced': time.time(), 'pages': new_pages})
+    if pdf and (changed or not os.path.exists(archive.pdf_path(doc_id))):
+        await write_pdf(archive, doc_id, new_pages, renderer)
+
+    diff.update({
+        'id': doc_id,
+        'synced': archive.manifest['synced'],
+        'previous_page_count': len(old_pages),
+        'page_count': page_count,
+        'downloaded': len(downloads),
+        'bytes': downloaded_bytes,
+        'seconds': time.monotonic() - start,
+    })
+    archive.record(diff)
+    return diff
@@ -1,14 +1,22 @@
 import sys
 import os
+import argparse
 
 # Adding this so that there is no need to install either library, just have them in the same folder.
 __root_location__ = os.path.realpath(os.path.dirname(__file__))
 sys.path.append(os.path.join(__root_location__, '..'))
 
 from app import app
-if 'PORT' in os.environ:
-    port = os.environ['PORT']
-else:
-    port = 8000
 
-app.run(host="0.0.0.0", port=port)
+parser = argparse.ArgumentParser(description='Runs the web app.')
+parser.add_argument('--port', type=int,
+                    default=int(os.environ.get('PORT', 8000)),
+                    help='port to listen on, defaults to $PORT or 8000')
+parser.add_argument('--workers', type=int,
+                    default=int(os.environ.get('WORKERS', 1)),
+                    help='server processes, defaults to $WORKERS or 1. '
+                         'Background jobs can also run in their own '
+                         'processes, see worker.py.')
+args = parser.parse_args()
+
+app.run(host="0.0.0.0", port=args.port, workers=args.workers)
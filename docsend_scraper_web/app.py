@@ -1,17 +1,31 @@
 import jinja2
 import os
-import asyncio
+import copy
+import time
+import hashlib
+import inspect
+import logging
+from json import dumps
+from configparser import ConfigParser
 from sanic import Sanic
-from sanic.response import json, html, stream, raw
-from reportlab.pdfgen import canvas
+from sanic.response import json, html, stream, raw, file_stream
+from sanic.handlers import ContentRangeHandler
 import docsend_scraper
-from io import BytesIO
+from store import create_store
+from jobs import create_job_queue, FINISHED_STATES, DONE
+from docsend_scraper.singleflight import SingleFlight
+from docsend_scraper import metrics
+from docsend_scraper.models import DocumentInfo
+from docsend_scraper.sinks import OUTPUT_FORMATS
 
 
 __root_location__ = os.path.realpath(os.path.dirname(__file__))
 
 TEMPLATES_FOLDER = os.path.join(__root_location__, 'templates')
 
+CONFIG = ConfigParser()
+CONFIG.read(os.path.join(__root_location__, 'config.ini'))
+
 _templateLoader = jinja2.FileSystemLoader(searchpath=TEMPLATES_FOLDER)
 templateEnv = jinja2.Environment(loader=_templateLoader)
 
@@ -21,7 +35,121 @@ app.static('/img', os.path.join(__root_location__, 'static/img'))
 app.static('/css', os.path.join(__root_location__, 'static/css'))
 app.static('/vendor', os.path.join(__root_location__, 'static/vendor'))
 
-DOC_INFO_CACHE = {}
+# Created once at server start so every request shares the connection pool,
+# the render executor and the pdf cache.
+CLIENT = None
+RENDERER = None
+PDF_CACHE = None
+# Document info and authenticated cookies, see get_authenticated_info
+STORE = None
+# Concurrent requests for the same document share one fetch
+FLIGHTS = SingleFlight()
+# Background downloads, see the /jobs routes
+JOBS = None
+
+# /download sheds requests while the upstream budget is used up
+MAX_WAITING = CONFIG.getint('load', 'max_waiting')
+SHED_RETRY_AFTER = CONFIG.getint('load', 'retry_after')
+
+TRACE_REQUESTS = CONFIG.getboolean('metrics', 'trace_requests')
+TRACE_LOGGER = logging.getLogger('docsend_scraper_web.trace')
+
+REQUESTS = metrics.Counter(
+    'docsend_web_requests_total', 'Requests answered, by route and status',
+    ('route', 'status'))
+RESPONSE_SECONDS = metrics.Histogram(
+    'docsend_web_response_seconds', 'Seconds until the response starts, '
+    'by route. Streamed pdf responses keep going after that.', ('route',))
+JOB_COUNT = metrics.Gauge(
+    'docsend_web_jobs', 'Background jobs by state', ('state',))
+FLIGHTS_IN_FLIGHT = metrics.Gauge(
+    'docsend_web_shared_in_flight', 'Shared gathers, authentications and '
+    'pdf streams running')
+STORE_ENTRIES = metrics.Gauge(
+    'docsend_web_store_entries', 'Entries in the document info store')
+SHED = metrics.Counter(
+    'docsend_web_shed_total', 'Downloads turned away with a 503 because '
+    'docsend was overloaded')
+
+
+@app.listener('before_server_start')
+async def start_client(app, loop):
+    global CLIENT, RENDERER, PDF_CACHE, STORE, JOBS
+    CLIENT = docsend_scraper.DocsendClient()
+    RENDERER = docsend_scraper.Renderer()
+    STORE = create_store(CONFIG['store']['backend'],
+                         CONFIG['store']['path'],
+                         CONFIG.getint('store', 'max_entries'),
+                         CONFIG.getint('store', 'max_bytes'),
+                         CONFIG.getfloat('store', 'ttl'))
+    if docsend_scraper.PDF_CACHE_DIR:
+        PDF_CACHE = docsend_scraper.PdfCache(
+            docsend_scraper.PDF_CACHE_DIR,
+            docsend_scraper.PDF_CACHE_MAX_BYTES)
+    JOBS = create_job_queue(CONFIG['jobs'], CLIENT, RENDERER)
+    JOBS.start()
+
+
+@app.listener('after_server_stop')
+async def close_client(app, loop):
+    if JOBS is not None:
+        await JOBS.stop()
+        JOBS.close()
+    if CLIENT is not None:
+        await CLIENT.close()
+    if hasattr(STORE, 'close'):
+        STORE.close()
+    if RENDERER is not None:
+        RENDERER.close()
+
+
+def log_span(span):
+    """
+    Trace hook that logs the spans of traced requests.
+    """
+    if span.trace_id is not None:
+        TRACE_LOGGER.info(dumps(span.to_dict()))
+
+
+if TRACE_REQUESTS:
+    TRACE_LOGGER.setLevel(logging.INFO)
+    TRACE_LOGGER.addHandler(logging.StreamHandler())
+    metrics.add_trace_hook(log_span)
+
+
+@app.middleware('request')
+async def start_request(request):
+    request.ctx.started = time.perf_counter()
+    if TRACE_REQUESTS:
+        request.ctx.trace_id = metrics.start_trace(
+            request.headers.get('X-Request-Id'))
+
+
+@app.middleware('response')
+async def finish_request(request, response):
+    route = request.uri_template or 'unknown'
+    REQUESTS.inc(route=route, status=response.status)
+    started = getattr(request.ctx, 'started', None)
+    if started is not None:
+        RESPONSE_SECONDS.observe(time.perf_counter() - started, route=route)
+    trace_id = getattr(request.ctx, 'trace_id', None)
+    if trace_id is not None:
+        response.headers['X-Trace-Id'] = trace_id
+
+
+@app.route('/metrics')
+async def get_metrics(request):
+    """
+    Metrics of this worker in the Prometheus text format.
+    """
+    if JOBS is not None:
+        for state, count in JOBS.counts().items():
+            JOB_COUNT.set(count, state=state)
+    FLIGHTS_IN_FLIGHT.set(FLIGHTS.in_flight())
+    if STORE is not None:
+        STORE_ENTRIES.set(len(STORE))
+    return raw(metrics.REGISTRY.render().encode(),
+               content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/')
@@ -32,56 +160,318 @@ def index(request):
 
 
 @app.route('/is_valid_doc_id/<doc_id>')
-def is_valid_doc_id(doc_id):
-    is_valid = docsend_scraper.is_valid_doc_id(doc_id)
+async def is_valid_doc_id(request, doc_id):
+    is_valid = await docsend_scraper.is_valid_doc_id_async(doc_id, CLIENT)
     return json({'result': is_valid})
 
 
+def remember(key, doc_info):
+    """
+    Stores document info until the store ttl runs out or the document
+    cookies expire, whichever comes first.
+    """
+    ttl = None
+    expires = doc_info.get('cookies_expire')
+    if expires is not None:
+        ttl = expires - time.time()
+        if STORE.ttl:
+            ttl = min(ttl, STORE.ttl)
+        if ttl <= 0:
+            return
+    STORE.set(key, doc_info.to_dict(), ttl)
+
+
+def recall(key):
+    """
+    Returns the document info stored with remember, None if there is none.
+    """
+    doc_info = STORE.get(key)
+    return None if doc_info is None else DocumentInfo.from_dict(doc_info)
+
+
+async def _gather_doc_info(doc_id):
+    doc_info = recall(doc_id)
+    if doc_info is None:
+        doc_info = await docsend_scraper.gather_document_info(doc_id, CLIENT)
+        remember(doc_id, doc_info)
+    return doc_info
+
+
+async def get_doc_info(doc_id):
+    """
+    Returns the info of a document from the store, or gathers and stores it.
+    Concurrent requests for the same document share one gather.
+    """
+    doc_info = await FLIGHTS.do(('info', doc_id),
+                                lambda: _gather_doc_info(doc_id))
+    return copy.deepcopy(doc_info)
+
+
+def credentials_key(doc_id, email, passcode):
+    """
+    Key of a document and the credentials used for it. The credentials are
+    hashed so they are not kept in the store or logs.
+    """
+    credentials = hashlib.sha256(f'{email}\0{passcode}'.encode()).hexdigest()
+    return f'{doc_id}:{credentials}'
+
+
+async def _authenticate(key, doc_id, email, passcode):
+    doc_info = recall(key)
+    if doc_info is None:
+        doc_info = await get_doc_info(doc_id)
+        await docsend_scraper.authenticate_document(doc_info, email, passcode,
+                                                    CLIENT)
+        remember(key, doc_info)
+    return doc_info
+
+
+async def get_authenticated_info(doc_id, email, passcode):
+    """
+    Returns the info of a document with cookies authenticated for the given
+    email and passcode. Authenticated info is stored under the doc id and a
+    hash of the credentials, so the cookies are reused until they expire.
+    Concurrent requests with the same credentials share one authentication.
+
+    :raises InfoRequiredError: the email or passcode is missing
+    :raises AuthError: the server refused the email or passcode
+    """
+    key = credentials_key(doc_id, email, passcode)
+    doc_info = await FLIGHTS.do(
+        ('auth', key), lambda: _authenticate(key, doc_id, email, passcode))
+    return copy.deepcopy(doc_info)
+
+
 @app.route('/get_document_info/<doc_id>')
 async def get_document_info(request, doc_id):
-    doc_info = await docsend_scraper.gather_document_info(doc_id)
-    if 'html' in doc_info:
-        del doc_info['html']
-    print(doc_id, doc_info)
-    global DOC_INFO_CACHE
-    DOC_INFO_CACHE[doc_id] = doc_info
-    return json(doc_info)
+    doc_info = await get_doc_info(doc_id)
+    return json(doc_info.to_dict())
+
+
+async def write_chunk(response, data):
+    """
+    Writes data to a streaming response. Newer Sanic versions make write a
+    coroutine that waits for the client to drain the data, older ones write
+    straight to the transport.
+    """
+    result = response.write(data)
+    if inspect.isawaitable(result):
+        await result
+
+
+def shed_load():
+    """
+    Turns a download away while docsend asked to hold requests, or more than
+    MAX_WAITING requests already wait for a slot of the shared scheduler.
+    Starting more downloads then would only make every one of them slower,
+    or fail together.
+
+    :returns: (sanic.response.HTTPResponse) 503 with a Retry-After, None if
+                the download can start
+    """
+    scheduler = CLIENT.scheduler
+    if not scheduler.overloaded(MAX_WAITING):
+        return None
+    SHED.inc()
+    retry_after = max(SHED_RETRY_AFTER, int(scheduler.retry_after()) + 1)
+    return json({'message': 'Too Busy, Try Again Later'}, status=503,
+                headers={'Retry-After': str(retry_after)})
+
+
+def document_spool(doc_info):
+    """
+    :returns: (PageSpool) spool of the document, None if no spool directory
+                is configured
+    """
+    if not docsend_scraper.SPOOL_DIR:
+        return None
+    return docsend_scraper.PageSpool(docsend_scraper.SPOOL_DIR,
+                                     doc_info['id'], doc_info['page_count'])
+
+
+async def pdf_source(doc_info, image_urls=None, fingerprint=None,
+                     pages=None):
+    """
+    Async generator of the pdf of an authenticated document. With a
+    fingerprint, the pdf is also written to the pdf cache. With a spool
+    directory configured, pages survive a failed attempt, so the next request
+    for the document only fetches the missing ones. With pages, only those
+    pages are fetched and put in the pdf.
+    """
+    cache_entry = None
+    if fingerprint is not None:
+        cache_entry = PDF_CACHE.entry(doc_info['id'], fingerprint)
+    spool = document_spool(doc_info)
+    pdf = docsend_scraper.stream_docsend_pdf(doc_info, CLIENT,
+                                             renderer=RENDERER,
+                                             image_urls=image_urls,
+                                             spool=spool, pages=pages)
+    try:
+        async for chunk in pdf:
+            if cache_entry is not None:
+                cache_entry.write(chunk)
+            yield chunk
+    except BaseException:
+        if cache_entry is not None:
+            cache_entry.discard()
+        if spool is not None:
+            spool.close()
+        raise
+    if cache_entry is not None:
+        cache_entry.commit()
+    if spool is not None:
+        spool.clear()
+
+
+def stream_pdf(key, doc_info, headers, image_urls=None, fingerprint=None,
+               pages=None):
+    """
+    Builds a chunked response that sends the pdf as pages are downloaded.
+    Requests with the same key attach to the same running pdf, so the
+    document is only fetched once however many clients ask for it. The pdf
+    keeps building if a client goes away.
+
+    :key: (str) key of the document and credentials, see credentials_key
+    :doc_info: (dict) info of an already authenticated document
+    :headers: (dict) headers of the response
+    :image_urls: (list) page image urls if they were already requested
+    :fingerprint: (str) fingerprint to cache the pdf under
+    :pages: (list) only send these pages
+    """
+    async def streaming_fn(response):
+        shared = FLIGHTS.stream(
+            ('pdf', key, fingerprint, pages and tuple(pages)),
+            lambda: pdf_source(doc_info, image_urls, fingerprint, pages))
+        async for chunk in shared.read():
+            await write_chunk(response, chunk)
+
+    return stream(streaming_fn, content_type='application/pdf',
+                  headers=headers)
+
+
+async def zip_source(doc_info, pages=None):
+    """
+    Async generator of a zip of the page images of an authenticated
+    document.
+    """
+    spool = document_spool(doc_info)
+    zip_file = docsend_scraper.stream_docsend_zip(doc_info, CLIENT,
+                                                  spool=spool, pages=pages)
+    try:
+        async for chunk in zip_file:
+            yield chunk
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
+    if spool is not None:
+        spool.clear()
+
+
+def stream_zip(key, doc_info, output_format, pages=None):
+    """
+    Builds a chunked response that sends the page images of a document, as
+    a zip or a cbz, as they are downloaded. Like stream_pdf, requests with
+    the same key share one download.
+
+    :key: (str) key of the document and credentials, see credentials_key
+    :doc_info: (dict) info of an already authenticated document
+    :output_format: (str) zip or cbz
+    :pages: (list) only send these pages
+    """
+    extension, content_type = OUTPUT_FORMATS[output_format]
+    headers = {
+        'Content-Disposition': 'attachment; filename="Docsend-{}{}"'.format(
+            doc_info['id'], extension)
+    }
+
+    async def streaming_fn(response):
+        shared = FLIGHTS.stream(('zip', key, pages and tuple(pages)),
+                                lambda: zip_source(doc_info, pages))
+        async for chunk in shared.read():
+            await write_chunk(response, chunk)
+
+    return stream(streaming_fn, content_type=content_type, headers=headers)
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Checks an If-None-Match header against the ETag of a response.
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+async def send_pdf(request, key, doc_info, pages=None):
+    """
+    Sends the pdf of an authenticated document.
+
+    With a pdf cache, the page image urls are requested first to fingerprint
+    the document. The fingerprint is the ETag of the response. An unchanged
+    pdf is served straight from disk, with range request support, and a new
+    one is copied to the cache while it streams to the client.
+
+    :key: (str) key of the document and credentials, see credentials_key
+    :doc_info: (dict) info of an already authenticated document
+    :pages: (list) only send these pages
+    """
+    doc_id = doc_info['id']
+    output_filename = f'Docsend-{doc_id}.pdf'
+    headers = {
+        'Content-Disposition': 'attachment; filename="{}"'.format(
+            output_filename)
+    }
+    if PDF_CACHE is None:
+        return stream_pdf(key, doc_info, headers, pages=pages)
+
+    # The urls name their page, so a selection of pages gets a fingerprint
+    # of its own
+    image_urls = await docsend_scraper.get_document_img_urls(doc_info, CLIENT,
+                                                             pages)
+    fingerprint = PDF_CACHE.fingerprint(image_urls)
+    etag = f'"{fingerprint}"'
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return raw(b'', status=304, headers={'ETag': etag})
+
+    headers['ETag'] = etag
+    path = PDF_CACHE.get(doc_id, fingerprint)
+    if path is None:
+        return stream_pdf(key, doc_info, headers, image_urls, fingerprint,
+                          pages)
+
+    headers['Accept-Ranges'] = 'bytes'
+    _range = None
+    if 'Range' in request.headers:
+        _range = ContentRangeHandler(request, os.stat(path))
+    return await file_stream(path, mime_type='application/pdf',
+                             headers=headers, _range=_range)
 
 
 @app.route('/download2/<doc_id>')
 async def download_docsend(request, doc_id):
     """
-    Downloads the document from the server and converts to a pdf.
+    Downloads the document from the server and streams it as a pdf.
     Notes:
         * email and passcode are not used if function does not detect it
             is needed.
-        * If canvas is provided then output_path is not utilized since the
-            path must be designated at the time of creation.
-
 
     :doc_id: (str) id of the document to be downloaded
     :email: (str) email to use to authenticate if needed
     :passcode: (str) passcode to use to authenticate if needed
-
-    :output_path: (str) path to use when saving file.
-    :output_canvas: (reportlab.pdfgen.canvas.Canvas) preconfigured canvas to
-                    save the downloaded document to.
-    :save_output: (bool) flag to save the output before exiting function
     """
+    shed = shed_load()
+    if shed is not None:
+        return shed
 
     # Gather basic information and get cookies
-    global DOC_INFO_CACHE
-    if doc_id in DOC_INFO_CACHE:
-        doc_info = DOC_INFO_CACHE[doc_id]
-    else:
-        doc_info = await docsend_scraper.gather_document_info(doc_id)
-
-    cookies = doc_info['cookies']
+    doc_info = await get_doc_info(doc_id)
 
     email = passcode = None
     if doc_info['passcode_required']:
         if 'passcode' in request.args:
-            passcode = request.args['passcode']
+            passcode = request.args.get('passcode')
         else:
             return json(
                 {'message': 'Missing Information: Passcode'},
@@ -90,7 +480,7 @@ async def download_docsend(request, doc_id):
 
     if doc_info['email_required']:
         if 'email' in request.args:
-            email = request.args['email']
+            email = request.args.get('email')
         else:
             return json(
                 {'message': 'Missing Information: Email'},
@@ -98,7 +488,7 @@ async def download_docsend(request, doc_id):
             )
 
     try:
-        c = await docsend_scraper.download_docsend(doc_info, email, passcode)
+        doc_info = await get_authenticated_info(doc_id, email, passcode)
     except docsend_scraper.AuthError:
         return json(
             {
@@ -108,97 +498,119 @@ async def download_docsend(request, doc_id):
             status=400
         )
 
-        # Authenticate
-    # if doc_info['email_required'] or doc_info['passcode_required']:
-    #     auth_response = docsend_scraper.authenticate_cookie(
-    #         doc_info['url'],
-    #         cookies,
-    #         doc_info['authenticity_token'],
-    #         email, passcode)
-
-    #     if auth_response.status_code not in [200, 302] \
-    #             or "review the problems" in auth_response.text:
-    #         return json(
-    #             {
-    #                 'message': 'Authentication Error',
-    #                 'id': doc_id
-    #             },
-    #             status=400
-    #         )
-
-    # Retrieve Image Urls
-    image_urls = await docsend_scraper.get_document_img_urls(doc_info)
-
-    # Download Images
-    imgs_coros = []
-    for image_url in image_urls:
-        imgs_coros.append(
-            docsend_scraper.download_image_for_document(cookies, image_url))
-    imgs = await asyncio.gather(*imgs_coros)
-
-    # Generate PDF
-    output_filename = f'Docsend-{doc_id}.pdf'
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer)
-    for img in imgs:
-        c.setPageSize(img.size)
-        c.drawInlineImage(img, 0, 0)
-        c.showPage()
-    c.save()
-
-    pdf = buffer.getvalue()
-    buffer.close()
-
-    async def streaming_fn(response):
-        response.write(pdf)
-
-    headers = {
-        'Content-Disposition': 'attachment; filename="{}"'.format(
-            output_filename)
-    }
-    return stream(streaming_fn, content_type='application/pdf',
-                  headers=headers)
+    key = credentials_key(doc_id, email, passcode)
+    return await send_pdf(request, key, doc_info)
 
 
 @app.route('/download/<doc_id>')
 async def download_docsend(request, doc_id):
     """
-    Downloads the document from the server and converts to a pdf.
+    Downloads the document from the server and streams it as a pdf. The
+    response starts as soon as the first page is ready and memory use does
+    not grow with the page count.
     Notes:
         * email and passcode are not used if function does not detect it
             is needed.
-        * If canvas is provided then output_path is not utilized since the
-            path must be designated at the time of creation.
-
+        * format=zip or format=cbz sends the page images as they came from
+            the server instead of a pdf.
+        * pages=1-5,12 only fetches and sends those pages.
 
     :doc_id: (str) id of the document to be downloaded
     :email: (str) email to use to authenticate if needed
     :passcode: (str) passcode to use to authenticate if needed
+    :format: (str) pdf, zip or cbz. Defaults to pdf.
+    :pages: (str) pages to send, see doc_info.parse_page_range. Defaults to
+                every page.
+
+    Answers 503 with a Retry-After while docsend is overloaded, see
+    shed_load.
+    """
+    shed = shed_load()
+    if shed is not None:
+        return shed
+
+    email = request.args.get('email')
+    passcode = request.args.get('passcode')
+    output_format = request.args.get('format', 'pdf')
+    if output_format not in ('pdf', 'zip', 'cbz'):
+        return json({'message': f'Unknown format: {output_format}'},
+                    status=400)
+
+    # Gather basic information and get authenticated cookies
+    try:
+        doc_info = await get_authenticated_info(doc_id, email, passcode)
+    except docsend_scraper.InfoRequiredError as e:
+        if e.passcode_required:
+            return json(
+                {'message': 'Missing Information: Passcode'},
+                status=400
+            )
+        else:
+            return json(
+                {'message': 'Missing Information: Email'},
+                status=400
+            )
 
-    :output_path: (str) path to use when saving file.
-    :output_canvas: (reportlab.pdfgen.canvas.Canvas) preconfigured canvas to
-                    save the downloaded document to.
-    :save_output: (bool) flag to save the output before exiting function
+    except docsend_scraper.AuthError:
+        return json(
+            {
+                'message': 'Authentication Error',
+                'id': doc_id
+            },
+            status=400
+        )
+
+    pages = None
+    if 'pages' in request.args:
+        try:
+            pages = docsend_scraper.select_pages(doc_info,
+                                                 request.args.get('pages'))
+        except ValueError as e:
+            return json({'message': str(e)}, status=400)
+
+    key = credentials_key(doc_id, email, passcode)
+    if output_format != 'pdf':
+        return stream_zip(key, doc_info, output_format, pages)
+    return await send_pdf(request, key, doc_info, pages)
+
+
+def request_field(request, name):
+    """
+    Reads a field of a request from its json body, its form or its query
+    string, in that order.
     """
+    body = None
+    if request.content_type == 'application/json':
+        body = request.json
+    if body is not None and name in body:
+        return body[name]
+    if name in request.form:
+        return request.form.get(name)
+    return request.args.get(name)
+
+
+@app.route('/jobs', methods=['POST'])
+async def submit_job(request):
+    """
+    Queues the download of a document. The credentials are checked right
+    away, so a job only fails later if the download itself fails.
 
-    # Gather basic information and get cookies
-    global DOC_INFO_CACHE
-    if doc_id in DOC_INFO_CACHE:
-        doc_info = DOC_INFO_CACHE[doc_id]
-    else:
-        doc_info = await docsend_scraper.gather_document_info(doc_id)
+    :doc_id: (str) id or url of the document to be downloaded
+    :email: (str) email to use to authenticate if needed
+    :passcode: (str) passcode to use to authenticate if needed
 
-    email = passcode = None
-    if 'passcode' in request.args:
-        passcode = request.args['passcode']
-    if 'email' in request.args:
-        email = request.args['email']
+    :returns: (json) id of the job and the url to poll it at, with a 202
+    """
+    doc_id = request_field(request, 'doc_id')
+    if doc_id and '.com' in doc_id:
+        doc_id = docsend_scraper.doc_info.get_id_from_url(doc_id)
+    if not doc_id:
+        return json({'message': 'Missing Information: Document'}, status=400)
+    email = request_field(request, 'email')
+    passcode = request_field(request, 'passcode')
 
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer)
     try:
-        await docsend_scraper.download_docsend(doc_info, email, passcode,
-                                               output_canvas=c)
+        doc_info = await get_authenticated_info(doc_id, email, passcode)
     except docsend_scraper.InfoRequiredError as e:
         if e.passcode_required:
             return json(
@@ -220,15 +632,74 @@ async def download_docsend(request, doc_id):
             status=400
         )
 
-    pdf = buffer.getvalue()
-    buffer.close()
+    job_id = JOBS.submit(doc_info)
+    return json(
+        {
+            'id': job_id,
+            'url': f'/jobs/{job_id}',
+            'job': JOBS.get(job_id)
+        },
+        status=202
+    )
+
+
+@app.route('/jobs/<job_id>')
+async def get_job(request, job_id):
+    """
+    State and progress of a job. pages_done counts the pages already added
+    to the pdf out of page_count.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return json({'message': 'Unknown Job', 'id': job_id}, status=404)
+    return json(job)
+
+
+@app.route('/jobs/<job_id>/events')
+async def job_events(request, job_id):
+    """
+    Server sent events with the state of a job, sent whenever it changes
+    until the job is finished.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return json({'message': 'Unknown Job', 'id': job_id}, status=404)
 
     async def streaming_fn(response):
-        response.write(pdf)
-    output_filename = f'Docsend-{doc_id}.pdf'
+        job = JOBS.get(job_id)
+        while True:
+            await write_chunk(response, f'data: {dumps(job)}\n\n')
+            if job is None or job['state'] in FINISHED_STATES:
+                return
+            # Also wakes up now and then for jobs run by other workers, and
+            # to keep proxies from closing an idle connection.
+            await JOBS.wait(job_id, timeout=15)
+            job = JOBS.get(job_id)
+
+    return stream(streaming_fn, content_type='text/event-stream',
+                  headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/jobs/<job_id>/pdf')
+async def get_job_pdf(request, job_id):
+    """
+    The pdf of a finished job, with range request support. Answers 409 with
+    the job while it is not done.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return json({'message': 'Unknown Job', 'id': job_id}, status=404)
+    if job['state'] != DONE:
+        return json({'message': 'Job Not Done', 'job': job}, status=409)
+
+    path = JOBS.pdf_path(job_id)
     headers = {
         'Content-Disposition': 'attachment; filename="{}"'.format(
-            output_filename)
+            f'Docsend-{job["doc_id"]}.pdf'),
+        'Accept-Ranges': 'bytes',
     }
-    return stream(streaming_fn, content_type='application/pdf',
-                  headers=headers)
+    _range = None
+    if 'Range' in request.headers:
+        _range = ContentRangeHandler(request, os.stat(path))
+    return await file_stream(path, mime_type='application/pdf',
+                             headers=headers, _range=_range)
@@ -0,0 +1,433 @@
+"""
+jobs.py
+
+Background download jobs. A job is submitted with the info of an already
+authenticated document and runs on a bounded pool of workers, so a burst of
+downloads waits in the queue instead of holding requests open until they
+time out. The pdf is written to disk, where it can be fetched once the job is
+done, and a client that goes away does not throw the work away.
+
+Jobs are kept in a SQLite file, which is also the broker between processes.
+A job is split into tasks: shards of at most shard_pages pages, and a merge
+that writes the pdf once every shard is done. Any worker of any process that
+uses the same file can claim a task, so a large document is downloaded and
+encoded by several processes at once, see worker.py.
+
+A running task holds a lease that its worker renews. Tasks whose lease ran
+out, because their process died, are queued again, and the pages a shard
+already finished are kept.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import docsend_scraper
+from docsend_scraper.models import DocumentInfo
+from docsend_scraper.pdf import PdfWriter, encode_image, dump_image, \
+    load_image
+
+
+# Job and task states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, FAILED)
+# Merge tasks wait until every shard of their job is done
+WAITING = 'waiting'
+
+# Task kinds
+SHARD = 'shard'
+MERGE = 'merge'
+
+# Columns of a job that are shown to clients
+PUBLIC_FIELDS = ('id', 'doc_id', 'state', 'page_count', 'pages_done',
+                 'error', 'created', 'started', 'finished')
+
+
+def create_job_queue(config, client=None, renderer=None, workers=None):
+    """
+    :config: (configparser.SectionProxy) the [jobs] section of config.ini
+    :client: (DocsendClient) client the jobs download with
+    :renderer: (Renderer) renderer the jobs encode pages with
+    :workers: (int) tasks run at the same time. Defaults to the config.
+
+    :returns: (JobQueue)
+    """
+    return JobQueue(config['path'], config['directory'],
+                    config.getint('workers') if workers is None else workers,
+                    client, renderer, config.getfloat('keep_finished'),
+                    shard_pages=config.getint('shard_pages'),
+                    lease_timeout=config.getfloat('lease_timeout'))
+
+
+class JobQueue:
+    """
+    Persistent queue of pdf downloads with a pool of workers.
+
+    :path: (str) path of the database file
+    :directory: (str) where finished pdf files are kept
+    :workers: (int) tasks run at the same time. 0 only queues jobs, for
+                a process whose jobs are run by other processes.
+    :client: (DocsendClient) client the jobs download with
+    :renderer: (Renderer) renderer the jobs encode pages with
+    :keep_finished: (float) seconds finished jobs and their pdf files are
+                    kept. 0 to keep them forever.
+    :poll_interval: (float) seconds between checks for jobs submitted by
+                    other processes
+    :shard_pages: (int) pages per shard. 0 for one shard per job.
+    :lease_timeout: (float) seconds a running task is kept by a worker that
+                    stopped renewing it, before it is queued again
+    """
+
+    def __init__(self, path, directory, workers=2, client=None,
+                 renderer=None, keep_finished=0, poll_interval=1,
+                 shard_pages=0, lease_timeout=60):
+        self.path = path
+        self.directory = os.path.expanduser(directory)
+        self.workers = max(0, workers)
+        self.client = client
+        self.renderer = renderer
+        self.keep_finished = keep_finished
+        self.poll_interval = poll_interval
+        self.shard_pages = shard_pages
+        self.lease_timeout = lease_timeout
+        # Marks the tasks this queue runs, so they can be given back on stop
+        self.worker_id = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, doc_id TEXT, state TEXT, doc_info TEXT, '
+            'page_count INTEGER, pages_done INTEGER, error TEXT, '
+            'created REAL, started REAL, finished REAL)')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'job_id TEXT, task INTEGER, kind TEXT, first_page INTEGER, '
+            'last_page INTEGER, state TEXT, worker TEXT, lease REAL, '
+            'created REAL, PRIMARY KEY (job_id, task))')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS tasks_state ON tasks '
+            '(state, created, task)')
+        self._tasks = []
+        self._wakeup = None
+        # job id -> event set when the job changes, see wait
+        self._changed = {}
+
+    def start(self):
+        """
+        Starts the workers. Call from inside the event loop.
+        """
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker())
+                       for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Stops the workers. Their running tasks are queued again right away
+        and the pages they finished are kept.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._db.execute('UPDATE tasks SET state = ?, worker = NULL '
+                         'WHERE worker = ? AND state = ?',
+                         (QUEUED, self.worker_id, RUNNING))
+
+    def close(self):
+        self._db.close()
+
+    def pdf_path(self, job_id):
+        """
+        :returns: (str) path of the pdf of a job
+        """
+        return os.path.join(self.directory, f'{job_id}.pdf')
+
+    def pages_path(self, job_id):
+        """
+        :returns: (str) directory the shards of a job keep encoded pages in
+        """
+        return os.path.join(self.directory, f'{job_id}.pages')
+
+    def submit(self, doc_info):
+        """
+        Queues the download of a document.
+
+        :doc_info: (DocumentInfo or dict) info of an already authenticated
+                    document. Kept with the job, so the download can start
+                    after a restart as long as the cookies have not expired.
+
+        :returns: (str) id of the job
+        """
+        job_id = uuid.uuid4().hex
+        doc_info = DocumentInfo.from_dict(doc_info)
+        page_count = doc_info['page_count']
+        shard_pages = self.shard_pages or max(1, page_count)
+        shards = [(first, min(first + shard_pages - 1, page_count))
+                  for first in range(1, page_count + 1, shard_pages)]
+        now = time.time()
+        with self._db:
+            self._db.execute('BEGIN')
+            self._db.execute(
+                'INSERT INTO jobs VALUES '
+                '(?, ?, ?, ?, ?, 0, NULL, ?, NULL, NULL)',
+                (job_id, doc_info['id'], QUEUED,
+                 json.dumps(doc_info.to_dict()), page_count, now))
+            self._db.executemany(
+                'INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?)',
+                [(job_id, task, SHARD, first, last, QUEUED, now)
+                 for task, (first, last) in enumerate(shards)])
+            # A document without pages only has the merge to run
+            self._db.execute(
+                'INSERT INTO tasks VALUES (?, ?, ?, 1, ?, ?, NULL, NULL, ?)',
+                (job_id, len(shards), MERGE, page_count,
+                 WAITING if shards else QUEUED, now))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        :job_id: (str) id of the job
+
+        :returns: (dict) public fields of the job and its position in the
+                    queue, None if there is no such job
+        """
+        row = self._db.execute('SELECT * FROM jobs WHERE id = ?',
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {field: row[field] for field in PUBLIC_FIELDS}
+        job['position'] = None
+        if job['state'] == QUEUED:
+            job['position'] = self._db.execute(
+                'SELECT COUNT(*) FROM jobs WHERE state = ? AND created < ?',
+                (QUEUED, job['created'])).fetchone()[0]
+        return job
+
+    def counts(self):
+        """
+        :returns: (dict) number of jobs in each state
+        """
+        counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+        counts.update(self._db.execute(
+            'SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+    async def wait(self, job_id, timeout=None):
+        """
+        Waits until a job changes, or the timeout runs out. Only sees changes
+        made by this process.
+
+        :returns: (bool) True if the job changed
+        """
+        event = self._changed.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _notify(self, job_id):
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _update(self, job_id, **fields):
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        self._db.execute(f'UPDATE jobs SET {columns} WHERE id = ?',
+                         (*fields.values(), job_id))
+        self._notify(job_id)
+
+    def _requeue_expired(self):
+        """
+        Queues the tasks of workers that stopped renewing their lease.
+        """
+        self._db.execute('UPDATE tasks SET state = ?, worker = NULL '
+                         'WHERE state = ? AND lease < ?',
+                         (QUEUED, RUNNING, time.time()))
+
+    def _claim(self):
+        """
+        Marks the oldest queued task as running by this queue.
+
+        :returns: (sqlite3.Row) the task, None if there is none
+        """
+        while True:
+            row = self._db.execute(
+                'SELECT * FROM tasks WHERE state = ? '
+                'ORDER BY created, task LIMIT 1', (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            # Another process may have claimed it in the meantime
+            cursor = self._db.execute(
+                'UPDATE tasks SET state = ?, worker = ?, lease = ? '
+                'WHERE job_id = ? AND task = ? AND state = ?',
+                (RUNNING, self.worker_id, time.time() + self.lease_timeout,
+                 row['job_id'], row['task'], QUEUED))
+            if cursor.rowcount:
+                cursor = self._db.execute(
+                    'UPDATE jobs SET state = ?, started = ? '
+                    'WHERE id = ? AND state = ?',
+                    (RUNNING, time.time(), row['job_id'], QUEUED))
+                if cursor.rowcount:
+                    self._notify(row['job_id'])
+                return row
+
+    def _remove_expired(self):
+        if not self.keep_finished:
+            return
+        expired = self._db.execute(
+            'SELECT id FROM jobs WHERE finished < ?',
+            (time.time() - self.keep_finished,)).fetchall()
+        for row in expired:
+            try:
+                os.remove(self.pdf_path(row['id']))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(self.pages_path(row['id']), ignore_errors=True)
+            self._db.execute('DELETE FROM tasks WHERE job_id = ?',
+                             (row['id'],))
+            self._db.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+
+    async def _worker(self):
+        while True:
+            self._requeue_expired()
+            row = self._claim()
+            if row is None:
+                self._remove_expired()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(),
+                                           self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(row)
+
+    async def _renew_lease(self, row):
+        while True:
+            await asyncio.sleep(self.lease_timeout / 4)
+            self._db.execute(
+                'UPDATE tasks SET lease = ? '
+                'WHERE job_id = ? AND task = ? AND worker = ?',
+                (time.time() + self.lease_timeout, row['job_id'],
+                 row['task'], self.worker_id))
+
+    async def _run(self, row):
+        job_id = row['job_id']
+        job = self._db.execute('SELECT * FROM jobs WHERE id = ?',
+                               (job_id,)).fetchone()
+        if job is None or job['state'] in FINISHED_STATES:
+            # The job failed in another shard, or expired
+            self._finish_task(row, FAILED)
+            return
+        doc_info = DocumentInfo.from_dict(json.loads(job['doc_info']))
+        renew = asyncio.ensure_future(self._renew_lease(row))
+        try:
+            if row['kind'] == MERGE:
+                await self._merge(job_id, doc_info)
+            else:
+                await self._run_shard(job_id, doc_info, row)
+        except asyncio.CancelledError:
+            # The server is stopping, stop gives the task back
+            raise
+        except Exception as e:
+            self._finish_task(row, FAILED)
+            self._fail(job_id, f'{type(e).__name__}: {e}')
+        else:
+            self._finish_task(row, DONE)
+            if row['kind'] == MERGE:
+                self._update(job_id, state=DONE, finished=time.time())
+            else:
+                self._queue_merge(job_id)
+        finally:
+            renew.cancel()
+
+    def _finish_task(self, row, state):
+        self._db.execute(
+            'UPDATE tasks SET state = ?, worker = NULL '
+            'WHERE job_id = ? AND task = ? AND worker = ?',
+            (state, row['job_id'], row['task'], self.worker_id))
+
+    def _queue_merge(self, job_id):
+        """
+        Queues the merge of a job once none of its shards is left.
+        """
+        cursor = self._db.execute(
+            'UPDATE tasks SET state = ? '
+            'WHERE job_id = ? AND kind = ? AND state = ? AND NOT EXISTS ('
+            'SELECT 1 FROM tasks WHERE job_id = ? AND kind = ? '
+            'AND state != ?)',
+            (QUEUED, job_id, MERGE, WAITING, job_id, SHARD, DONE))
+        if cursor.rowcount and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _fail(self, job_id, error):
+        self._db.execute(
+            'UPDATE tasks SET state = ? WHERE job_id = ? AND state IN (?, ?)',
+            (FAILED, job_id, QUEUED, WAITING))
+        self._update(job_id, state=FAILED, finished=time.time(), error=error)
+        shutil.rmtree(self.pages_path(job_id), ignore_errors=True)
+
+    def _page_path(self, job_id, page):
+        return os.path.join(self.pages_path(job_id), f'{page}.page')
+
+    async def _run_shard(self, job_id, doc_info, row):
+        """
+        Downloads and encodes the pages of a shard. Pages a previous attempt
+        finished are skipped.
+        """
+        os.makedirs(self.pages_path(job_id), exist_ok=True)
+        pages = [page for page in range(row['first_page'],
+                                        row['last_page'] + 1)
+                 if not os.path.exists(self._page_path(job_id, page))]
+        if not pages:
+            return
+        images = docsend_scraper.iter_document_pages(
+            doc_info, self.client, prepare=encode_image,
+            renderer=self.renderer, pages=pages)
+        async for page, image in images:
+            path = self._page_path(job_id, page)
+            tmp_path = f'{path}.{self.worker_id}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(dump_image(image))
+            os.replace(tmp_path, path)
+            self._db.execute(
+                'UPDATE jobs SET pages_done = pages_done + 1 WHERE id = ?',
+                (job_id,))
+            self._notify(job_id)
+
+    async def _merge(self, job_id, doc_info):
+        """
+        Writes the pdf of a job from the pages of its shards.
+        """
+        path = self.pdf_path(job_id)
+        # A worker whose lease ran out may still be merging the same job
+        part_path = f'{path}.{self.worker_id}.part'
+        writer = PdfWriter(doc_info['id'])
+        try:
+            with open(part_path, 'wb') as f:
+                f.write(writer.header())
+                for page in range(1, doc_info['page_count'] + 1):
+                    with open(self._page_path(job_id, page), 'rb') as page_f:
+                        image = load_image(page_f.read())
+                    f.write(writer.page(image))
+                    # Lets the lease be renewed during long merges
+                    await asyncio.sleep(0)
+                f.write(writer.trailer())
+            os.replace(part_path, path)
+        finally:
+            try:
+                os.remove(part_path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(self.pages_path(job_id), ignore_errors=True)
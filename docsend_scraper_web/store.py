@@ -0,0 +1,181 @@
+"""
+store.py
+
+Bounded stores for the document info (cookies, page count, auth state) the
+web app keeps between requests. Entries expire after a time to live and the
+least recently used entries are dropped once the store holds too many
+entries or too many bytes. Values are kept as json, which is also what their
+size is measured on.
+
+MemoryStore is local to a worker. SqliteStore keeps the entries in a SQLite
+file so every worker on the machine sees the same entries.
+"""
+import json
+import time
+import sqlite3
+import collections
+
+
+class MemoryStore:
+    """
+    In process store.
+
+    :max_entries: (int) max number of entries. 0 for no limit.
+    :max_bytes: (int) max total size of the values. 0 for no limit.
+    :ttl: (float) default seconds an entry lives
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0, ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # key -> (json value, expires)
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :key: (str) key of the entry
+
+        :returns: a copy of the value, None if missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        """
+        :key: (str) key of the entry
+        :value: json serializable value
+        :ttl: (float) seconds the entry lives. Defaults to the store ttl.
+        """
+        self.delete(key)
+        value = json.dumps(value)
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        self._entries[key] = (value, expires)
+        self.size += len(value)
+        self._evict()
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def _evict(self):
+        while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries)
+                or (self.max_bytes and self.size > self.max_bytes)):
+            key, (value, _) = self._entries.popitem(last=False)
+            self.size -= len(value)
+
+
+class SqliteStore:
+    """
+    Store kept in a SQLite file, shared by every process that opens it.
+
+    :path: (str) path of the database file
+    :max_entries: (int) max number of entries. 0 for no limit.
+    :max_bytes: (int) max total size of the values. 0 for no limit.
+    :ttl: (float) default seconds an entry lives
+    """
+
+    def __init__(self, path, max_entries=0, max_bytes=0, ttl=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT, size INTEGER, '
+            'expires REAL, accessed REAL)')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS entries_accessed '
+            'ON entries (accessed)')
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self):
+        return self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        """
+        :key: (str) key of the entry
+
+        :returns: the value, None if missing or expired
+        """
+        now = time.time()
+        row = self._db.execute(
+            'SELECT value FROM entries WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)', (key, now)).fetchone()
+        if row is None:
+            return None
+        self._db.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                         (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """
+        :key: (str) key of the entry
+        :value: json serializable value
+        :ttl: (float) seconds the entry lives. Defaults to the store ttl.
+        """
+        now = time.time()
+        value = json.dumps(value)
+        ttl = self.ttl if ttl is None else ttl
+        expires = now + ttl if ttl else None
+        self._db.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+            (key, value, len(value), expires, now))
+        self._evict(now)
+
+    def delete(self, key):
+        self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def _evict(self, now):
+        db = self._db
+        db.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+        if self.max_entries:
+            db.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries '
+                'ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+        if self.max_bytes:
+            # Keep the most recently used entries that fit in max_bytes
+            db.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM ('
+                'SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS total '
+                'FROM entries) WHERE total > ?)', (self.max_bytes,))
+
+    def close(self):
+        self._db.close()
+
+
+def create_store(backend, path=None, max_entries=0, max_bytes=0, ttl=0):
+    """
+    Builds the store named in the config.
+
+    :backend: (str) memory or sqlite
+    :path: (str) database file for the sqlite backend
+
+    :returns: (MemoryStore or SqliteStore)
+    """
+    if backend == 'memory':
+        return MemoryStore(max_entries, max_bytes, ttl)
+    elif backend == 'sqlite':
+        return SqliteStore(path, max_entries, max_bytes, ttl)
+    raise ValueError(f'Unknown store backend "{backend}"')
@@ -0,0 +1,110 @@
+"""
+worker.py
+
+Runs the background download jobs of the web app in processes of their own.
+Each process pulls shards of the jobs queued in the jobs database, see
+jobs.py, so a large document is downloaded by all of them at once and adding
+processes, on this machine or on any machine that shares the database file,
+adds throughput.
+
+    python docsend_scraper_web/worker.py --processes 4
+
+The web app only needs to queue the jobs then, with workers = 0 in the [jobs]
+section of config.ini.
+"""
+import os
+import sys
+import signal
+import asyncio
+import argparse
+import multiprocessing
+from configparser import ConfigParser
+
+# Adding this so that there is no need to install either library, just have
+# them in the same folder.
+__root_location__ = os.path.realpath(os.path.dirname(__file__))
+sys.path.append(os.path.join(__root_location__, '..'))
+sys.path.append(__root_location__)
+
+import docsend_scraper  # noqa: E402
+from jobs import create_job_queue  # noqa: E402
+
+
+CONFIG = ConfigParser()
+CONFIG.read(os.path.join(__root_location__, 'config.ini'))
+
+
+async def serve(config, workers=None):
+    """
+    Runs jobs until the process gets SIGTERM or SIGINT.
+
+    :config: (configparser.SectionProxy) the [jobs] section of config.ini
+    :workers: (int) tasks run at the same time. Defaults to the config.
+    """
+    loop = asyncio.get_event_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    client = docsend_scraper.DocsendClient()
+    renderer = docsend_scraper.Renderer()
+    queue = create_job_queue(config, client, renderer, workers)
+    queue.start()
+    try:
+        await stopping.wait()
+    finally:
+        await queue.stop()
+        queue.close()
+        await client.close()
+        renderer.close()
+
+
+def run_process(jobs_db, jobs_dir, workers):
+    """
+    Target of the worker processes. Reads the config again, so it also works
+    where processes are spawned instead of forked.
+    """
+    if jobs_db is not None:
+        CONFIG['jobs']['path'] = jobs_db
+    if jobs_dir is not None:
+        CONFIG['jobs']['directory'] = jobs_dir
+    asyncio.run(serve(CONFIG['jobs'], workers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Runs the background download jobs of the web app.')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='worker processes to start')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='tasks each process runs at the same time. '
+                             'Defaults to the config.')
+    parser.add_argument('--jobs-db', default=None,
+                        help='jobs database. Defaults to the config.')
+    parser.add_argument('--jobs-dir', default=None,
+                        help='where the pdf files of the jobs are kept. '
+                             'Defaults to the config.')
+    args = parser.parse_args(argv)
+    workers = args.workers
+    if workers is None or workers < 1:
+        workers = max(1, CONFIG.getint('jobs', 'workers'))
+
+    processes = [multiprocessing.Process(target=run_process,
+                                         args=(args.jobs_db, args.jobs_dir,
+                                               workers))
+                 for _ in range(max(1, args.processes))]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import os
+
+from docsend_scraper import cache
+from docsend_scraper.cache import DiskLRU, PageCache
+
+
+def write_files(lru, count, size):
+    for n in range(count):
+        path = os.path.join(lru.directory, f'{n}.bin')
+        lru.write(path, b'x' * size)
+        # Oldest first, whatever the resolution of the file system clock
+        os.utime(path, (n, n))
+
+
+def test_eviction_goes_down_to_the_low_water_mark(tmp_path):
+    lru = DiskLRU(str(tmp_path), max_bytes=1000)
+    write_files(lru, 10, 100)
+    assert lru.size == 1000
+    lru.write(os.path.join(lru.directory, 'new.bin'), b'x' * 100)
+    assert lru.size == 900
+    assert sorted(os.listdir(str(tmp_path))) == \
+        [f'{n}.bin' for n in range(2, 10)] + ['new.bin']
+
+
+def test_full_cache_is_not_walked_on_every_write(tmp_path, monkeypatch):
+    lru = DiskLRU(str(tmp_path), max_bytes=1000)
+    write_files(lru, 11, 100)
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(cache.os, 'walk',
+                        lambda *args: walks.append(args) or walk(*args))
+    write_files(lru, 1, 50)
+    assert walks == []
+    assert lru.size == 950
+
+
+def test_page_cache_ignores_the_signature(tmp_path):
+    pages = PageCache(str(tmp_path))
+    pages.put('doc', 1, 'https://docsend.test/1.png?signature=a', b'page')
+    assert pages.get('doc', 1, 'https://docsend.test/1.png?signature=b') \
+        == b'page'
+    assert pages.get('doc', 2, 'https://docsend.test/1.png') is None
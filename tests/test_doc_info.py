@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from docsend_scraper.doc_info import DocumentInfoParser, parse_document_info
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                        'fixtures')
+CHUNK_SIZE = 4096
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, f'{name}.html'), 'r') as f:
+        return f.read()
+
+
+def feed_until_done(html):
+    """
+    :returns: (int, dict) characters fed when feed returned True, None if it
+                never did, and the fields found
+    """
+    parser = DocumentInfoParser(keep_html=False)
+    for start in range(0, len(html), CHUNK_SIZE):
+        if parser.feed(html[start:start + CHUNK_SIZE]):
+            return start + CHUNK_SIZE, parser.close()
+    return None, parser.close()
+
+
+def test_gated_document_stops_early():
+    html = read_fixture('passcode')
+    fed, fields = feed_until_done(html)
+    assert fed is not None and fed < len(html)
+    assert fields == parse_document_info(html)
+    assert fields['email_required'] and fields['passcode_required']
+
+
+@pytest.mark.parametrize('name', ['email', 'public'])
+def test_document_without_passcode_is_read_to_the_end(name):
+    html = read_fixture(name)
+    fed, fields = feed_until_done(html)
+    assert fed is None
+    assert fields == parse_document_info(html)
+    assert not fields['passcode_required']
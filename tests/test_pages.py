@@ -0,0 +1,61 @@
+"""
+test_pages.py
+
+Page selections, see doc_info.parse_page_range and scraper.select_pages.
+"""
+import pytest
+from docsend_scraper.doc_info import parse_page_range
+from docsend_scraper.scraper import select_pages
+
+
+@pytest.mark.parametrize('spec, page_count, expected', [
+    ('3', 5, [3]),
+    ('1-5,12', 20, [1, 2, 3, 4, 5, 12]),
+    ('2-', 5, [2, 3, 4, 5]),
+    ('4-4', 5, [4]),
+    # Ranges are cut at the last page
+    ('1-10', 3, [1, 2, 3]),
+    ('3,1,3', 5, [1, 3]),
+    ('2-4,3-5', 5, [2, 3, 4, 5]),
+    (' 1 - 2 , 4 ', 5, [1, 2, 4]),
+])
+def test_parse_page_range(spec, page_count, expected):
+    assert parse_page_range(spec, page_count) == expected
+
+
+@pytest.mark.parametrize('spec, page_count', [
+    ('5-3', 10),
+    ('-3', 10),
+    ('-', 10),
+    ('1,,2', 10),
+    ('', 10),
+    ('0', 10),
+    ('0-2', 10),
+    ('a', 10),
+    ('1-b', 10),
+    ('1.5', 10),
+    # Past the end of the document
+    ('6', 5),
+    ('6-', 5),
+    ('2,7-9', 5),
+])
+def test_parse_page_range_invalid(spec, page_count):
+    with pytest.raises(ValueError):
+        parse_page_range(spec, page_count)
+
+
+@pytest.mark.parametrize('pages, expected', [
+    (None, [1, 2, 3, 4, 5]),
+    ('2-3', [2, 3]),
+    ([5, 1, 5], [1, 5]),
+    (range(2, 4), [2, 3]),
+    ({4}, [4]),
+])
+def test_select_pages(pages, expected):
+    assert select_pages({'page_count': 5}, pages) == expected
+
+
+@pytest.mark.parametrize('pages', [[], [0], [6], [1, 6], '9'])
+def test_select_pages_invalid(pages):
+    with pytest.raises(ValueError):
+        select_pages({'page_count': 5}, pages)
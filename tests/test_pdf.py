@@ -0,0 +1,142 @@
+"""
+test_pdf.py
+
+PdfWriter output read back with pypdf, for every kind of page image the
+server can send.
+"""
+import io
+import re
+import pytest
+from PIL import Image
+from docsend_scraper import pdf
+from docsend_scraper.pdf import PdfWriter, encode_image
+
+pypdf = pytest.importorskip('pypdf')
+
+WIDTH, HEIGHT = 48, 32
+
+
+def make_image(mode):
+    """
+    :returns: (PIL.Image) a gradient, so a page that comes back with its rows
+                or colors mixed up does not match
+    """
+    img = Image.new('RGB', (WIDTH, HEIGHT))
+    img.putdata([(x * 5, y * 7, (x + y) * 3)
+                 for y in range(HEIGHT) for x in range(WIDTH)])
+    if mode == 'RGBA':
+        img.putalpha(200)
+    elif mode == 'I;16':
+        img = img.convert('L').convert('I')
+        img = img.point(lambda value: value * 256).convert('I;16')
+    elif mode != 'RGB':
+        img = img.convert(mode)
+    return img
+
+
+def save_image(img, format):
+    out = io.BytesIO()
+    img.save(out, format, **({'lossless': True} if format == 'WEBP' else {}))
+    return out.getvalue()
+
+
+def build_pdf(pages, title=None):
+    writer = PdfWriter(title)
+    return writer.header() + b''.join(writer.page(page) for page in pages) \
+        + writer.trailer()
+
+
+def read_pdf(data):
+    # strict, so a broken xref or trailer is an error, not a warning
+    return pypdf.PdfReader(io.BytesIO(data), strict=True)
+
+
+# (format, mode, color space, passed through as it came)
+IMAGES = [
+    ('JPEG', 'L', 'DeviceGray', True),
+    ('JPEG', 'RGB', 'DeviceRGB', True),
+    ('JPEG', 'CMYK', 'DeviceRGB', False),
+    ('PNG', 'L', 'DeviceGray', True),
+    ('PNG', 'RGB', 'DeviceRGB', True),
+    ('PNG', 'RGBA', 'DeviceRGB', False),
+    ('PNG', 'P', 'DeviceRGB', False),
+    ('PNG', 'I;16', 'DeviceGray', False),
+    ('WEBP', 'RGB', 'DeviceRGB', False),
+]
+
+
+@pytest.mark.parametrize('format, mode, color_space, passthrough', IMAGES)
+def test_image_is_encoded(format, mode, color_space, passthrough):
+    img_data = save_image(make_image(mode), format)
+    image = encode_image(img_data)
+    assert (image.width, image.height) == (WIDTH, HEIGHT)
+    assert image.color_space == color_space
+    assert image.bits == 8
+    # A JPEG passes through byte for byte and a PNG keeps its compressed
+    # image data. Only the others are decoded and compressed again.
+    if format == 'JPEG' and passthrough:
+        assert image.filter == 'DCTDecode' and image.data == img_data
+    elif passthrough:
+        assert image.filter == 'FlateDecode'
+        assert image.data in img_data and image.decode_parms is not None
+    else:
+        assert image.filter == 'FlateDecode' and image.decode_parms is None
+    header = pdf.read_jpeg(img_data) or pdf.read_png(img_data)
+    assert (header is not None) == passthrough
+
+
+@pytest.mark.parametrize('format, mode, color_space, passthrough', IMAGES)
+def test_page_reads_back(format, mode, color_space, passthrough):
+    original = make_image(mode)
+    reader = read_pdf(build_pdf([save_image(original, format)]))
+    page, = reader.pages
+    assert [float(value) for value in page.mediabox] == [0, 0, WIDTH, HEIGHT]
+    image, = page.images
+    decoded = image.image
+    assert decoded.size == (WIDTH, HEIGHT)
+    if format in ('PNG', 'WEBP'):
+        # Lossless, so the pixels come back as they were drawn
+        if mode == 'I;16':
+            expected = original.point(lambda value: value / 256).convert('L')
+        elif mode in ('L', 'RGB'):
+            expected = original
+        else:
+            expected = original.convert('RGB')
+        assert decoded.convert(expected.mode).tobytes() == expected.tobytes()
+
+
+def test_pages_keep_their_size_and_order():
+    sizes = [(40, 30), (30, 40), (64, 16)]
+    pages = [save_image(Image.new('RGB', size, (n * 80, 0, 0)), 'PNG')
+             for n, size in enumerate(sizes)]
+    reader = read_pdf(build_pdf(pages, title='Deck (v2) \\ final'))
+    assert [(float(page.mediabox.width), float(page.mediabox.height))
+            for page in reader.pages] == sizes
+    assert [page.images[0].image.getpixel((0, 0))[0]
+            for page in reader.pages] == [0, 80, 160]
+    assert reader.metadata.title == 'Deck (v2) \\ final'
+    assert reader.metadata.producer == 'docsend_scraper'
+
+
+def test_xref_and_trailer():
+    pages = [save_image(make_image('RGB'), 'JPEG'),
+             save_image(make_image('RGB'), 'WEBP')]
+    data = build_pdf(pages)
+    startxref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    assert data[startxref:].startswith(b'xref\n0 ')
+    size = int(re.search(rb'/Size (\d+)', data).group(1))
+    entries = re.findall(rb'(\d{10}) (\d{5}) ([fn]) \n', data[startxref:])
+    assert len(entries) == size
+    for obj_id, (offset, _, kind) in enumerate(entries[1:], 1):
+        assert kind == b'n'
+        assert data[int(offset):].startswith(b'%d 0 obj\n' % obj_id)
+    reader = read_pdf(data)
+    assert len(reader.pages) == 2
+    assert reader.trailer['/Root']['/Type'] == '/Catalog'
+
+
+def test_dumped_image_loads_back():
+    image = encode_image(save_image(make_image('RGB'), 'PNG'))
+    assert pdf.load_image(pdf.dump_image(image)) == image
+    image = encode_image(save_image(make_image('RGB'), 'WEBP'))
+    assert pdf.load_image(pdf.dump_image(image)) == image
@@ -0,0 +1,207 @@
+"""
+test_scheduler.py
+
+AdaptiveLimit and the Retry-After pauses of Scheduler. The scheduler's clock
+is replaced, so rounds and pauses do not depend on how fast the tests run.
+"""
+import asyncio
+import aiohttp
+import pytest
+from docsend_scraper import scheduler
+from docsend_scraper.scheduler import AdaptiveLimit, Scheduler
+
+
+class Clock:
+    """
+    Stands in for the time module of the scheduler.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    return clock
+
+
+def response_error(status, headers=None):
+    return aiohttp.ClientResponseError(None, (), status=status,
+                                       headers=headers or {})
+
+
+async def fail_in_slot(slots, status, headers=None):
+    with pytest.raises(aiohttp.ClientResponseError):
+        async with slots.slot('doc', 'http://docsend.test/page'):
+            raise response_error(status, headers)
+
+
+def test_throttled_response_halves_limit(clock):
+    limit = AdaptiveLimit(8)
+    slots = Scheduler(adaptive=limit)
+    asyncio.run(fail_in_slot(slots, 429))
+    assert limit.limit == 4
+    assert limit.in_flight == 0
+
+
+def test_server_error_halves_limit(clock):
+    limit = AdaptiveLimit(8)
+    slots = Scheduler(adaptive=limit)
+    asyncio.run(fail_in_slot(slots, 503))
+    assert limit.limit == 4
+
+
+def test_client_error_keeps_limit(clock):
+    limit = AdaptiveLimit(8)
+    slots = Scheduler(adaptive=limit)
+    asyncio.run(fail_in_slot(slots, 404))
+    assert limit.limit == 8
+
+
+def test_failures_of_one_round_decrease_once(clock):
+    limit = AdaptiveLimit(16)
+
+    async def fail(times):
+        for _ in range(times):
+            await limit.acquire()
+        for _ in range(times):
+            limit.release('throttled')
+
+    asyncio.run(fail(5))
+    assert limit.limit == 8
+    # Without a round latency yet, a round trip counts as a second
+    clock.now += 0.5
+    asyncio.run(fail(1))
+    assert limit.limit == 8
+    clock.now += 0.5
+    asyncio.run(fail(1))
+    assert limit.limit == 4
+
+
+def test_limit_does_not_go_under_min_limit(clock):
+    limit = AdaptiveLimit(4, min_limit=2)
+
+    async def fail():
+        await limit.acquire()
+        limit.release('throttled')
+
+    for _ in range(3):
+        asyncio.run(fail())
+        clock.now += 1
+    assert limit.limit == 2
+
+
+def test_limit_grows_by_one_per_round(clock):
+    limit = AdaptiveLimit(16)
+    limit.limit = 4.0
+
+    async def full_round():
+        for _ in range(4):
+            await limit.acquire()
+        # Each of the 4 responses of the round comes back while the limit
+        # is reached
+        for n in range(4):
+            limit.release(latency=0.1)
+            if n < 3:
+                await limit.acquire()
+        for _ in range(3):
+            limit.release(latency=0.1)
+
+    asyncio.run(full_round())
+    assert limit.limit == pytest.approx(5, abs=0.1)
+    assert limit.limit <= limit.max_limit
+
+
+def test_limit_does_not_grow_when_not_reached(clock):
+    limit = AdaptiveLimit(16)
+    limit.limit = 4.0
+
+    async def one_at_a_time():
+        for _ in range(20):
+            await limit.acquire()
+            limit.release(latency=0.1)
+
+    asyncio.run(one_at_a_time())
+    assert limit.limit == 4
+
+
+def test_limit_does_not_grow_past_max_limit(clock):
+    limit = AdaptiveLimit(2)
+
+    async def full_rounds():
+        for _ in range(2):
+            await limit.acquire()
+        for _ in range(10):
+            limit.release(latency=0.1)
+            await limit.acquire()
+
+    asyncio.run(full_rounds())
+    assert limit.limit == 2
+
+
+def test_cancelled_waiter_passes_slot_on(clock):
+    limit = AdaptiveLimit(1)
+
+    async def run():
+        await limit.acquire()
+        first = asyncio.ensure_future(limit.acquire())
+        second = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        assert limit.waiting == 2
+        # The room goes to the first waiter, which is cancelled before it
+        # gets to take it
+        limit.release(latency=0.1)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        assert first.cancelled()
+        assert limit.in_flight == 1
+        assert limit.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue(clock):
+    limit = AdaptiveLimit(1)
+
+    async def run():
+        await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limit.waiting == 0
+        limit.release(latency=0.1)
+        assert limit.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_retry_after_pauses_scheduler(clock):
+    slots = Scheduler(max_retry_after=120)
+    asyncio.run(fail_in_slot(slots, 429, {'Retry-After': '5'}))
+    assert slots.retry_after() == 5
+    assert slots.overloaded(0)
+    clock.now += 5
+    assert slots.retry_after() == 0
+    assert not slots.overloaded(0)
+
+
+def test_retry_after_is_capped(clock):
+    slots = Scheduler(max_retry_after=120)
+    asyncio.run(fail_in_slot(slots, 503, {'Retry-After': '3600'}))
+    assert slots.retry_after() == 120
+
+
+def test_retry_after_of_other_statuses_is_ignored(clock):
+    slots = Scheduler()
+    asyncio.run(fail_in_slot(slots, 404, {'Retry-After': '5'}))
+    assert slots.retry_after() == 0
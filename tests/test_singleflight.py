@@ -0,0 +1,147 @@
+"""
+test_singleflight.py
+
+SingleFlight calls and SharedStream readers: what every reader gets when the
+source succeeds, fails or is cancelled, and when the spool file goes away.
+"""
+import os
+import asyncio
+import pytest
+from docsend_scraper.singleflight import SharedStream, SingleFlight
+
+
+async def chunks(parts, delay=0, error=None):
+    for part in parts:
+        await asyncio.sleep(delay)
+        yield part
+    if error is not None:
+        raise error
+
+
+async def read_all(shared, chunk_size=3):
+    data = b''
+    async for chunk in shared.read(chunk_size):
+        data += chunk
+    return data
+
+
+def test_concurrent_readers_get_the_same_bytes(tmp_path):
+    parts = [b'first ', b'second ', b'third']
+
+    async def run():
+        shared = SharedStream(chunks(parts, 0.01), str(tmp_path))
+        first = asyncio.ensure_future(read_all(shared))
+        await asyncio.sleep(0.015)
+        # Joins after the first chunk, and still reads from the start
+        second = asyncio.ensure_future(read_all(shared, chunk_size=64))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(run()) == [b''.join(parts)] * 2
+
+
+def test_source_error_reaches_every_reader(tmp_path):
+    async def run():
+        shared = SharedStream(chunks([b'page'], 0.01, ValueError('broken')),
+                              str(tmp_path))
+        return await asyncio.gather(read_all(shared), read_all(shared),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError] * 2
+
+
+def test_cancelled_source_is_not_a_complete_output(tmp_path):
+    async def run():
+        shared = SharedStream(chunks([b'page'] * 100, 0.01), str(tmp_path))
+        readers = [asyncio.ensure_future(read_all(shared)) for _ in range(2)]
+        await asyncio.sleep(0.03)
+        shared.task.cancel()
+        return await asyncio.gather(*readers, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == \
+        [asyncio.CancelledError] * 2
+
+
+def test_spool_is_removed_after_the_last_reader(tmp_path):
+    async def run():
+        shared = SharedStream(chunks([b'a', b'b']), str(tmp_path))
+        reader = shared.read()
+        assert await reader.__anext__() == b'a'
+        await shared.task
+        # The source is done, but a reader is still on the spool
+        assert os.path.exists(shared.path)
+        async for _ in reader:
+            pass
+        return shared.path
+
+    path = asyncio.run(run())
+    assert not os.path.exists(path)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_do_runs_once_for_concurrent_callers():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'info'
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do('doc', fetch)
+                                         for _ in range(3)))
+        return results, flights.in_flight()
+
+    assert asyncio.run(run()) == (['info'] * 3, 0)
+    assert len(calls) == 1
+
+
+def test_do_shares_the_error():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('broken')
+
+    async def run():
+        flights = SingleFlight()
+        return await asyncio.gather(flights.do('doc', fail),
+                                    flights.do('doc', fail),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError] * 2
+
+
+def test_cancelled_caller_of_do_does_not_cancel_the_others():
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return 'info'
+
+    async def run():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do('doc', fetch))
+        second = asyncio.ensure_future(flights.do('doc', fetch))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == 'info'
+
+
+def test_stream_is_shared_while_running(tmp_path):
+    async def run():
+        flights = SingleFlight(str(tmp_path))
+        first = flights.stream('doc', lambda: chunks([b'a'], 0.01))
+        second = flights.stream('doc', lambda: chunks([b'b'], 0.01))
+        assert first is second
+        assert await read_all(first) == b'a'
+        await first.task
+        # A finished stream is not reused
+        third = flights.stream('doc', lambda: chunks([b'c']))
+        assert third is not first
+        return await read_all(third)
+
+    assert asyncio.run(run()) == b'c'
@@ -0,0 +1,63 @@
+"""
+test_sinks.py
+
+ZipWriter output read back with zipfile.
+"""
+import io
+import zlib
+import zipfile
+import pytest
+from docsend_scraper import sinks
+from docsend_scraper.sinks import ZipWriter
+
+PAGES = {
+    '001.jpg': b'\xff\xd8\xff' + bytes(range(256)) * 40,
+    '002.png': b'\x89PNG\r\n\x1a\n' + b'\x00' * 5000,
+    '003.bin': b'',
+    'pages/ünïcode.webp': b'RIFF\x00\x00\x00\x00WEBP' + b'\x07' * 17,
+}
+
+
+def build_zip(pages, timestamp=None):
+    writer = ZipWriter(timestamp)
+    data = b''.join(writer.add(name, content)
+                    for name, content in pages.items())
+    return data + writer.close()
+
+
+def test_zip_reads_back():
+    data = build_zip(PAGES)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(PAGES)
+        for info in archive.infolist():
+            content = PAGES[info.filename]
+            assert info.CRC == zlib.crc32(content)
+            assert info.file_size == info.compress_size == len(content)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert archive.read(info) == content
+
+
+def test_zip_entries_keep_timestamp():
+    # Two seconds precision, and the year is kept past 1980
+    timestamp = 1700000000
+    data = build_zip({'001.jpg': b'page'}, timestamp)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        info = archive.getinfo('001.jpg')
+    assert info.date_time[0] == 2023
+    assert info.external_attr >> 16 == 0o100644
+
+
+def test_empty_zip():
+    with zipfile.ZipFile(io.BytesIO(build_zip({}))) as archive:
+        assert archive.namelist() == []
+
+
+def test_zip_over_4_gib_fails_before_the_entry_is_written():
+    writer = ZipWriter()
+    writer.add('001.jpg', b'page')
+    # As if the pages written so far were just under 4 GiB
+    writer.offset = sinks.ZIP_MAX_SIZE - 10
+    with pytest.raises(ValueError):
+        writer.add('002.jpg', b'x' * 100)
+    assert len(writer.entries) == 1
@@ -0,0 +1,29 @@
+import os
+import asyncio
+
+import pytest
+
+from docsend_scraper.spill import SpillBuffer, parse_size
+
+
+@pytest.mark.parametrize('size, expected', [
+    ('512', 512), ('64K', 64 * 1024), ('256m', 256 * 1024 ** 2),
+    ('1.5G', int(1.5 * 1024 ** 3)), ('8MB', 8 * 1024 ** 2)])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def test_pages_past_the_budget_are_spilled_and_read_back(tmp_path):
+    buffer = SpillBuffer(10, str(tmp_path))
+
+    async def run():
+        await asyncio.gather(*(buffer.put(page, bytes([page]) * 6)
+                               for page in range(1, 4)))
+        assert buffer.spilled == 2 and buffer.memory_bytes == 6
+        assert len(os.listdir(str(tmp_path))) == 1
+        return [await buffer.pop(page) for page in range(1, 4)]
+
+    assert asyncio.run(run()) == [bytes([page]) * 6 for page in range(1, 4)]
+    assert buffer.memory_bytes == 0
+    buffer.close()
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,59 @@
+import os
+
+from docsend_scraper.spool import PageSpool
+
+URL = 'https://docsend.test/pages/1.png?signature=a'
+
+
+def test_page_is_found_by_its_url_without_the_signature(tmp_path):
+    spool = PageSpool(str(tmp_path), 'doc', 3)
+    spool.put(1, URL, b'page')
+    assert spool.get(1, 'https://docsend.test/pages/1.png?signature=b') \
+        == b'page'
+    assert spool.completed() == {1}
+
+
+def test_revised_page_is_not_found(tmp_path):
+    spool = PageSpool(str(tmp_path), 'doc', 3)
+    spool.put(1, URL, b'page')
+    assert spool.get(1, 'https://docsend.test/pages/1-v2.png') is None
+    assert spool.get(2, URL) is None
+
+
+def test_clear_waits_for_the_last_download(tmp_path):
+    first = PageSpool(str(tmp_path), 'doc', 3)
+    second = PageSpool(str(tmp_path), 'doc', 3)
+    first.put(1, URL, b'page')
+    first.clear()
+    assert second.get(1, URL) == b'page'
+    second.put(2, URL, b'page')
+    second.clear()
+    assert not os.path.exists(first.path)
+
+
+def test_closed_spool_is_resumed(tmp_path):
+    spool = PageSpool(str(tmp_path), 'doc', 3)
+    spool.put(1, URL, b'page')
+    spool.close()
+    spool = PageSpool(str(tmp_path), 'doc', 3)
+    assert spool.get(1, URL) == b'page'
+    spool.clear()
+
+
+def test_page_count_change_resets_the_spool(tmp_path):
+    spool = PageSpool(str(tmp_path), 'doc', 3)
+    spool.put(1, URL, b'page')
+    spool.close()
+    spool = PageSpool(str(tmp_path), 'doc', 4)
+    assert spool.get(1, URL) is None
+    spool.clear()
+
+
+def test_open_spool_is_not_reset(tmp_path):
+    first = PageSpool(str(tmp_path), 'doc', 3)
+    first.put(1, URL, b'page')
+    second = PageSpool(str(tmp_path), 'doc', 4)
+    assert first.get(1, URL) == b'page'
+    second.clear()
+    first.clear()
+    assert not os.path.exists(first.path)